@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Base project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from anyblok.blok import Blok
+from anyblok_wms_base import version
+
+
+def import_declarations(reload=None):
+    from . import physobj
+    from . import operation
+
+    if reload is not None:
+        reload(physobj)
+        reload(operation)
+
+
+class WmsContainerClosure(Blok):
+    """Materialized closure of the containing hierarchy.
+
+    With this Blok installed, recursive quantity queries don't issue
+    a recursive CTE anymore, but rely on a closure table, which is
+    maintained by the Operations as they affect containers.
+
+    This is meant for applications with a deep and large containing
+    hierarchy, for which the recursive CTE has become a performance problem.
+    """
+    version = version
+    author = "Georges Racinet"
+    required = ['wms-core']
+
+    def update(self, latest_version):
+        if latest_version is None:
+            self.registry.Wms.PhysObj.ContainerClosure.refresh_all()
+
+    @classmethod
+    def import_declaration_module(cls):
+        import_declarations()
+
+    @classmethod
+    def reload_declaration_module(cls, reload):
+        import_declarations(reload=reload)
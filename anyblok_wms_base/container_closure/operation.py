@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Base project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import itertools
+
+from sqlalchemy import select
+
+from anyblok import Declarations
+
+register = Declarations.register
+Wms = Declarations.Model.Wms
+
+
+@register(Wms)
+class Operation:
+    """Override to maintain the closure of the containing hierarchy.
+
+    This is done at the level of the main public methods, so that it
+    applies uniformly to all Operation classes (Arrival, Move, Teleportation,
+    Departure, Unpack, Assembly etc.), including those that downstream
+    libraries and applications define. For cancel and oblivion, this is
+    done for each batch of removed Operations, and :meth:`bulk_create`
+    and :meth:`bulk_execute` recompute once for all created or executed
+    Operations.
+
+    Operations that don't involve any container don't incur anything else
+    than checking the Types of their inputs and outcomes.
+    """
+
+    def container_closure_objs(self):
+        """Return the ids of containers among inputs and outcomes.
+
+        :rtype: set
+        """
+        return set(av.obj_id
+                   for av in itertools.chain(self.inputs, self.outcomes)
+                   if av.obj.is_container())
+
+    def recompute_container_closure(self, before=()):
+        """Recompute the closure for containers affected by ``self``.
+
+        :param before: ids of containers and their descendants, as
+                       collected before the changes, typically because
+                       these changes are deletions.
+        """
+        Closure = self.registry.Wms.PhysObj.ContainerClosure
+        ids = Closure.subtree_ids(self.container_closure_objs())
+        ids.update(before)
+        Closure.recompute(ids)
+
+    @classmethod
+    def create(cls, **kwargs):
+        op = super(Operation, cls).create(**kwargs)
+        op.recompute_container_closure()
+        return op
+
+    @classmethod
+    def bulk_create(cls, specs):
+        """Override to recompute the closure once for the whole batch."""
+        operations = super(Operation, cls).bulk_create(specs)
+        Closure = cls.registry.Wms.PhysObj.ContainerClosure
+        Closure.recompute(Closure.subtree_ids(cls.container_closure_objs_batch(
+            [op.id for op in operations])))
+        return operations
+
+    def execute(self, dt_execution=None):
+        super(Operation, self).execute(dt_execution=dt_execution)
+        self.recompute_container_closure()
+
+    @classmethod
+    def bulk_execute(cls, operations, dt_execution):
+        """Override to recompute the closure once for the whole batch."""
+        failures = super(Operation, cls).bulk_execute(operations,
+                                                      dt_execution)
+        Closure = cls.registry.Wms.PhysObj.ContainerClosure
+        Closure.recompute(Closure.subtree_ids(cls.container_closure_objs_batch(
+            [op.id for op in operations if op.id not in failures])))
+        return failures
+
+    @classmethod
+    def container_closure_objs_batch(cls, op_ids):
+        """Set-based version of :meth:`container_closure_objs`.
+
+        :param op_ids: ids of Operations
+        :rtype: set
+        """
+        affected = cls.affected_avatars(op_ids)
+        PhysObj = cls.registry.Wms.PhysObj
+        physobj = PhysObj.__table__
+        by_type = {}
+        for obj_id, type_id in cls.registry.execute(
+                select([affected.c.obj_id, physobj.c.type_id]).where(
+                    physobj.c.id == affected.c.obj_id).distinct()):
+            by_type.setdefault(type_id, set()).add(obj_id)
+        res = set()
+        for gt in PhysObj.Type.query().filter(
+                PhysObj.Type.id.in_(list(by_type))).all():
+            if gt.is_container():
+                res.update(by_type[gt.id])
+        return res
+
+    @classmethod
+    def single_batch(cls, operations, meth_name, **kwargs):
+        """Override to recompute the closure after cancel or oblivion.
+
+        This is where :meth:`cancel` and :meth:`obliviate` actually remove
+        Operations, followers included, by batches.
+        """
+        Closure = cls.registry.Wms.PhysObj.ContainerClosure
+        before = Closure.subtree_ids(cls.container_closure_objs_batch(
+            [op.id for op in operations]))
+        super(Operation, cls).single_batch(operations, meth_name, **kwargs)
+        Closure.recompute(before)
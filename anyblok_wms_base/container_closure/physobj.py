@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Base project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from sqlalchemy import orm
+from sqlalchemy import and_
+from sqlalchemy import or_
+from sqlalchemy import not_
+from sqlalchemy import func
+from sqlalchemy import literal
+from sqlalchemy import union_all
+
+from anyblok import Declarations
+from anyblok.column import Boolean
+from anyblok.column import Integer
+from anyblok.column import DateTime
+from anyblok.relationship import Many2One
+
+from anyblok_wms_base.constants import DATE_TIME_INFINITY
+
+register = Declarations.register
+Model = Declarations.Model
+
+
+@register(Model.Wms.PhysObj)
+class ContainerClosure:
+    """Materialized transitive closure of the containing relation.
+
+    Each record stands for a chain of Avatars through which
+    :attr:`descendant` is (has been, will be) inside :attr:`ancestor`,
+    :attr:`depth` levels below it.
+
+    Since containing is a matter of Avatars, it depends on their date/time
+    ranges and states: :attr:`dt_from` and :attr:`dt_until` are the
+    intersection of the date/time ranges of the Avatars of the chain,
+    while :attr:`with_past` and :attr:`with_future` tell whether one of
+    them is in the ``past`` or ``future`` state.
+
+    Only containers are considered as descendants, that's enough for
+    quantity queries, which are all about the locations of Avatars.
+
+    The records are not meant to be created directly:
+    the closure is maintained
+    by :meth:`recompute`, which all Operations call after having
+    affected containers (see :class:`Operation
+    <anyblok_wms_base.container_closure.operation.Operation>`).
+    """
+
+    id = Integer(label="Identifier", primary_key=True)
+    """Primary key.
+
+    There can be several records for the same pair of :attr:`ancestor` and
+    :attr:`descendant`, for instance if the latter has been moved back
+    and forth.
+    """
+
+    ancestor = Many2One(model=Model.Wms.PhysObj,
+                        index=True,
+                        nullable=False,
+                        foreign_key_options={'ondelete': 'cascade'})
+    """The containing PhysObj."""
+
+    descendant = Many2One(model=Model.Wms.PhysObj,
+                          index=True,
+                          nullable=False,
+                          foreign_key_options={'ondelete': 'cascade'})
+    """The contained PhysObj (always a container itself)."""
+
+    depth = Integer(nullable=False)
+    """Number of Avatars in the chain (1 for direct containment)."""
+
+    dt_from = DateTime(nullable=False)
+    """Start of the validity of the chain, inclusively."""
+
+    dt_until = DateTime()
+    """End of the validity of the chain, exclusively (``None`` for +infinity).
+
+    For chains whose Avatars are all in the ``present`` state, this can be
+    smaller than :attr:`dt_from`. That's on purpose, as those chains
+    must be taken into account by quantity queries that don't involve
+    date and time.
+    """
+
+    with_past = Boolean(nullable=False, default=False)
+    """``True`` if an Avatar of the chain is in the ``past`` state."""
+
+    with_future = Boolean(nullable=False, default=False)
+    """``True`` if an Avatar of the chain is in the ``future`` state."""
+
+    @classmethod
+    def chains_cte(cls, seed_filter):
+        """Recursive CTE producing all upward chains of Avatars.
+
+        :param seed_filter: SQL criterion on
+                            :class:`Wms.PhysObj.Avatar
+                            <anyblok_wms_base.core.physobj.main.Avatar>`
+                            restricting the starting points of the chains.
+
+        The columns are the same as those of the present model, except
+        :attr:`id`, and with the ``_id`` suffix for Many2One fields.
+
+        Chains whose date/time range has become empty are pruned as soon as
+        possible, unless all of their Avatars are ``present``.
+        """
+        Avatar = cls.registry.Wms.PhysObj.Avatar
+        query = cls.registry.session.query
+        seed = query(Avatar.obj_id.label('descendant_id'),
+                     Avatar.location_id.label('ancestor_id'),
+                     literal(1).label('depth'),
+                     Avatar.dt_from.label('dt_from'),
+                     Avatar.dt_until.label('dt_until'),
+                     (Avatar.state == 'past').label('with_past'),
+                     (Avatar.state == 'future').label('with_future'),
+                     ).filter(seed_filter)
+
+        chains = seed.cte(name='chains', recursive=True)
+        parent = orm.aliased(Avatar, name='parent_avatar')
+        # LEAST() and GREATEST() ignore NULL, which for dt_until is
+        # exactly the intended +infinity semantics
+        tail = query(chains.c.descendant_id,
+                     parent.location_id,
+                     chains.c.depth + 1,
+                     func.greatest(chains.c.dt_from, parent.dt_from),
+                     func.least(chains.c.dt_until, parent.dt_until),
+                     or_(chains.c.with_past, parent.state == 'past'),
+                     or_(chains.c.with_future, parent.state == 'future'),
+                     ).filter(
+                         parent.obj_id == chains.c.ancestor_id,
+                         or_(and_(not_(chains.c.with_past),
+                                  not_(chains.c.with_future),
+                                  parent.state == 'present'),
+                             and_(or_(chains.c.dt_until.is_(None),
+                                      parent.dt_from < chains.c.dt_until),
+                                  or_(parent.dt_until.is_(None),
+                                      parent.dt_until > chains.c.dt_from))))
+        return chains.union_all(tail)
+
+    CHAINS_COLUMNS = ('descendant_id', 'ancestor_id', 'depth',
+                      'dt_from', 'dt_until', 'with_past', 'with_future')
+
+    @classmethod
+    def insert_chains(cls, seed_filter):
+        """Insert all chains from :meth:`chains_cte` in one SQL statement."""
+        chains = cls.chains_cte(seed_filter)
+        select = cls.registry.session.query(
+            *(getattr(chains.c, col) for col in cls.CHAINS_COLUMNS))
+        cls.registry.execute(cls.__table__.insert().from_select(
+            cls.CHAINS_COLUMNS, select.statement))
+
+    @classmethod
+    def subtree_ids(cls, container_ids):
+        """Return the given ids, together with those of all descendants.
+
+        All records are taken into account, whatever their states and
+        date/time ranges.
+
+        :rtype: set
+        """
+        res = set(container_ids)
+        if not res:
+            return res
+        res.update(r[0] for r in cls.query(cls.descendant_id).filter(
+            cls.ancestor_id.in_(res)).distinct().all())
+        return res
+
+    @classmethod
+    def recompute(cls, descendant_ids):
+        """Recompute all records having the given descendants.
+
+        :param descendant_ids: ids of containers whose Avatars changed,
+                               together with all their descendants
+                               (see :meth:`subtree_ids`). The caller has to
+                               provide them, because in case of deletions,
+                               they have to be computed before hand.
+
+        This is done with a ``DELETE`` and an ``INSERT … SELECT``, hence
+        costs do not depend on the size of the whole containing hierarchy,
+        but only on the part of it that is below or above the given
+        containers.
+        """
+        if not descendant_ids:
+            return
+        cls.registry.flush()
+        cls.query().filter(cls.descendant_id.in_(descendant_ids)).delete(
+            synchronize_session=False)
+        Avatar = cls.registry.Wms.PhysObj.Avatar
+        cls.insert_chains(Avatar.obj_id.in_(descendant_ids))
+
+    @classmethod
+    def refresh_all(cls):
+        """Rebuild the whole closure from scratch.
+
+        This is done at installation, and can also be useful for data
+        imports that bypass Operations.
+        """
+        PhysObj = cls.registry.Wms.PhysObj
+        Avatar = PhysObj.Avatar
+        cls.registry.flush()
+        cls.query().delete(synchronize_session=False)
+        container_type_ids = [gt.id for gt in PhysObj.Type.query().all()
+                              if gt.is_container()]
+        if not container_type_ids:
+            return
+        cls.insert_chains(Avatar.obj_id.in_(
+            PhysObj.query(PhysObj.id).filter(
+                PhysObj.type_id.in_(container_type_ids)).subquery()))
+
+
+@register(Model.Wms)
+class PhysObj:
+    """Override to use the closure in :meth:`flatten_containers_subquery`
+    and :meth:`flatten_containers_tops_subquery`.
+    """
+
+    @classmethod
+    def flatten_containers_subquery(cls, top=None,
+                                    additional_states=None, at_datetime=None):
+        """Read the :class:`ContainerClosure` rather than recursing.
+
+        The result is a plain subquery, with an ``id`` column, as in the
+        base implementation.
+
+        This falls back to the base implementation if ``top`` is not
+        specified.
+        """
+        if top is None:
+            return super(PhysObj, cls).flatten_containers_subquery(
+                top=top,
+                additional_states=additional_states,
+                at_datetime=at_datetime)
+
+        Closure = cls.ContainerClosure
+        query = cls.registry.session.query
+        below = cls._closure_filter(
+            query(Closure.descendant_id.label('id')).filter(
+                Closure.ancestor_id == top.id),
+            additional_states=additional_states,
+            at_datetime=at_datetime)
+        return union_all(below.statement,
+                         query(literal(top.id).label('id')).statement
+                         ).alias(name='container')
+
+    @classmethod
+    def flatten_containers_tops_subquery(cls, tops,
+                                         additional_states=None,
+                                         at_datetime=None):
+        """Read the :class:`ContainerClosure` rather than recursing."""
+        Closure = cls.ContainerClosure
+        query = cls.registry.session.query
+        top_ids = set(top.id for top in tops)
+        below = cls._closure_filter(
+            query(Closure.ancestor_id.label('top_id'),
+                  Closure.descendant_id.label('id')).filter(
+                      Closure.ancestor_id.in_(top_ids)),
+            additional_states=additional_states,
+            at_datetime=at_datetime)
+        return union_all(below.statement,
+                         query(cls.id.label('top_id'), cls.id).filter(
+                             cls.id.in_(top_ids)).statement
+                         ).alias(name='container')
+
+    @classmethod
+    def _closure_filter(cls, query, additional_states=None, at_datetime=None):
+        """Restrict closure records according to states and date/time."""
+        Closure = cls.ContainerClosure
+        if additional_states is None or 'past' not in additional_states:
+            query = query.filter(Closure.with_past.is_(False))
+        if additional_states is None or 'future' not in additional_states:
+            query = query.filter(Closure.with_future.is_(False))
+
+        if at_datetime is DATE_TIME_INFINITY:
+            query = query.filter(Closure.dt_until.is_(None))
+        elif at_datetime is not None:
+            query = query.filter(Closure.dt_from <= at_datetime,
+                                 or_(Closure.dt_until.is_(None),
+                                     Closure.dt_until > at_datetime))
+        return query
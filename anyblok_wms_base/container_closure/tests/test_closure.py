@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Base project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from anyblok_wms_base.constants import DATE_TIME_INFINITY
+from anyblok_wms_base.testing import WmsTestCase
+
+
+class TestContainerClosure(WmsTestCase):
+
+    def setUp(self):
+        super(TestContainerClosure, self).setUp()
+        self.Avatar = self.PhysObj.Avatar
+        self.Closure = self.PhysObj.ContainerClosure
+        self.physobj_type = self.PhysObj.Type.insert(label="My goods",
+                                                     code='MyGT')
+        self.stock = self.insert_location('STK')
+        self.sub = self.insert_location('STK/SUB', parent=self.stock)
+        self.subsub = self.insert_location('STK/SUB/SUB', parent=self.sub)
+        self.other = self.insert_location('OTHER')
+        # locations inserted directly, bypassing Operations
+        self.Closure.refresh_all()
+
+        self.arrival = self.Operation.Arrival.create(
+            goods_type=self.physobj_type,
+            location=self.subsub,
+            dt_execution=self.dt_test1,
+            state='done')
+        self.default_quantity_location = self.stock
+
+    def closure_pairs(self, **filters):
+        return set((c.ancestor, c.descendant, c.depth)
+                   for c in self.Closure.query().filter_by(**filters).all())
+
+    def test_refresh_all(self):
+        self.assertEqual(self.closure_pairs(),
+                         {(self.stock, self.sub, 1),
+                          (self.sub, self.subsub, 1),
+                          (self.stock, self.subsub, 2),
+                          })
+        self.assertEqual(self.closure_pairs(with_past=True), set())
+        self.assertEqual(self.closure_pairs(with_future=True), set())
+
+    def test_goods_operations_untouched(self):
+        """Operations not involving containers don't affect the closure."""
+        before = set(c.id for c in self.Closure.query().all())
+        self.Operation.Move.create(input=self.arrival.outcomes[0],
+                                   destination=self.other,
+                                   dt_execution=self.dt_test2,
+                                   state='planned')
+        self.assertEqual(set(c.id for c in self.Closure.query().all()),
+                         before)
+
+    def test_planned_move_execute(self):
+        sub_av = self.Avatar.query().filter_by(obj=self.sub).one()
+        move = self.Operation.Move.create(input=sub_av,
+                                          destination=self.other,
+                                          dt_execution=self.dt_test2,
+                                          state='planned')
+        self.assertEqual(self.closure_pairs(with_future=True),
+                         {(self.other, self.sub, 1),
+                          (self.other, self.subsub, 2),
+                          })
+        # present chains are unchanged
+        self.assertEqual(self.closure_pairs(with_future=False),
+                         {(self.stock, self.sub, 1),
+                          (self.sub, self.subsub, 1),
+                          (self.stock, self.subsub, 2),
+                          })
+
+        self.assert_quantity(1)
+        self.assert_quantity(0, location=self.other)
+        for dt in (self.dt_test2, self.dt_test3, DATE_TIME_INFINITY):
+            self.assert_quantity(0, at_datetime=dt,
+                                 additional_states=['future'])
+            self.assert_quantity(1, at_datetime=dt,
+                                 additional_states=['future'],
+                                 location=self.other)
+
+        move.execute(dt_execution=self.dt_test2)
+        self.assertEqual(self.closure_pairs(with_future=True), set())
+        self.assertEqual(self.closure_pairs(with_past=True),
+                         {(self.stock, self.sub, 1),
+                          (self.stock, self.subsub, 2),
+                          })
+        self.assert_quantity(0)
+        self.assert_quantity(1, location=self.other)
+        self.assert_quantity(1, at_datetime=self.dt_test1,
+                             additional_states=['past'])
+        self.assert_quantity(0, at_datetime=self.dt_test1,
+                             additional_states=['past'],
+                             location=self.other)
+        self.assert_quantity(0, at_datetime=self.dt_test3,
+                             additional_states=['past'])
+
+        move.obliviate()
+        self.assertEqual(self.closure_pairs(),
+                         {(self.stock, self.sub, 1),
+                          (self.sub, self.subsub, 1),
+                          (self.stock, self.subsub, 2),
+                          })
+
+    def test_planned_move_cancel(self):
+        sub_av = self.Avatar.query().filter_by(obj=self.sub).one()
+        move = self.Operation.Move.create(input=sub_av,
+                                          destination=self.other,
+                                          dt_execution=self.dt_test2,
+                                          state='planned')
+        move.cancel()
+        self.assertEqual(self.closure_pairs(),
+                         {(self.stock, self.sub, 1),
+                          (self.sub, self.subsub, 1),
+                          (self.stock, self.subsub, 2),
+                          })
+        self.assert_quantity(1)
+        self.assert_quantity(1, at_datetime=DATE_TIME_INFINITY,
+                             additional_states=['future'])
+
+    def test_container_arrival_departure(self):
+        """Containers created and removed by Operations."""
+        box_type = self.PhysObj.Type.insert(code='BOX',
+                                            behaviours=dict(container={}))
+        arrival = self.Operation.Arrival.create(goods_type=box_type,
+                                                location=self.sub,
+                                                dt_execution=self.dt_test2,
+                                                state='planned')
+        box = arrival.outcomes[0].obj
+        self.assertEqual(self.closure_pairs(descendant=box),
+                         {(self.sub, box, 1),
+                          (self.stock, box, 2)})
+        self.assertEqual(self.closure_pairs(descendant=box,
+                                            with_future=False),
+                         set())
+
+        arrival.execute(dt_execution=self.dt_test2)
+        self.Operation.Arrival.create(goods_type=self.physobj_type,
+                                      location=box,
+                                      dt_execution=self.dt_test2,
+                                      state='done')
+        self.assert_quantity(2)
+        self.assert_quantity(1, location=box)
+
+        dep = self.Operation.Departure.create(input=arrival.outcomes[0],
+                                              dt_execution=self.dt_test3,
+                                              state='done')
+        self.assertEqual(self.closure_pairs(descendant=box,
+                                            with_past=False),
+                         set())
+        self.assert_quantity(1)
+        self.assert_quantity(2, at_datetime=self.dt_test2,
+                             additional_states=['past'])
+
+        dep.obliviate()
+        self.assert_quantity(2)
+        self.assertEqual(self.closure_pairs(descendant=box),
+                         {(self.sub, box, 1),
+                          (self.stock, box, 2)})
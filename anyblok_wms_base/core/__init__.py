@@ -30,6 +30,11 @@ class WmsCore(Blok):
     version = version
     author = "Georges Racinet"
 
+    def update(self, latest_version):
+        if latest_version is not None:
+            # existing Properties records get the default share count
+            self.registry.Wms.PhysObj.Properties.refresh_share_counts()
+
     def pre_migration(self, latest_version):  # pragma: no cover
         if latest_version is None:
             return
@@ -121,3 +121,22 @@ class Apparition(Operation):
                 reason=self,
                 state='present',
                 dt_from=self.dt_execution)
+
+    @classmethod
+    def after_insert_batch(cls, operations):
+        """Set-based version of :meth:`after_insert`."""
+        Properties = cls.registry.Wms.PhysObj.Properties
+        rows = []
+        for op in operations:
+            op_props = op.goods_properties
+            props = (None if op_props is None
+                     else Properties.create(**op_props))
+            rows.extend(dict(type_id=op.goods_type_id,
+                             properties=props,
+                             code=op.goods_code,
+                             location_id=op.location_id,
+                             reason_id=op.id,
+                             state='present',
+                             dt_from=op.dt_execution)
+                        for _ in range(op.quantity))
+        cls.insert_objs_batch(rows)
@@ -110,7 +110,31 @@ class Arrival(Operation):
             dt_from=self.dt_execution,
         )
 
+    @classmethod
+    def after_insert_batch(cls, operations):
+        """Set-based version of :meth:`after_insert`."""
+        Properties = cls.registry.Wms.PhysObj.Properties
+        rows = []
+        for op in operations:
+            op_props = op.goods_properties
+            rows.append(dict(
+                type_id=op.goods_type_id,
+                properties=(None if op_props is None
+                            else Properties.create(**op_props)),
+                code=op.goods_code,
+                location_id=op.location_id,
+                reason_id=op.id,
+                state='present' if op.state == 'done' else 'future',
+                dt_from=op.dt_execution))
+        cls.insert_objs_batch(rows)
+
     def execute_planned(self):
         Avatar = self.registry.Wms.PhysObj.Avatar
         Avatar.query().filter(Avatar.reason == self).one().update(
             state='present', dt_from=self.dt_execution)
+
+    @classmethod
+    def execute_planned_batch(cls, op_ids, dt_execution):
+        """Set-based version of :meth:`execute_planned`."""
+        cls.update_outcomes_batch(op_ids, state='present',
+                                  dt_from=dt_execution)
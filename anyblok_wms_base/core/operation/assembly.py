@@ -394,7 +394,6 @@ class Assembly(Operation):
         spec = self.specification
 
         PhysObjType = self.registry.Wms.PhysObj.Type
-        types_by_code = dict()
         from_state = None if for_creation else self.state
 
         match = self.match = []
@@ -415,11 +414,7 @@ class Assembly(Operation):
             expected_id = expected.get('id')
             expected_code = expected.get('code')
 
-            gtype = types_by_code.get(type_code)
-            if gtype is None:
-                gtype = PhysObjType.query().filter_by(
-                    code=type_code).one()
-                types_by_code[type_code] = gtype
+            gtype = PhysObjType.get_by_code(type_code)
             for _ in range(expected['quantity']):
                 for candidate in inputs:
                     goods = candidate.obj
@@ -903,8 +898,7 @@ class Assembly(Operation):
         :return: ``True`` iff a match has been performed
         """
         spec = self.specification.get('inputs_spec_type')
-        if spec is None:
-            spec = {}
+        spec = {} if spec is None else dict(spec)
         spec.setdefault('planned', 'match')
 
         cm = merge_state_parameter(spec,
@@ -8,8 +8,19 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 
 import logging
+import itertools
+from collections import OrderedDict
 from datetime import datetime
 
+from sqlalchemy import case
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import literal
+from sqlalchemy import or_
+from sqlalchemy import select
+from sqlalchemy import union
+from sqlalchemy import orm
+
 from anyblok import Declarations
 from anyblok.column import String
 from anyblok.column import Selection
@@ -35,6 +46,18 @@ Wms = Declarations.Model.Wms
 NONZERO = NonZero()
 
 
+def mapped_relationship(model, name):
+    """Return the SQLAlchemy relationship attribute for a Many2One field.
+
+    AnyBlok maps relationships under other names than the fields, we need
+    the actual mapped attributes, e.g., for eager loading options.
+    """
+    column = model.__table__.c[name + '_id']
+    for rel in orm.class_mapper(model).relationships:
+        if column in rel.local_columns:
+            return rel.class_attribute
+
+
 @Declarations.register(Wms.Operation)
 class HistoryInput:
     """Internal Model linking Operations with their inputs and together.
@@ -75,6 +98,28 @@ class HistoryInput:
     This is needed for :ref:`cancel and oblivion <op_cancel_revert_obliviate>`
     """
 
+    def history_operation_ids(self):
+        """Ids of the Operations whose history involves this record.
+
+        These are those of :attr:`operation` and :attr:`latest_previous_op`,
+        including the values they had before pending changes, i.e., the
+        Operations whose :attr:`inputs <Operation.inputs>`,
+        :attr:`follows <Operation.follows>` or :attr:`followers
+        <Operation.followers>` a flush of this record may change.
+        """
+        HI = self.registry.Wms.Operation.HistoryInput
+        mapper = orm.class_mapper(HI)
+        for name in ('operation', 'latest_previous_op'):
+            rel = mapped_relationship(HI, name)
+            history = orm.attributes.get_history(
+                self, rel.key, passive=orm.attributes.PASSIVE_NO_INITIALIZE)
+            for op in history.sum():
+                if op is not None:
+                    yield op.id
+            col = mapper.get_property_by_column(HI.__table__.c[name + '_id'])
+            for op_id in orm.attributes.get_history(self, col.key).sum():
+                yield op_id
+
 
 @register(Wms)
 class Operation:
@@ -134,10 +179,83 @@ class Operation:
               be simply removed.
     """
 
+    history_generation = 0
+    """Incremented by :meth:`bump_history_generation`, invalidating all
+    cached :attr:`inputs`, :attr:`follows` and :attr:`followers`."""
+
     def query_history_input(self):
         HI = self.registry.Wms.Operation.HistoryInput
         return HI.query().filter(HI.operation == self)
 
+    def history_cache(self):
+        """Return the cache of :attr:`inputs`, :attr:`follows` and
+        :attr:`followers`, emptied if :attr:`history_generation` changed.
+
+        :rtype: dict
+        """
+        memo = getattr(self, '_history_memo', None)
+        if memo is None or memo[0] != self.history_generation:
+            memo = self._history_memo = (self.history_generation, {})
+        return memo[1]
+
+    def invalidate_history_cache(self, *args):
+        """Discard the cached :attr:`inputs`, :attr:`follows` and
+        :attr:`followers`.
+
+        Extra arguments are ignored, so that this can be used directly
+        as an instance event listener.
+        """
+        self._history_memo = None
+
+    @classmethod
+    def invalidate_history_caches(cls, op_ids, session=None):
+        """Discard the history caches of the Operations with given ids.
+
+        :param op_ids: ids of the Operations whose :attr:`inputs`,
+                       :attr:`follows` or :attr:`followers` may have
+                       changed. ``None`` values are ignored.
+        :param session: by default, the current one. Only the Operations
+                        that are in its identity map have a cache to
+                        invalidate.
+        """
+        Wms = cls.registry.Wms
+        for op in Wms.loaded_records(Wms.Operation, op_ids, session=session):
+            op.invalidate_history_cache()
+
+    @classmethod
+    def bump_history_generation(cls):
+        """Invalidate the history caches of all Operations.
+
+        This is meant for set-based statements on :class:`HistoryInput`
+        that can't tell which Operations they affect and don't expire
+        the session. Otherwise, :meth:`invalidate_history_caches` is
+        preferable.
+        """
+        cls.registry.Wms.Operation.history_generation += 1
+
+    def load_history_input(self):
+        """Fill the cache with :attr:`inputs` and :attr:`follows`.
+
+        The query on :class:`HistoryInput` is the same as without the
+        cache, hence the order of :attr:`inputs` is unchanged: in practice,
+        that's the order in which :meth:`link_inputs` got them, which
+        matters for :attr:`input <.single_input.WmsSingleInputOperation.input>`
+        and for subclasses using the first input as a template.
+        The Avatars and the previous Operations are loaded with one more
+        query each, whatever the number of inputs.
+        """
+        cache = self.history_cache()
+        HI = self.registry.Wms.Operation.HistoryInput
+        # not joinedload(), so that the query plan, hence the order
+        # of results, doesn't change
+        his = self.query_history_input().options(
+            orm.subqueryload(mapped_relationship(HI, 'avatar')),
+            orm.subqueryload(mapped_relationship(HI, 'latest_previous_op')),
+        ).all()
+        cache['inputs'] = [hi.avatar for hi in his]
+        cache['follows'] = [hi.latest_previous_op for hi in his]
+        return cache
+
     @property
     def inputs(self):
         """The Avatars records the Operation is working on.
@@ -145,8 +263,13 @@ class Operation:
         This is a read-only pseudo field, initialized by :meth:`create()`.
         The backing data is actually stored in
         :class:`Model.Wms.Operation.HistoryInput <HistoryInput>`.
+
+        The result is cached, see :meth:`history_cache`.
         """
-        return [hi.avatar for hi in self.query_history_input().all()]
+        inputs = self.history_cache().get('inputs')
+        if inputs is None:
+            inputs = self.load_history_input()['inputs']
+        return list(inputs)
 
     @property
     def follows(self):
@@ -173,9 +296,13 @@ class Operation:
         This is a read-only pseudo field, initialized by :meth:`create()`,
         The backing data is actually stored in
         :class:`Model.Wms.Operation.HistoryInput <HistoryInput>`.
+
+        The result is cached, see :meth:`history_cache`.
         """
-        return [hi.latest_previous_op
-                for hi in self.query_history_input().all()]
+        follows = self.history_cache().get('follows')
+        if follows is None:
+            follows = self.load_history_input()['follows']
+        return list(follows)
 
     @property
     def followers(self):
@@ -190,11 +317,19 @@ class Operation:
         This is a read-only pseudo field, initialized by :meth:`create()`,
         The backing data is actually stored in
         :class:`Model.Wms.Operation.HistoryInput <HistoryInput>`.
+
+        The result is cached, see :meth:`history_cache`.
         """
-        HI = self.registry.Wms.Operation.HistoryInput
-        return [hi.operation
-                for hi in HI.query().filter(
-                        HI.latest_previous_op == self).all()]
+        cache = self.history_cache()
+        followers = cache.get('followers')
+        if followers is None:
+            HI = self.registry.Wms.Operation.HistoryInput
+            query = HI.query().filter(HI.latest_previous_op == self).options(
+                orm.joinedload(mapped_relationship(HI, 'operation')))
+            followers = cache['followers'] = [
+                hi.operation
+                for hi in query.order_by(HI.operation_id).all()]
+        return list(followers)
 
     dt_execution = DateTime(label="date and time of execution",
                             nullable=False)
@@ -253,6 +388,59 @@ class Operation:
     In particular, purely creative subclasses must set this to 0
     """
 
+    @classmethod
+    def initialize_model(cls):
+        """Set up the invalidation of the history caches.
+
+        See :meth:`history_cache`.
+        """
+        super(Operation, cls).initialize_model()
+        if cls.__registry_name__ != 'Model.Wms.Operation':
+            return
+        event.listen(cls.registry.session, 'before_flush',
+                     cls._history_before_flush)
+        # expiration happens, e.g., at commit, rollback, and after
+        # set-based statements, such as in cancel_batch()
+        event.listen(cls, 'expire', cls.invalidate_history_cache,
+                     propagate=True)
+        event.listen(cls, 'refresh', cls.invalidate_history_cache,
+                     propagate=True)
+
+    @classmethod
+    def _history_before_flush(cls, session, flush_context, instances):
+        """Invalidate the history caches that the flush will make stale.
+
+        These are those of the Operations of the new, updated or deleted
+        :class:`HistoryInput` records, and of their
+        :attr:`HistoryInput.latest_previous_op`. Creating Operations
+        or Avatars has no effect on existing history, whereas deleting
+        them removes :class:`HistoryInput` records in cascade: their
+        Operations are found with one query.
+        """
+        Wms = cls.registry.Wms
+        HI = Wms.Operation.HistoryInput
+        op_ids = set()
+        for obj in itertools.chain(session.new, session.dirty,
+                                   session.deleted):
+            if isinstance(obj, HI):
+                op_ids.update(obj.history_operation_ids())
+
+        deleted_ops = [obj.id for obj in session.deleted
+                       if isinstance(obj, Wms.Operation)]
+        deleted_avatars = [obj.id for obj in session.deleted
+                           if isinstance(obj, Wms.PhysObj.Avatar)]
+        if deleted_ops or deleted_avatars:
+            hi = HI.__table__
+            query = select([hi.c.operation_id,
+                            hi.c.latest_previous_op_id]).where(or_(
+                                hi.c.operation_id.in_(deleted_ops),
+                                hi.c.latest_previous_op_id.in_(deleted_ops),
+                                hi.c.avatar_id.in_(deleted_avatars)))
+            for row in session.execute(query):
+                op_ids.update(row)
+        if op_ids:
+            cls.invalidate_history_caches(op_ids, session=session)
+
     @classmethod
     def define_mapper_args(cls):
         mapper_args = super(Operation, cls).define_mapper_args()
@@ -277,15 +465,48 @@ class Operation:
     __str__ = __repr__
 
     def link_inputs(self, inputs=None, clear=False, **fields):
+        """Record ``inputs`` as inputs of the current Operation.
+
+        :param inputs: Avatars whose current :attr:`reason
+                       <anyblok_wms_base.core.physobj.Avatar.reason>` and
+                       :attr:`dt_until
+                       <anyblok_wms_base.core.physobj.Avatar.dt_until>`
+                       get saved in :class:`HistoryInput`.
+        :param bool clear: if ``True``, the previously linked inputs
+                           are removed first.
+
+        This issues a single ``INSERT ... SELECT`` statement, copying the
+        values from the Avatars in the database, in the order of
+        ``inputs``, and a single ``DELETE`` if ``clear`` is ``True``.
+
+        The history caches of the current Operation and of the previous
+        ones are invalidated (see :meth:`invalidate_history_caches`).
+        """
+        self.registry.flush()
         HI = self.registry.Wms.Operation.HistoryInput
+        hi = HI.__table__
+        affected = [self.id]
         if clear:
-            HI.query().filter(HI.operation == self).delete(
-                synchronize_session='fetch')
-        for avatar in inputs:
-            HI.insert(avatar=avatar,
-                      operation=self,
-                      latest_previous_op=avatar.reason,
-                      orig_dt_until=avatar.dt_until)
+            affected.extend(row[0] for row in self.registry.execute(
+                select([hi.c.latest_previous_op_id]).where(
+                    hi.c.operation_id == self.id)))
+            HI.query().filter(HI.operation_id == self.id).delete(
+                synchronize_session='evaluate')
+        avatar_ids = [avatar.id for avatar in inputs]
+        if avatar_ids:
+            avatar = self.registry.Wms.PhysObj.Avatar.__table__
+            position = case({av_id: i for i, av_id in enumerate(avatar_ids)},
+                            value=avatar.c.id)
+            affected.extend(row[0] for row in self.registry.execute(
+                hi.insert().from_select(
+                    ['operation_id', 'avatar_id', 'latest_previous_op_id',
+                     'orig_dt_until'],
+                    select([literal(self.id), avatar.c.id, avatar.c.reason_id,
+                            avatar.c.dt_until]).where(
+                                avatar.c.id.in_(avatar_ids)).order_by(
+                                    position)).returning(
+                                        hi.c.latest_previous_op_id)))
+        self.invalidate_history_caches(affected)
 
     @classmethod
     def create(cls, state='planned', inputs=None,
@@ -330,16 +551,7 @@ class Operation:
         (yes, the same could be achieved by forcing to use the Model class
         methods instead).
         """
-        if dt_execution is None:
-            if state == 'done':
-                dt_execution = datetime.now()
-            else:
-                raise OperationError(
-                    cls,
-                    "Creation in state {state!r} requires the "
-                    "'dt_execution' field (date and time when "
-                    "it's supposed to be done).",
-                    state=state)
+        dt_execution = cls.default_dt_execution(state, dt_execution)
         cls.check_create_conditions(
             state, dt_execution, inputs=inputs, **fields)
         inputs, fields_upd = cls.before_insert(state=state,
@@ -353,12 +565,352 @@ class Operation:
         if inputs is not None:  # happens with creative Operations
             op.link_inputs(inputs)
         op.after_insert()
+        op.invalidate_quantity_cache()
         return op
 
     @classmethod
     def before_insert(cls, inputs=None, **fields):
         return inputs, None
 
+    @classmethod
+    def default_dt_execution(cls, state, dt_execution):
+        """Return ``dt_execution``, with the default :meth:`create` applies.
+
+        :raises: OperationError if ``dt_execution`` is ``None``, unless
+                 ``state`` is ``'done'``, in which case the current date
+                 and time are returned.
+        """
+        if dt_execution is not None:
+            return dt_execution
+        if state == 'done':
+            return datetime.now()
+        raise OperationError(
+            cls,
+            "Creation in state {state!r} requires the "
+            "'dt_execution' field (date and time when "
+            "it's supposed to be done).",
+            state=state)
+
+    @classmethod
+    def create_batch(cls, specs):
+        """Create several Operations of the current class.
+
+        :param specs: iterable of :class:`dict` instances, each being the
+                      keyword arguments :meth:`create` would take for one
+                      of the Operations.
+        :return: the list of created Operations, in the order of ``specs``.
+
+        If the current class supports it (see :meth:`has_bulk_create`),
+        this is done by :meth:`bulk_create`, with a number of queries
+        that doesn't depend on the number of Operations.
+        Otherwise, :meth:`create` is simply called for each item of
+        ``specs``.
+        """
+        specs = list(specs)
+        if not specs:
+            return []
+        if not cls.has_bulk_create():
+            with cls.registry.Wms.defer_quantity_cache_invalidation():
+                return [cls.create(**spec) for spec in specs]
+        return cls.bulk_create(specs)
+
+    @classmethod
+    def has_bulk_create(cls):
+        """Tell if :meth:`bulk_create` can be used for the current class.
+
+        This is the case if the class implements :meth:`after_insert_batch`
+        and keeps the :meth:`after_insert` that goes with it, while
+        :meth:`before_insert` and :meth:`link_inputs` have their default
+        implementations. Hence, overrides of these methods in other Bloks,
+        such as those making Moves :class:`Splitter Operations
+        <anyblok_wms_base.quantity.operation.splitter.WmsSplitterOperation>`
+        make :meth:`create_batch` fall back to :meth:`create`.
+
+        Bloks overriding :meth:`create` should override :meth:`bulk_create`
+        as well.
+        """
+        def owner(name):
+            return next(klass for klass in cls.__mro__ if name in vars(klass))
+
+        batch_owner = owner('after_insert_batch')
+        # comparing with the class declared in this module, as in
+        # has_default_single()
+        return (batch_owner is not Operation and
+                owner('after_insert') is batch_owner and
+                all(owner(name) is Operation
+                    for name in ('before_insert', 'link_inputs')))
+
+    @classmethod
+    def bulk_create(cls, specs):
+        """Set-based implementation of :meth:`create_batch`.
+
+        :meth:`check_create_conditions` is called for all ``specs`` before
+        anything gets written. This validation is still done Operation per
+        Operation, because subclasses and other Bloks override
+        :meth:`check_create_conditions`, but without any query as long as
+        the inputs are loaded: those that aren't are loaded beforehand,
+        with a single query.
+
+        Then the Operations are inserted by :meth:`insert_batch`, their
+        inputs linked by :meth:`link_inputs_batch` and the specific logic
+        is applied by :meth:`after_insert_batch`, all of these issuing
+        multi-row statements. Afterwards, the inputs and their PhysObj
+        are expired, being the only loaded records that these statements
+        may change, apart from the Properties (see
+        :meth:`insert_objs_batch`). The new Operations are loaded after
+        their insertion, and not changed afterwards.
+
+        :raises: OperationInputsError if an Avatar is an input of several
+                 Operations of the batch.
+        """
+        specs = list(specs)
+        cls.registry.flush()
+        Avatar = cls.registry.Wms.PhysObj.Avatar
+        states = (orm.attributes.instance_state(avatar)
+                  for spec in specs for avatar in spec.get('inputs') or ())
+        expired = [state.identity[0] for state in states
+                   if state.has_identity and state.expired_attributes]
+        if expired:
+            Avatar.query().filter(Avatar.id.in_(expired)).all()
+
+        rows, all_inputs = [], []
+        seen = set()
+        for spec in specs:
+            fields = dict(spec)
+            state = fields.pop('state', 'planned')
+            dt_execution = cls.default_dt_execution(
+                state, fields.pop('dt_execution', None))
+            inputs = fields.pop('inputs', None)
+            cls.check_create_conditions(
+                state, dt_execution, inputs=inputs, **fields)
+            for avatar in inputs or ():
+                if avatar.id in seen:
+                    raise OperationInputsError(
+                        cls,
+                        "Avatar {avatar} can't be an input of several "
+                        "Operations of the same batch", avatar=avatar,
+                        inputs=inputs)
+                seen.add(avatar.id)
+            fields.update(state=state, dt_execution=dt_execution)
+            rows.append(fields)
+            all_inputs.append(inputs or ())
+
+        ids = cls.insert_batch(rows)
+        cls.link_inputs_batch(zip(ids, all_inputs))
+        by_id = {op.id: op for op in cls.query().filter(
+            cls.id.in_(ids)).all()}
+        operations = [by_id[op_id] for op_id in ids]
+        cls.after_insert_batch(operations)
+        cls.expire_inputs_batch(all_inputs)
+        cls.registry.Wms.invalidate_quantity_cache(
+            cls.quantity_cache_changes_batch(ids))
+        return operations
+
+    @classmethod
+    def expire_inputs_batch(cls, all_inputs):
+        """Expire the inputs of a batch and their PhysObj.
+
+        :param all_inputs: iterable of iterables of Avatars, such as the
+                           inputs of each Operation of the batch.
+
+        This is what :meth:`bulk_create` expires after the set-based
+        statements of :meth:`after_insert_batch`, leaving the other
+        loaded records untouched. The PhysObj are looked up in the
+        session only, without triggering any query.
+        """
+        Wms = cls.registry.Wms
+        session = cls.registry.session
+        avatars = list(itertools.chain.from_iterable(all_inputs))
+        obj_ids = [avatar.obj_id for avatar in avatars]
+        for avatar in avatars:
+            session.expire(avatar)
+        for obj in Wms.loaded_records(Wms.PhysObj, obj_ids):
+            session.expire(obj)
+
+    @classmethod
+    def insert_batch(cls, rows):
+        """Insert several Operations of the current class, without any logic.
+
+        This is the set-based analog of :meth:`insert`, issuing a
+        multi-row ``INSERT`` statement for each table of the class.
+
+        :param rows: list of :class:`dict` of field values. As with
+                     :meth:`insert`, Many2One fields are given as records.
+        :return: the ids of the new Operations, in the order of ``rows``
+        """
+        mapper = cls.__mapper__
+        base_table = cls.registry.Wms.Operation.__table__
+        ids = cls.next_ids(base_table, len(rows))
+        tables = [base_table]
+        tables.extend(t for t in mapper.tables if t is not base_table)
+        by_table = {table: [] for table in tables}
+        for op_id, fields in zip(ids, rows):
+            values = {table: dict(id=op_id) for table in tables}
+            values[base_table]['type'] = cls.TYPE
+            for name, value in fields.items():
+                if name in mapper.relationships:
+                    rel = mapper.relationships[name]
+                    for local, remote in rel.local_remote_pairs:
+                        values[local.table][local.name] = (
+                            None if value is None
+                            else getattr(value, remote.key))
+                else:
+                    column = mapper.columns[name]
+                    values[column.table][column.name] = value
+            for table in tables:
+                by_table[table].append(values[table])
+        for table in tables:
+            cls.insert_rows(table, by_table[table])
+        return ids
+
+    @classmethod
+    def insert_rows(cls, table, rows):
+        """Insert ``rows`` in ``table`` with multi-row ``INSERT`` statements.
+
+        :param rows: list of :class:`dict` of column values. Those having
+                     the same keys are inserted together.
+        """
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        for group in groups.values():
+            cls.registry.execute(table.insert().values(group))
+
+    @classmethod
+    def next_ids(cls, table, count):
+        """Reserve ``count`` values of the sequence of the ``id`` of ``table``.
+
+        This allows to insert records, then related ones, with multi-row
+        statements.
+
+        :return: list of ids
+        """
+        seq = func.pg_get_serial_sequence(table.name, 'id')
+        query = select([func.nextval(seq)]).select_from(
+            func.generate_series(1, count))
+        return [row[0] for row in cls.registry.execute(query)]
+
+    @classmethod
+    def link_inputs_batch(cls, op_inputs):
+        """Set-based version of :meth:`link_inputs`, for new Operations.
+
+        :param op_inputs: iterable of pairs (Operation id, inputs)
+        """
+        HI = cls.registry.Wms.Operation.HistoryInput.__table__
+        rows = [dict(operation_id=op_id,
+                     avatar_id=avatar.id,
+                     latest_previous_op_id=avatar.reason_id,
+                     orig_dt_until=avatar.dt_until)
+                for op_id, inputs in op_inputs
+                for avatar in inputs]
+        cls.invalidate_history_caches(
+            itertools.chain.from_iterable(
+                (row['operation_id'], row['latest_previous_op_id'])
+                for row in rows))
+        cls.insert_rows(HI, rows)
+
+    @classmethod
+    def insert_avatars_from_inputs_batch(cls, op_ids, location, state):
+        """Create a new Avatar for each input of the given Operations.
+
+        :param location: SQL expression for the location of the new Avatars,
+                         typically a column of the table of the current
+                         class.
+        :param state: SQL expression for the state of the new Avatars.
+
+        The new Avatars have the same PhysObj and :attr:`dt_until`
+        as the inputs, the Operation as :attr:`reason` and its
+        :attr:`dt_execution` as :attr:`dt_from`. This is done with a single
+        ``INSERT`` statement.
+        """
+        Wms = cls.registry.Wms
+        op = Wms.Operation.__table__
+        HI = Wms.Operation.HistoryInput.__table__
+        avatar = Wms.PhysObj.Avatar.__table__
+        query = select([location, op.c.id, state, op.c.dt_execution,
+                        avatar.c.dt_until, avatar.c.obj_id]).where(
+                            op.c.id == cls.__table__.c.id).where(
+                                HI.c.operation_id == op.c.id).where(
+                                    avatar.c.id == HI.c.avatar_id).where(
+                                        op.c.id.in_(op_ids))
+        cls.registry.execute(avatar.insert().from_select(
+            ['location_id', 'reason_id', 'state', 'dt_from', 'dt_until',
+             'obj_id'], query))
+
+    @classmethod
+    def update_inputs_batch(cls, op_ids, **values):
+        """Update the inputs of the given Operations in a single statement.
+
+        :param values: new values of the columns of the Avatar table, as
+                       SQL expressions that can involve the columns of
+                       the Operation and Avatar tables.
+        """
+        Wms = cls.registry.Wms
+        op = Wms.Operation.__table__
+        HI = Wms.Operation.HistoryInput.__table__
+        avatar = Wms.PhysObj.Avatar.__table__
+        cls.registry.execute(avatar.update().where(
+            avatar.c.id == HI.c.avatar_id).where(
+                HI.c.operation_id == op.c.id).where(
+                    op.c.id.in_(op_ids)).values(**values))
+
+    @classmethod
+    def update_outcomes_batch(cls, op_ids, **values):
+        """Update the outcomes of the given Operations in a single statement.
+
+        :param values: new values of the columns of the Avatar table.
+        """
+        avatar = cls.registry.Wms.PhysObj.Avatar.__table__
+        cls.registry.execute(avatar.update().where(
+            avatar.c.reason_id.in_(op_ids)).where(
+                avatar.c.state != 'past').values(**values))
+
+    @classmethod
+    def insert_objs_batch(cls, rows):
+        """Insert PhysObj records together with their initial Avatars.
+
+        :param rows: list of :class:`dict`. The ``type_id``, ``code`` and
+                     ``properties`` (a record or ``None``) keys are for
+                     the PhysObj, the other ones for its Avatar.
+
+        This issues a multi-row ``INSERT`` statement for each table, then
+        updates the :attr:`share_count
+        <anyblok_wms_base.core.physobj.main.Properties.share_count>` of
+        the Properties.
+        """
+        cls.registry.flush()
+        PhysObj = cls.registry.Wms.PhysObj
+        physobj = PhysObj.__table__
+        objs, avatars, props_ids = [], [], set()
+        for obj_id, row in zip(cls.next_ids(physobj, len(rows)), rows):
+            avatar = dict(row, obj_id=obj_id)
+            props = avatar.pop('properties')
+            props_id = None if props is None else props.id
+            objs.append(dict(id=obj_id,
+                             type_id=avatar.pop('type_id'),
+                             code=avatar.pop('code'),
+                             properties_id=props_id))
+            avatars.append(avatar)
+            if props_id is not None:
+                props_ids.add(props_id)
+        cls.insert_rows(physobj, objs)
+        cls.insert_rows(PhysObj.Avatar.__table__, avatars)
+        if props_ids:
+            PhysObj.Properties.refresh_share_counts(ids=props_ids)
+
+    @classmethod
+    def after_insert_batch(cls, operations):
+        """Set-based version of :meth:`after_insert`, for :meth:`bulk_create`.
+
+        :param operations: the new Operations, whose inputs are linked.
+
+        To be implemented in subclasses, together with :meth:`after_insert`.
+        Implementations should issue set-based statements, as the ones
+        :meth:`insert_avatars_from_inputs_batch`,
+        :meth:`update_inputs_batch` and :meth:`insert_objs_batch` do.
+        """
+        raise NotImplementedError  # pragma: no cover
+
     def execute(self, dt_execution=None):
         """Execute the operation.
 
@@ -381,32 +933,367 @@ class Operation:
         self.check_execute_conditions()
         self.execute_planned()
         self.state = 'done'
+        self.invalidate_quantity_cache()
+
+    @classmethod
+    def execute_batch(cls, operations, dt_execution=None):
+        """Execute several Operations, reporting failures instead of raising.
+
+        :param operations: iterable of Operations, or query for them.
+                           Those that are already done are ignored.
+        :param datetime dt_execution: the time at which execution happens
+                                      for all ``operations``. If omitted,
+                                      it defaults to the current date and
+                                      time.
+        :return: :class:`dict` of the exceptions (instances of
+                 :class:`OperationError`) that prevented execution, by
+                 Operation id. The other Operations are done.
+
+        Operations are executed by class, with :meth:`bulk_execute` for
+        those that support it (see :meth:`has_bulk_execute`) and
+        :meth:`execute`, in a savepoint, for the other ones.
+
+        Operations whose inputs aren't present yet are tried again if
+        others have been executed in the meanwhile, so that, e.g., a
+        planned Move can be executed in the same batch as the Arrival
+        of its input.
+        """
+        if dt_execution is None:
+            dt_execution = datetime.now()
+        if hasattr(operations, 'all'):
+            operations = operations.all()
+        failures = {}
+        pending = [op for op in operations if op.state != 'done']
+        while pending:
+            failed = cls.execute_by_class(pending, dt_execution)
+            for op in pending:
+                failures.pop(op.id, None)
+            failures.update(failed)
+            retry = [op for op in pending
+                     if isinstance(failed.get(op.id),
+                                   OperationInputWrongState)]
+            if len(retry) == len(pending):
+                break
+            pending = retry
+        if failures:
+            logger.info("execute_batch: %d Operations could not be executed",
+                        len(failures))
+        return failures
+
+    @classmethod
+    def execute_by_class(cls, operations, dt_execution):
+        """Single pass of :meth:`execute_batch`.
+
+        :return: :class:`dict` of exceptions, by Operation id
+        """
+        by_class = {}
+        for op in operations:
+            by_class.setdefault(op.__class__, []).append(op)
+        failures = {}
+        for op_cls, ops in by_class.items():
+            if op_cls.has_bulk_execute():
+                failures.update(op_cls.bulk_execute(ops, dt_execution))
+                continue
+            with cls.registry.Wms.defer_quantity_cache_invalidation():
+                for op in ops:
+                    try:
+                        with cls.registry.begin_nested():
+                            op.execute(dt_execution=dt_execution)
+                    except OperationError as exc:
+                        failures[op.id] = exc
+        return failures
+
+    @classmethod
+    def has_bulk_execute(cls):
+        """Tell if :meth:`bulk_execute` can be used for the current class.
+
+        This is the case if the class implements
+        :meth:`execute_planned_batch` and keeps the :meth:`execute_planned`
+        that goes with it, while :meth:`check_execute_conditions` has
+        its default implementation.
+
+        As with :meth:`has_bulk_create`, Bloks overriding :meth:`execute`
+        should override :meth:`bulk_execute` as well.
+        """
+        def owner(name):
+            return next(klass for klass in cls.__mro__ if name in vars(klass))
+
+        batch_owner = owner('execute_planned_batch')
+        return (batch_owner is not Operation and
+                owner('execute_planned') is batch_owner and
+                owner('check_execute_conditions') is Operation)
+
+    @classmethod
+    def bulk_execute(cls, operations, dt_execution):
+        """Set-based execution of several Operations of the current class.
+
+        :param operations: Operations of the current class, not done yet.
+        :param datetime dt_execution: the time at which execution happens
+        :return: :class:`dict` of exceptions, by Operation id, for those
+                 that don't meet :meth:`check_execute_conditions_batch`.
+
+        The other Operations are updated, then executed by
+        :meth:`execute_planned_batch`, using a few ``UPDATE`` statements in
+        total. The ORM session is expired afterwards.
+        """
+        cls.registry.flush()
+        failures = cls.check_execute_conditions_batch(
+            [op.id for op in operations])
+        op_ids = [op.id for op in operations if op.id not in failures]
+        if not op_ids:
+            return failures
+
+        op = cls.registry.Wms.Operation.__table__
+        cls.registry.execute(op.update().where(op.c.id.in_(op_ids)).values(
+            dt_execution=dt_execution,
+            dt_start=func.coalesce(op.c.dt_start, dt_execution)))
+        cls.execute_planned_batch(op_ids, dt_execution)
+        cls.registry.execute(op.update().where(op.c.id.in_(op_ids)).values(
+            state='done'))
+        cls.registry.session.expire_all()
+        cls.registry.Wms.invalidate_quantity_cache(
+            cls.quantity_cache_changes_batch(op_ids))
+        return failures
+
+    @classmethod
+    def check_execute_conditions_batch(cls, op_ids):
+        """Set-based version of :meth:`check_execute_conditions`.
+
+        :return: :class:`dict` of exceptions, by Operation id
+
+        In this default implementation, we check with a single query
+        that all the :attr:`inputs` are in the ``present`` state.
+        """
+        if not cls.inputs_number or not op_ids:
+            return {}
+        Avatar = cls.registry.Wms.PhysObj.Avatar
+        HI = cls.registry.Wms.Operation.HistoryInput.__table__
+        avatar = Avatar.__table__
+        wrong = dict(cls.registry.execute(
+            select([HI.c.operation_id, HI.c.avatar_id]).where(
+                avatar.c.id == HI.c.avatar_id).where(
+                    avatar.c.state != 'present').where(
+                        HI.c.operation_id.in_(op_ids))).fetchall())
+        if not wrong:
+            return {}
+        ops = cls.query().filter(cls.id.in_(list(wrong))).all()
+        avatars = {av.id: av for av in Avatar.query().filter(
+            Avatar.id.in_(list(wrong.values()))).all()}
+        return {op.id: OperationInputWrongState(
+            op, avatars[wrong[op.id]], 'present',
+            prelude="Can't execute {operation}") for op in ops}
+
+    @classmethod
+    def execute_planned_batch(cls, op_ids, dt_execution):
+        """Set-based version of :meth:`execute_planned`.
+
+        :param op_ids: ids of Operations of the current class, whose
+                       :attr:`dt_execution` is already set.
+
+        To be implemented in subclasses, together with
+        :meth:`execute_planned`, typically with
+        :meth:`update_inputs_batch` and :meth:`update_outcomes_batch`.
+        """
+        raise NotImplementedError  # pragma: no cover
 
     def cancel(self):
         """Cancel a planned operation and all its consequences.
 
-        This method will recursively cancel all follow-ups of ``self``, before
+        This method will cancel all follow-ups of ``self``, before
         cancelling ``self`` itself.
 
-        The implementation is for now a simple recursion, and hence can
-        lead to :class:`RecursionError` on huge graphs.
-        TODO rewrite using an accumulation logic rather than recursion.
+        This is :meth:`cancel_several` applied to ``self`` alone.
         """
-        if self.state != 'planned':
-            raise OperationError(
-                self,
-                "Can't cancel {op} because its state {op.state!r} is not "
-                "'planned'", op=self)
-        logger.debug("Cancelling operation %r", self)
-
-        # followers attribute value will mutate during the loop
-        followers = tuple(self.followers)
-        for follower in followers:
-            follower.cancel()
-        self.cancel_single()
-        self.follows.clear()
-        self.delete()
-        logger.info("Cancelled operation %r", self)
+        self.cancel_several((self, ))
+
+    @classmethod
+    def cancel_several(cls, operations):
+        """Cancel several planned Operations and all their consequences.
+
+        The whole downstream graph is first collected by
+        :meth:`collect_downstream_levels`, then cancelled level by level
+        with :meth:`cancel_batch`, hence without recursion.
+
+        Bloks that need to react on cancellations should override this
+        rather than :meth:`cancel`.
+        """
+        cls.remove_downstream(operations, 'planned', 'cancel')
+
+    @classmethod
+    def remove_downstream(cls, operations, state, action):
+        """Common implementation of :meth:`cancel_several` and
+        :meth:`obliviate_several`.
+
+        :param str state: the state all involved Operations must be in.
+        :param str action: ``'cancel'`` or ``'obliviate'``, used to pick the
+                           batch method (e.g, :meth:`cancel_batch`) and in
+                           error messages.
+        :raises: OperationError if some Operation is not in ``state``.
+        """
+        def check_state(op):
+            if op.state != state:
+                raise OperationError(
+                    op,
+                    "Can't {action} {op} because its state {op.state!r} "
+                    "is not {state!r}", op=op, action=action, state=state)
+
+        for op in operations:
+            check_state(op)
+        logger.debug("Starting to %s operations %r", action, operations)
+
+        levels = cls.collect_downstream_levels(operations)
+        for level in levels:
+            for op in level:
+                check_state(op)
+        # before removal, while inputs and outcomes are still there
+        cache_changes = cls.quantity_cache_changes_batch(
+            [op.id for level in levels for op in level])
+        batch = getattr(cls, action + '_batch')
+        for level in levels:
+            batch(level)
+        cls.registry.Wms.invalidate_quantity_cache(cache_changes)
+        logger.info("Done %s of operations %r, and of %d other ones",
+                    action, operations,
+                    sum(len(level) for level in levels) - len(operations))
+
+    def downstream_levels(self):
+        """Collect ``self`` and all Operations that follow it.
+
+        This is :meth:`collect_downstream_levels` applied to ``self``
+        alone, hence the last level is ``[self]``.
+        """
+        return self.collect_downstream_levels((self, ))
+
+    @classmethod
+    def collect_downstream_levels(cls, operations):
+        """Collect Operations and all those that follow them.
+
+        :return: list of lists of Operations. Each Operation is in the level
+                 right after that of its last follower, the first level
+                 being made of the Operations that have no followers.
+                 Hence the Operations of a given level don't follow each
+                 other.
+
+        See :meth:`collect_downstream_graph` for details.
+        """
+        return cls.collect_downstream_graph(operations)[0]
+
+    @classmethod
+    def collect_downstream_graph(cls, operations):
+        """Collect Operations and all those that follow them, with links.
+
+        The graph is collected with a single recursive query on
+        :attr:`HistoryInput.latest_previous_op`.
+
+        :return: a pair whose first element is the list of levels,
+                 as in :meth:`collect_downstream_levels`, and the second
+                 is a :class:`dict` of the ids of direct :attr:`followers`,
+                 by Operation id, for the Operations having any.
+        """
+        roots = set(op.id for op in operations)
+        if not roots:
+            return [], {}
+        HI = cls.registry.Wms.Operation.HistoryInput.__table__
+        edges = select([HI.c.operation_id, HI.c.latest_previous_op_id]
+                       ).where(HI.c.latest_previous_op_id.in_(roots)
+                               ).cte(name='downstream', recursive=True)
+        edges = edges.union(
+            select([HI.c.operation_id, HI.c.latest_previous_op_id]).where(
+                HI.c.latest_previous_op_id == edges.c.operation_id))
+
+        preds = {op_id: set() for op_id in roots}
+        followers = {}
+        for op_id, prev_id in cls.registry.execute(select([edges])):
+            preds.setdefault(op_id, set()).add(prev_id)
+            followers.setdefault(prev_id, set()).add(op_id)
+
+        Operation = cls.registry.Wms.Operation
+        by_id = {op.id: op for op in Operation.query().filter(
+            Operation.id.in_(list(preds))).all()}
+
+        nb_followers = {op_id: len(followers.get(op_id, ()))
+                        for op_id in preds}
+        levels = []
+        level = [op_id for op_id, nb in nb_followers.items() if nb == 0]
+        while level:
+            levels.append([by_id[op_id] for op_id in sorted(level)])
+            next_level = []
+            for op_id in level:
+                for prev_id in preds[op_id]:
+                    nb_followers[prev_id] -= 1
+                    if not nb_followers[prev_id]:
+                        next_level.append(prev_id)
+            level = next_level
+        return levels, followers
+
+    @classmethod
+    def cancel_batch(cls, operations):
+        """Cancel and delete several Operations that don't follow each other.
+
+        This is meant to be called by :meth:`cancel_several`, once the
+        followers of ``operations`` have been taken care of.
+
+        Operations whose class keep the default implementations of
+        :meth:`cancel_single`, :meth:`reset_inputs_original_values` and
+        :meth:`delete_outcomes` are treated together, with a few set-based
+        statements. For the other ones, :meth:`cancel_single` is called.
+
+        The ORM session is expired afterwards.
+        """
+        cls.single_batch(operations, 'cancel_single')
+
+    @classmethod
+    def obliviate_batch(cls, operations):
+        """Obliviate and delete several Operations that don't follow each other.
+
+        This is the analog of :meth:`cancel_batch` for
+        :meth:`obliviate_several` and :meth:`obliviate_single`.
+        """
+        cls.single_batch(operations, 'obliviate_single',
+                         inputs_state='present')
+
+    @classmethod
+    def single_batch(cls, operations, meth_name, inputs_state=None):
+        """Common implementation of :meth:`cancel_batch` and
+        :meth:`obliviate_batch`.
+
+        :param str meth_name: name of the method to call on Operations that
+                              don't have the default implementation.
+        :param inputs_state: passed to
+                             :meth:`reset_inputs_original_values_batch`
+        """
+        default = []
+        for op in operations:
+            if op.has_default_single(meth_name):
+                default.append(op.id)
+            else:
+                getattr(op, meth_name)()
+        cls.registry.flush()
+        if default:
+            cls.reset_inputs_original_values_batch(default,
+                                                   state=inputs_state)
+            cls.delete_outcomes_batch(default)
+        for op in operations:
+            op.delete(flush=False)
+        cls.registry.flush()
+
+    def has_default_single(self, meth_name):
+        """Tell if ``self`` has the default implementation of the given method.
+
+        :param str meth_name: name of one of the single Operation methods,
+                              such as :meth:`cancel_single`.
+                              The methods they rely on,
+                              :meth:`reset_inputs_original_values` and
+                              :meth:`delete_outcomes` must also have their
+                              default implementations.
+        """
+        cls = self.__class__
+        # comparing with the class declared in this module, not with the
+        # one of the registry, so that overrides in other Bloks count
+        return all(getattr(cls, name) is getattr(Operation, name)
+                   for name in (meth_name,
+                                'reset_inputs_original_values',
+                                'delete_outcomes'))
 
     def is_reversible(self):
         """Tell whether the current operation can be in principle reverted.
@@ -428,8 +1315,8 @@ class Operation:
     def plan_revert(self, dt_execution=None):
         """Plan operations to revert the present one and its consequences.
 
-        Like :meth:`cancel`, this method is recursive, but it applies only
-        to operations that are in the 'done' state.
+        Like :meth:`cancel`, this method applies to all followers, but it
+        applies only to operations that are in the 'done' state.
 
         It is expected that some operations can't be reverted, because they
         are destructive, and in that case an exception will be raised.
@@ -446,9 +1333,114 @@ class Operation:
         :return: the operation reverting the present one, and
                  the list of initial operations to be executed to actually
                  start reversing the whole.
+
+        The whole downstream graph is collected and checked first by
+        :meth:`collect_downstream_graph`, then the reversals are planned
+        level by level by :meth:`plan_revert_level`, so that each Operation
+        gets its reversal planned exactly once, after all its followers.
         """
         if dt_execution is None:
             dt_execution = datetime.now()
+        self.check_revert_conditions()
+        logger.debug("Planning reversal of operation %r", self)
+
+        levels, followers = self.collect_downstream_graph((self, ))
+        for level in levels:
+            for op in level:
+                op.check_revert_conditions()
+
+        reversals = {}
+        exec_leafs = []
+        with self.registry.Wms.defer_quantity_cache_invalidation():
+            for level in levels:
+                self.plan_revert_level(level, followers, reversals,
+                                       dt_execution)
+                exec_leafs.extend(reversals[op.id] for op in level
+                                  if not followers.get(op.id))
+        self.registry.flush()
+        this_reversal = reversals[self.id]
+        logger.info("Planned reversal of operation %r. "
+                    "Execution starts with %r", self, exec_leafs)
+        return this_reversal, exec_leafs
+
+    @classmethod
+    def plan_revert_level(cls, level, followers, reversals, dt_execution):
+        """Plan the reversals of Operations whose followers are reverted.
+
+        :param level: the Operations to plan reversals for
+        :param dict followers: ids of followers, by Operation id, as
+                               returned by :meth:`collect_downstream_graph`
+        :param dict reversals: the reversals planned so far, by id of the
+                               reverted Operation. It is updated with the
+                               new ones.
+        :param datetime dt_execution: the date and time at which to plan
+                                      the reversals
+
+        Operations that describe their reversal with
+        :meth:`plan_revert_spec` have them created with
+        :meth:`create_batch`, grouped by class. The others get their
+        reversals planned by :meth:`plan_revert_single`.
+        """
+        by_model = OrderedDict()
+        for op in level:
+            follows = [reversals[f_id]
+                       for f_id in sorted(followers.get(op.id, ()))]
+            spec = None
+            if op.has_revert_spec():
+                spec = op.plan_revert_spec(dt_execution, follows=follows)
+            if spec is None:
+                reversals[op.id] = op.plan_revert_single(dt_execution,
+                                                         follows=follows)
+            else:
+                model, fields = spec
+                by_model.setdefault(model, []).append((op.id, fields))
+
+        for model, items in by_model.items():
+            created = model.create_batch(fields for _, fields in items)
+            for (op_id, _), reversal in zip(items, created):
+                reversals[op_id] = reversal
+
+    @classmethod
+    def has_revert_spec(cls):
+        """Tell if :meth:`plan_revert_spec` can be used for the current class.
+
+        This is the case if it is implemented by the same class as
+        :meth:`plan_revert_single`, so that overrides of the latter
+        in other Bloks are honoured.
+        """
+        def owner(name):
+            return next(klass for klass in cls.__mro__ if name in vars(klass))
+
+        spec_owner = owner('plan_revert_spec')
+        # comparing with the class declared in this module, as in
+        # has_default_single()
+        return (spec_owner is not Operation and
+                spec_owner is owner('plan_revert_single'))
+
+    def plan_revert_spec(self, dt_execution, follows=()):
+        """Describe the Operation that would revert the present one.
+
+        This is meant for :meth:`plan_revert_level`, to create the
+        reversals of several Operations at once, with the same
+        parameters as :meth:`plan_revert_single`.
+
+        :return: a pair made of the Operation class and the keyword
+                 arguments that its :meth:`create` would take, or ``None``
+                 if the reversal has to be planned by
+                 :meth:`plan_revert_single`.
+
+        The default implementation returns ``None``. Subclasses implementing
+        this method should implement :meth:`plan_revert_single` with it.
+        """
+        return None
+
+    def check_revert_conditions(self):
+        """Check that the Operation can be reverted, ignoring followers.
+
+        :raises: OperationError if the Operation is not in the ``done``
+                 state, :class:`OperationIrreversibleError` if it is not
+                 :meth:`reversible <is_reversible>`.
+        """
         if self.state != 'done':
             # TODO actually it'd be nice to cancel or update
             # planned operations (think of reverting a Move meant for
@@ -461,24 +1453,6 @@ class Operation:
         if not self.is_reversible():
             raise OperationIrreversibleError(self)
 
-        logger.debug("Planning reversal of operation %r", self)
-
-        exec_leafs = []
-        followers_reverts = []
-        for follower in self.followers:
-            follower_revert, follower_exec_leafs = follower.plan_revert()
-            self.registry.flush()
-            followers_reverts.append(follower_revert)
-            exec_leafs.extend(follower_exec_leafs)
-        this_reversal = self.plan_revert_single(dt_execution,
-                                                follows=followers_reverts)
-        self.registry.flush()
-        if not exec_leafs:
-            exec_leafs.append(this_reversal)
-        logger.info("Planned reversal of operation %r. "
-                    "Execution starts with %r", self, exec_leafs)
-        return this_reversal, exec_leafs
-
     def obliviate(self):
         """Totally forget about an executed Operation and all its consequences.
 
@@ -500,37 +1474,92 @@ class Operation:
         Also, some Operations cannot be reverted in reality, whereas oblivion
         in our sense have no effect on reality.
 
-        This method will recursively obliviate all follow-ups of ``self``,
+        This method will obliviate all follow-ups of ``self``,
         before ``self`` itself.
 
-        The implementation is for now a simple recursion, and hence can
-        lead to :class:`RecursionError` on huge graphs.
-        TODO rewrite using an accumulation logic rather than recursion.
-        TODO it is also very much a duplication of :meth:`cancel`. The
-        recursion logic itself should probably be factorized in a common
-        method.
+        This is :meth:`obliviate_several` applied to ``self`` alone.
 
         TODO For the time being, the implementation insists on all Operations
         to be in the ``done`` state, but it should probably accept those
         that are in the ``planned`` state, and call :meth:`cancel` on them,
         maybe this could become an option if we can't decide.
         """
-        if self.state != 'done':
-            raise OperationError(
-                self,
-                "Can't obliviate {op} because its state {op.state!r} is not "
-                "'obliviate'", op=self)
-        logger.debug("Obliviating operation %r", self)
+        self.obliviate_several((self, ))
+
+    @classmethod
+    def obliviate_several(cls, operations):
+        """Totally forget about several executed Operations and their
+        consequences.
+
+        This works as :meth:`cancel_several` does, with
+        :meth:`obliviate_batch` instead of :meth:`cancel_batch`,
+        and can therefore be used to purge, e.g., thousands of
+        mistaken Arrivals at once.
 
-        # followers attribute value will mutate during the loop
-        followers = tuple(self.followers)
-        for follower in followers:
-            follower.obliviate()
-        self.obliviate_single()
+        Bloks that need to react on oblivion should override this
+        rather than :meth:`obliviate`.
+        """
+        cls.remove_downstream(operations, 'done', 'obliviate')
 
-        self.delete()
-        # TODO check that we have a test for cascading on HistoryInput
-        logger.info("Obliviated operation %r", self)
+    def quantity_cache_changes(self):
+        """Describe what the Operation affects, for the quantity cache.
+
+        :return: ``None`` if the :attr:`quantity cache
+                 <anyblok_wms_base.core.wms.Wms.quantity_cache>` is
+                 disabled, otherwise the pair of arguments for its
+                 ``invalidate()`` method: the set of pairs (location id,
+                 Type id) of :attr:`inputs` and :attr:`outcomes`, and the
+                 set of locations of those of them that are containers.
+        """
+        if self.registry.Wms.quantity_cache is None:
+            return None
+        changes = set()
+        container_location_ids = set()
+        for avatar in itertools.chain(self.inputs, self.outcomes):
+            obj = avatar.obj
+            changes.add((avatar.location_id, obj.type_id))
+            if obj.is_container():
+                container_location_ids.add(avatar.location_id)
+        return changes, container_location_ids
+
+    def invalidate_quantity_cache(self):
+        """Invalidate the quantity cache for what the Operation affects.
+
+        This relies on :meth:`quantity_cache_changes`, unless invalidations
+        are deferred (see :meth:`Wms.defer_quantity_cache_invalidation
+        <anyblok_wms_base.core.wms.Wms.defer_quantity_cache_invalidation>`).
+        """
+        Wms = self.registry.Wms
+        deferred = Wms.quantity_cache_deferred()
+        if deferred is not None:
+            deferred.add(self.id)
+            return
+        Wms.invalidate_quantity_cache(self.quantity_cache_changes())
+
+    @classmethod
+    def quantity_cache_changes_batch(cls, op_ids):
+        """Set-based version of :meth:`quantity_cache_changes`.
+
+        :param op_ids: ids of Operations
+        :return: same as :meth:`quantity_cache_changes`, for all the given
+                 Operations.
+        """
+        Wms = cls.registry.Wms
+        if Wms.quantity_cache is None:
+            return None
+        affected = cls.affected_avatars(op_ids)
+        PhysObj = Wms.PhysObj
+        physobj = PhysObj.__table__
+        changes = set(tuple(row) for row in cls.registry.execute(
+            select([affected.c.location_id, physobj.c.type_id]).where(
+                physobj.c.id == affected.c.obj_id).distinct()))
+        Type = PhysObj.Type
+        container_type_ids = set(
+            gt.id for gt in Type.query().filter(
+                Type.id.in_(list(set(t_id for _, t_id in changes)))).all()
+            if gt.is_container())
+        return changes, set(loc_id for loc_id, type_id in changes
+                            if type_id in container_type_ids)
 
     def iter_inputs_original_values(self):
         """List inputs together with the original values stored in HistoryInput.
@@ -553,15 +1582,86 @@ class Operation:
         The original values are those currently held in
         :class:`Model.Wms.Operation.HistoryInput <HistoryInput>`.
 
-        TODO PERF: it should be more efficient not to fetch the avatars and
-        their records, but work directly on ids (and maybe do this in one pass
-        with a clever UPDATE query).
+        This works on the ORM records, for the sake of overrides.
+        :meth:`reset_inputs_original_values_batch` is the set-based
+        version, used for Operations that keep the default implementation.
         """
         for avatar, reason, dt_until in self.iter_inputs_original_values():
             if state is not None:
                 avatar.state = state
             avatar.update(reason=reason, dt_until=dt_until)
 
+    @classmethod
+    def affected_avatars(cls, op_ids):
+        """Set-based access to :attr:`inputs` and :attr:`outcomes`.
+
+        :param op_ids: ids of Operations
+        :return: a SQL subquery having the ``location_id`` and ``obj_id``
+                 columns of all Avatars that are inputs or outcomes of the
+                 given Operations.
+        """
+        HI = cls.registry.Wms.Operation.HistoryInput.__table__
+        avatar = cls.registry.Wms.PhysObj.Avatar.__table__
+        columns = [avatar.c.location_id, avatar.c.obj_id]
+        inputs = select(columns).where(
+            avatar.c.id == HI.c.avatar_id).where(
+                HI.c.operation_id.in_(op_ids))
+        outcomes = select(columns).where(
+            avatar.c.reason_id.in_(op_ids)).where(avatar.c.state != 'past')
+        return union(inputs, outcomes).alias('affected_avatars')
+
+    @classmethod
+    def reset_inputs_original_values_batch(cls, op_ids, state=None):
+        """Set-based version of :meth:`reset_inputs_original_values`.
+
+        :param op_ids: ids of Operations that don't follow each other.
+
+        This issues a single ``UPDATE`` statement, and expires the
+        ORM session.
+        """
+        cls.registry.flush()
+        HI = cls.registry.Wms.Operation.HistoryInput.__table__
+        avatar = cls.registry.Wms.PhysObj.Avatar.__table__
+        values = dict(reason_id=HI.c.latest_previous_op_id,
+                      dt_until=HI.c.orig_dt_until)
+        if state is not None:
+            values['state'] = state
+        cls.registry.execute(avatar.update().where(
+            avatar.c.id == HI.c.avatar_id).where(
+                HI.c.operation_id.in_(op_ids)).values(**values))
+        cls.registry.session.expire_all()
+
+    @classmethod
+    def delete_outcomes_batch(cls, op_ids):
+        """Set-based version of :meth:`delete_outcomes`.
+
+        :param op_ids: ids of Operations that don't follow each other.
+
+        This issues one ``DELETE`` statement for the Avatars, and one
+        for the PhysObj that have no Avatar left, then updates the
+        :attr:`share_count
+        <anyblok_wms_base.core.physobj.main.Properties.share_count>` of their
+        Properties. The ORM session is expired.
+        """
+        cls.registry.flush()
+        execute = cls.registry.execute
+        PhysObj = cls.registry.Wms.PhysObj
+        avatar = PhysObj.Avatar.__table__
+        physobj = PhysObj.__table__
+        obj_ids = set(row[0] for row in execute(
+            avatar.delete().where(avatar.c.reason_id.in_(op_ids)).where(
+                avatar.c.state != 'past').returning(avatar.c.obj_id)))
+        if obj_ids:
+            props_ids = set(row[0] for row in execute(
+                physobj.delete().where(physobj.c.id.in_(obj_ids)).where(
+                    ~select([avatar.c.id]).where(
+                        avatar.c.obj_id == physobj.c.id).exists()
+                ).returning(physobj.c.properties_id)))
+            props_ids.discard(None)
+            if props_ids:
+                PhysObj.Properties.refresh_share_counts(ids=props_ids)
+        cls.registry.session.expire_all()
+
     @classmethod
     def check_create_conditions(cls, state, dt_execution,
                                 inputs=None, **kwargs):
@@ -683,13 +1783,15 @@ class Operation:
         The PhysObj that the outcome Avatars were attached too get removed if
         they have no Avatar left. Typically that would be because they have
         been created along with the Avatars.
+
+        :meth:`delete_outcomes_batch` is the set-based version, used for
+        Operations that keep the default implementation.
         """
         all_goods = set()
         for avatar in self.outcomes:
             all_goods.add(avatar.obj)
             avatar.delete()
         self.registry.flush()
-        # TODO PERF probably more efficient in one query with GROUP BY + COUNT
         Avatar = self.registry.Wms.PhysObj.Avatar
         for goods in all_goods:
             if not Avatar.query().filter(Avatar.obj == goods).count():
@@ -709,7 +1811,12 @@ class Operation:
 
         Downstream applications and libraries are
         not supposed to call this method: they should use :meth:`cancel`,
-        which takes care of the necessary recursivity and the final deletion.
+        which takes care of the followers and the final deletion.
+
+        Operations whose classes don't override this method are actually
+        cancelled by :meth:`reset_inputs_original_values_batch` and
+        :meth:`delete_outcomes_batch`, which subclasses may have to override
+        accordingly.
         """
         self.reset_inputs_original_values()
         self.registry.flush()
@@ -729,7 +1836,12 @@ class Operation:
 
         Downstream applications and libraries are
         not supposed to call this method: they should use :meth:`obliviate`,
-        which takes care of the necessary recursivity and the final deletion.
+        which takes care of the followers and the final deletion.
+
+        As for :meth:`cancel_single`, Operations whose classes don't override
+        this method are actually obliviated by
+        :meth:`reset_inputs_original_values_batch` and
+        :meth:`delete_outcomes_batch`.
         """
         self.reset_inputs_original_values(state='present')
         self.registry.flush()
@@ -753,7 +1865,7 @@ class Operation:
 
         Downstream applications and libraries are
         not supposed to call this method: they should use :meth:`plan_revert`,
-        which takes care of the necessary recursivity.
+        which takes care of the followers.
 
         To be implemented in sublasses
         """
@@ -7,6 +7,8 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
+from sqlalchemy import case
+
 from anyblok import Declarations
 from anyblok.column import Integer
 
@@ -44,10 +46,30 @@ class Departure(Mixin.WmsSingleInputOperation, Operation):
         else:
             self.input.dt_until = self.dt_execution
 
+    @classmethod
+    def after_insert_batch(cls, operations):
+        """Set-based version of :meth:`after_insert`."""
+        op_ids = [op.id for op in operations]
+        op = cls.registry.Wms.Operation.__table__
+        avatar = cls.registry.Wms.PhysObj.Avatar.__table__
+        done = op.c.state == 'done'
+        cls.update_inputs_batch(
+            op_ids,
+            dt_until=op.c.dt_execution,
+            reason_id=case([(done, op.c.id)], else_=avatar.c.reason_id),
+            state=case([(done, 'past')], else_=avatar.c.state))
+
     def execute_planned(self):
         self.registry.flush()
         self.depart()
 
+    @classmethod
+    def execute_planned_batch(cls, op_ids, dt_execution):
+        """Set-based version of :meth:`execute_planned`."""
+        op = cls.registry.Wms.Operation.__table__
+        cls.update_inputs_batch(op_ids, state='past', reason_id=op.c.id,
+                                dt_until=dt_execution)
+
     def cancel_single(self):
         self.reset_inputs_original_values()
 
@@ -7,6 +7,8 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
+from sqlalchemy import case
+
 from anyblok import Declarations
 from anyblok.column import Integer
 from anyblok.relationship import Many2One
@@ -53,6 +55,21 @@ class Move(Mixin.WmsSingleInputOperation, Operation):
         if state == 'done':
             to_move.state = 'past'
 
+    @classmethod
+    def after_insert_batch(cls, operations):
+        """Set-based version of :meth:`after_insert`."""
+        op_ids = [op.id for op in operations]
+        op = cls.registry.Wms.Operation.__table__
+        avatar = cls.registry.Wms.PhysObj.Avatar.__table__
+        done = op.c.state == 'done'
+        cls.insert_avatars_from_inputs_batch(
+            op_ids, cls.__table__.c.destination_id,
+            case([(done, 'present')], else_='future'))
+        cls.update_inputs_batch(
+            op_ids,
+            dt_until=op.c.dt_execution,
+            state=case([(done, 'past')], else_=avatar.c.state))
+
     @classmethod
     def check_create_conditions(cls, state, dt_execution, destination=None,
                                 **kwargs):
@@ -73,6 +90,15 @@ class Move(Mixin.WmsSingleInputOperation, Operation):
 
         self.input.update(state='past', reason=self, dt_until=dt_execution)
 
+    @classmethod
+    def execute_planned_batch(cls, op_ids, dt_execution):
+        """Set-based version of :meth:`execute_planned`."""
+        op = cls.registry.Wms.Operation.__table__
+        cls.update_outcomes_batch(op_ids, state='present',
+                                  dt_from=dt_execution)
+        cls.update_inputs_batch(op_ids, state='past', reason_id=op.c.id,
+                                dt_until=dt_execution)
+
     def is_reversible(self):
         """Moves are always reversible.
 
@@ -82,6 +108,10 @@ class Move(Mixin.WmsSingleInputOperation, Operation):
         return True
 
     def plan_revert_single(self, dt_execution, follows=()):
+        model, fields = self.plan_revert_spec(dt_execution, follows=follows)
+        return model.create(**fields)
+
+    def plan_revert_spec(self, dt_execution, follows=()):
         if not follows:
             # reversal of an end-of-chain move
             after = self
@@ -90,14 +120,14 @@ class Move(Mixin.WmsSingleInputOperation, Operation):
             # its reversal follows at most one operation, whose
             # outcome is one PhysObj record
             after = follows[0]
-        return self.create(input=after.outcomes[0],
-                           destination=self.input.location,
-                           dt_execution=dt_execution,
-                           state='planned',
-                           **self.revert_extra_fields())
+        return self.__class__, dict(input=after.outcomes[0],
+                                    destination=self.input.location,
+                                    dt_execution=dt_execution,
+                                    state='planned',
+                                    **self.revert_extra_fields())
 
     def revert_extra_fields(self):
-        """Extra fields to take into account in :meth:`plan_revert_single`.
+        """Extra fields to take into account in :meth:`plan_revert_spec`.
 
         Singled out for easy subclassing, e.g., by the
         :ref:`wms-quantity Blok <blok_wms_quantity>`.
@@ -59,5 +59,24 @@ class WmsSingleInputOperation:
         return super(WmsSingleInputOperation, cls).create(
             inputs=inputs, **kwargs)
 
+    @classmethod
+    def create_batch(cls, specs):
+        """Accept the alternative ``input`` key in ``specs``, as :meth:`create`.
+        """
+        normalized = []
+        for spec in specs:
+            spec = dict(spec)
+            inp = spec.pop('input', None)
+            if inp is not None:
+                if spec.get('inputs') is not None:
+                    raise OperationError(
+                        cls,
+                        "You must choose between the 'input' and the "
+                        "'inputs' keys (got input={input}, inputs={inputs}",
+                        input=inp, inputs=spec['inputs'])
+                spec['inputs'] = (inp, )
+            normalized.append(spec)
+        return super(WmsSingleInputOperation, cls).create_batch(normalized)
+
     def specific_repr(self):
         return "input={self.input!r}".format(self=self)
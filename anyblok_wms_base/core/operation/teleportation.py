@@ -6,6 +6,8 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
+from sqlalchemy import literal
+
 from anyblok import Declarations
 from anyblok.column import Integer
 from anyblok.relationship import Many2One
@@ -84,3 +86,15 @@ class Teleportation(Mixin.WmsSingleInputOperation, Operation):
             obj=to_move.obj)
 
         to_move.update(dt_until=dt_exec, reason=self, state='past')
+
+    @classmethod
+    def after_insert_batch(cls, operations):
+        """Set-based version of :meth:`after_insert`."""
+        op_ids = [op.id for op in operations]
+        op = cls.registry.Wms.Operation.__table__
+        cls.insert_avatars_from_inputs_batch(
+            op_ids, cls.__table__.c.new_location_id, literal('present'))
+        cls.update_inputs_batch(op_ids,
+                                dt_until=op.c.dt_execution,
+                                reason_id=op.c.id,
+                                state='past')
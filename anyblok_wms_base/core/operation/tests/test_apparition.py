@@ -140,6 +140,37 @@ class TestApparition(WmsTestCase):
         str(exc)
         self.assertEqual(exc.kwargs.get('forbidden'), 'planned')
 
+    def test_create_batch(self):
+        app1, app2 = self.Apparition.create_batch([
+            dict(location=self.stock,
+                 state='done',
+                 quantity=2,
+                 goods_code='x34/7',
+                 goods_properties=dict(foo=2),
+                 goods_type=self.goods_type),
+            dict(location=self.stock,
+                 state='done',
+                 quantity=1,
+                 goods_type=self.goods_type),
+        ])
+        avatars = app1.outcomes
+        self.assertEqual(len(avatars), 2)
+        for avatar in avatars:
+            self.assertEqual(avatar.state, 'present')
+            self.assertEqual(avatar.location, self.stock)
+            self.assertEqual(avatar.dt_from, app1.dt_execution)
+            goods = avatar.obj
+            self.assertEqual(goods.type, self.goods_type)
+            self.assertEqual(goods.code, 'x34/7')
+            self.assertEqual(goods.get_property('foo'), 2)
+        self.assertEqual(avatars[0].obj.properties,
+                         avatars[1].obj.properties)
+        self.assertEqual(avatars[0].obj.properties.share_count, 2)
+
+        goods = self.assert_singleton(app2.outcomes).obj
+        self.assertIsNone(goods.properties)
+        self.assertIsNone(goods.code)
+
     def test_not_a_container(self):
         wrong_loc = self.PhysObj.insert(type=self.goods_type)
         with self.assertRaises(OperationContainerExpected) as arc:
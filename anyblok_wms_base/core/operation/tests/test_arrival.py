@@ -98,6 +98,34 @@ class TestArrival(WmsTestCase):
         self.assertEqual(
             self.PhysObj.query().filter_by(type=self.goods_type).count(), 0)
 
+    def test_create_batch(self):
+        self.assertEqual(self.Arrival.create_batch(()), [])
+        arrivals = self.Arrival.create_batch(
+            dict(location=self.incoming_loc,
+                 state='planned',
+                 dt_execution=self.dt_test1,
+                 goods_code=str(i),
+                 goods_properties=dict(foo=i),
+                 goods_type=self.goods_type) for i in range(3))
+        self.assertEqual([arrival.goods_code for arrival in arrivals],
+                         ['0', '1', '2'])
+        for i, arrival in enumerate(arrivals):
+            self.assertEqual(arrival.follows, [])
+            avatar = self.assert_singleton(arrival.outcomes)
+            self.assertEqual(avatar.state, 'future')
+            self.assertEqual(avatar.location, self.incoming_loc)
+            self.assertEqual(avatar.dt_from, self.dt_test1)
+            goods = avatar.obj
+            self.assertEqual(goods.type, self.goods_type)
+            self.assertEqual(goods.code, str(i))
+            self.assertEqual(goods.get_property('foo'), i)
+            self.assertEqual(goods.properties.share_count, 1)
+
+        arrivals[0].execute(self.dt_test2)
+        avatar = self.assert_singleton(arrivals[0].outcomes)
+        self.assertEqual(avatar.state, 'present')
+        self.assertEqual(avatar.dt_from, self.dt_test2)
+
     def test_repr(self):
         arrival = self.Arrival(location=self.incoming_loc,
                                state='done',
@@ -117,5 +117,31 @@ class TestDeparture(WmsTestCaseWithPhysObj):
         repr(dep)
         str(dep)
 
+    def test_create_batch(self):
+        self.avatar.state = 'present'
+        arrival = self.Operation.Arrival.create(goods_type=self.physobj_type,
+                                                location=self.incoming_loc,
+                                                state='done',
+                                                dt_execution=self.dt_test1)
+        other = arrival.outcomes[0]
+        done, planned = self.Departure.create_batch([
+            dict(input=self.avatar, state='done',
+                 dt_execution=self.dt_test2),
+            dict(input=other, dt_execution=self.dt_test3),
+        ])
+        self.assertEqual(done.follows, [self.arrival])
+        self.assertEqual(self.avatar.state, 'past')
+        self.assertEqual(self.avatar.reason, done)
+        self.assertEqual(self.avatar.dt_until, self.dt_test2)
+
+        self.assertEqual(planned.follows, [arrival])
+        self.assertEqual(other.state, 'present')
+        self.assertEqual(other.reason, arrival)
+        self.assertEqual(other.dt_until, self.dt_test3)
+
+        planned.execute(self.dt_test3)
+        self.assertEqual(other.state, 'past')
+        self.assertEqual(other.reason, planned)
+
 
 del WmsTestCaseWithPhysObj
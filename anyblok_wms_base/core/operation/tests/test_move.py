@@ -6,10 +6,13 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
+from sqlalchemy import inspect
+
 from anyblok_wms_base.testing import WmsTestCaseWithPhysObj
 
 from anyblok_wms_base.exceptions import (
     OperationContainerExpected,
+    OperationInputsError,
 )
 
 
@@ -97,5 +100,81 @@ class TestMove(WmsTestCaseWithPhysObj):
         repr(exc)
         self.assertEqual(exc.kwargs['offender'], wrong_loc)
 
+    def test_create_batch(self):
+        arrivals = self.Operation.Arrival.create_batch(
+            dict(goods_type=self.physobj_type,
+                 location=self.incoming_loc,
+                 state='done',
+                 dt_execution=self.dt_test1) for _ in range(3))
+        avatars = [arrival.outcomes[0] for arrival in arrivals]
+        moves = self.Move.create_batch([
+            dict(input=avatars[0], destination=self.stock,
+                 state='done', dt_execution=self.dt_test2),
+            dict(inputs=[avatars[1]], destination=self.stock,
+                 dt_execution=self.dt_test2),
+            dict(input=avatars[2], destination=self.stock,
+                 dt_execution=self.dt_test3),
+        ])
+        done, planned, to_execute = moves
+        self.assertEqual([move.follows for move in moves],
+                         [[arrival] for arrival in arrivals])
+        self.assertEqual([move.input for move in moves], avatars)
+
+        self.assertEqual(done.state, 'done')
+        self.assertEqual(avatars[0].state, 'past')
+        self.assertEqual(avatars[0].dt_until, self.dt_test2)
+        moved = self.assert_singleton(done.outcomes)
+        self.assertEqual(moved.state, 'present')
+        self.assertEqual(moved.location, self.stock)
+        self.assertEqual(moved.obj, avatars[0].obj)
+        self.assertEqual(moved.dt_from, self.dt_test2)
+        self.assertIsNone(moved.dt_until)
+
+        self.assertEqual(planned.state, 'planned')
+        self.assertEqual(avatars[1].state, 'present')
+        self.assertEqual(avatars[1].dt_until, self.dt_test2)
+        self.assertEqual(self.assert_singleton(planned.outcomes).state,
+                         'future')
+
+        to_execute.execute(self.dt_test3)
+        self.assertEqual(avatars[2].state, 'past')
+        self.assertEqual(self.assert_singleton(to_execute.outcomes).state,
+                         'present')
+
+        planned.cancel()
+        self.assertEqual(avatars[1].state, 'present')
+        self.assertIsNone(avatars[1].dt_until)
+        self.assertEqual(avatars[1].reason, arrivals[1])
+
+    def test_create_batch_expiry(self):
+        """Only the inputs and their PhysObj are expired."""
+        self.avatar.state = 'present'
+        self.registry.flush()
+        self.registry.session.expire(self.avatar)
+        obj = self.avatar.obj
+        self.registry.session.expire(self.avatar)
+
+        others = (self.stock, self.arrival)
+        before = [set(inspect(record).expired_attributes)
+                  for record in others]
+
+        move = self.assert_singleton(self.Move.create_batch([
+            dict(input=self.avatar, destination=self.stock,
+                 state='done', dt_execution=self.dt_test2)]))
+        for record in (self.avatar, obj):
+            self.assertTrue(inspect(record).expired_attributes)
+        self.assertEqual([set(inspect(record).expired_attributes)
+                          for record in others], before)
+        self.assertEqual(move.state, 'done')
+        self.assertEqual(self.avatar.state, 'past')
+        self.assertEqual(self.avatar.dt_until, self.dt_test2)
+
+    def test_create_batch_same_input(self):
+        self.avatar.state = 'present'
+        with self.assertRaises(OperationInputsError):
+            self.Move.create_batch([dict(input=self.avatar,
+                                         destination=self.stock,
+                                         state='done')] * 2)
+
 
 del WmsTestCaseWithPhysObj
@@ -12,6 +12,7 @@ from .testcase import WmsTestCase
 from anyblok_wms_base.exceptions import (
     OperationError,
     OperationInputsError,
+    OperationInputWrongState,
     OperationIrreversibleError,
     )
 
@@ -36,6 +37,48 @@ class TestOperation(WmsTestCase):
         op.execute_planned = lambda: self.fail("Should not be called")
         op.execute()
 
+    def test_execute_batch(self):
+        Operation = self.Operation
+        arrivals = Operation.Arrival.create_batch(
+            dict(goods_type=self.goods_type,
+                 location=self.incoming_loc,
+                 state='planned',
+                 dt_execution=self.dt_test1) for _ in range(3))
+        avatars = [arrival.outcomes[0] for arrival in arrivals]
+        moves = Operation.Move.create_batch(
+            dict(input=avatar,
+                 destination=self.stock,
+                 dt_execution=self.dt_test2) for avatar in avatars[:2])
+        departure = Operation.Departure.create(input=avatars[2],
+                                               dt_execution=self.dt_test2)
+
+        # Moves come first, and need a second pass.
+        # The last Arrival isn't in the batch, hence the Departure fails
+        failures = Operation.execute_batch(
+            moves + arrivals[:2] + [departure], dt_execution=self.dt_test3)
+        self.assertEqual(list(failures), [departure.id])
+        self.assertIsInstance(failures[departure.id],
+                              OperationInputWrongState)
+        self.assertEqual(departure.state, 'planned')
+        self.assertEqual(avatars[2].state, 'future')
+
+        for op in arrivals[:2] + moves:
+            self.assertEqual(op.state, 'done')
+            self.assertEqual(op.dt_execution, self.dt_test3)
+            self.assertEqual(op.dt_start, self.dt_test3)
+        for avatar, move in zip(avatars, moves):
+            self.assertEqual(avatar.state, 'past')
+            self.assertEqual(avatar.reason, move)
+            self.assertEqual(avatar.dt_from, self.dt_test3)
+            self.assertEqual(avatar.dt_until, self.dt_test3)
+            outcome = self.assert_singleton(move.outcomes)
+            self.assertEqual(outcome.state, 'present')
+            self.assertEqual(outcome.location, self.stock)
+            self.assertEqual(outcome.dt_from, self.dt_test3)
+
+        # already done Operations are ignored
+        self.assertEqual(Operation.execute_batch(Operation.Move.query()), {})
+
     def test_history(self):
         arrival = self.Operation.Arrival.create(goods_type=self.goods_type,
                                                 dt_execution=self.dt_test1,
@@ -49,6 +92,56 @@ class TestOperation(WmsTestCase):
         self.assertEqual(move.follows, [arrival])
         self.assertEqual(arrival.followers, [move])
 
+    def test_history_cache(self):
+        Move = self.Operation.Move
+        arrival = self.Operation.Arrival.create(goods_type=self.goods_type,
+                                                dt_execution=self.dt_test1,
+                                                location=self.incoming_loc,
+                                                state='planned')
+        avatar = self.assert_singleton(arrival.outcomes)
+        move = Move.create(destination=self.stock,
+                           dt_execution=self.dt_test2,
+                           state='planned',
+                           input=avatar)
+        self.assertEqual(move.inputs, [avatar])
+        self.assertEqual(arrival.followers, [move])
+
+        # now served from the cache
+        move.query_history_input = lambda: self.fail("Should not be called")
+        self.assertEqual(move.inputs, [avatar])
+        self.assertEqual(move.follows, [arrival])
+        move.inputs.append(None)  # can't alter the cache
+        self.assertEqual(move.inputs, [avatar])
+
+        # unrelated creations don't invalidate the cache
+        self.Operation.Arrival.create(goods_type=self.goods_type,
+                                      dt_execution=self.dt_test1,
+                                      location=self.incoming_loc,
+                                      state='planned')
+        self.assertEqual(move.inputs, [avatar])
+        del move.query_history_input
+
+        # linking inputs invalidates caches of the previous Operations
+        other = Move.create(destination=self.incoming_loc,
+                            dt_execution=self.dt_test3,
+                            state='planned',
+                            input=avatar)
+        self.assertEqual(arrival.followers, [move, other])
+        other.cancel()
+        self.assertEqual(arrival.followers, [move])
+
+        # so do updates of HistoryInput records
+        self.assertEqual(move.follows, [arrival])
+        arrival2 = self.Operation.Arrival.create(goods_type=self.goods_type,
+                                                 dt_execution=self.dt_test1,
+                                                 location=self.incoming_loc,
+                                                 state='planned')
+        self.assertEqual(move.follows, [arrival])
+        hi = self.single_result(move.query_history_input())
+        hi.latest_previous_op = arrival2
+        self.registry.flush()
+        self.assertEqual(move.follows, [arrival2])
+
     def test_len_inputs(self):
         arrival = self.Operation.Arrival.insert(goods_type=self.goods_type,
                                                 dt_execution=self.dt_test1,
@@ -110,6 +203,22 @@ class TestOperation(WmsTestCase):
         self.assertEqual(hi.orig_dt_until, self.dt_test3)
         self.assertEqual(hi.latest_previous_op, arrival)
 
+        # inputs keep the order in which they have been linked, even if
+        # that's not the order of ids
+        op.link_inputs(inputs=avatars[::-1], clear=True)
+        self.assertEqual(op.inputs, avatars[::-1])
+
+        # pending changes on the inputs are taken into account
+        avatars[0].dt_until = self.dt_test2
+        avatars[0].reason = op
+        op2 = self.Operation.insert(state='planned',
+                                    dt_execution=self.dt_test3,
+                                    type='wms_move')
+        op2.link_inputs(inputs=avatars[:1])
+        hi = self.single_result(HI.query().filter(HI.operation == op2))
+        self.assertEqual(hi.orig_dt_until, self.dt_test2)
+        self.assertEqual(hi.latest_previous_op, op)
+
     def test_before_insert(self):
         other_loc = self.insert_location('other')
 
@@ -185,6 +294,98 @@ class TestOperation(WmsTestCase):
             Avatar.state == 'future').count(), 0)
         self.assertEqual(self.Operation.query().count(), 0)
 
+    def test_downstream_levels(self):
+        arrival = self.Operation.Arrival.create(goods_type=self.goods_type,
+                                                location=self.incoming_loc,
+                                                dt_execution=self.dt_test1,
+                                                state='planned')
+        goods = self.assert_singleton(arrival.outcomes)
+        Move = self.Operation.Move
+        move1 = Move.create(input=goods,
+                            dt_execution=self.dt_test2,
+                            destination=self.stock,
+                            state='planned')
+        move2 = Move.create(input=goods,
+                            dt_execution=self.dt_test2,
+                            destination=self.stock,
+                            state='planned')
+        dep = self.Operation.Departure.create(
+            input=self.assert_singleton(move2.outcomes),
+            dt_execution=self.dt_test3,
+            state='planned')
+        self.registry.flush()
+        self.assertEqual(arrival.downstream_levels(),
+                         [[move1, dep], [move2], [arrival]])
+        self.assertEqual(move2.downstream_levels(), [[dep], [move2]])
+        self.assertEqual(dep.downstream_levels(), [[dep]])
+
+    def test_cancel_long_chain(self):
+        """No recursion is involved, even for very long histories."""
+        arrival = self.Operation.Arrival.create(goods_type=self.goods_type,
+                                                location=self.incoming_loc,
+                                                dt_execution=self.dt_test1,
+                                                state='planned')
+        avatar = self.assert_singleton(arrival.outcomes)
+        locs = (self.stock, self.incoming_loc)
+        for i in range(1200):
+            move = self.Operation.Move.create(input=avatar,
+                                              dt_execution=self.dt_test2,
+                                              destination=locs[i % 2],
+                                              state='planned')
+            avatar = self.assert_singleton(move.outcomes)
+        self.registry.flush()
+
+        arrival.cancel()
+        self.assertEqual(self.Operation.query().count(), 0)
+        Avatar = self.PhysObj.Avatar
+        self.assertEqual(Avatar.query().filter(
+            Avatar.state == 'future').count(), 0)
+        self.assertEqual(
+            self.PhysObj.query().filter_by(type=self.goods_type).count(), 0)
+
+    def test_obliviate_several(self):
+        Arrival = self.Operation.Arrival
+        arrivals = [Arrival.create(goods_type=self.goods_type,
+                                   location=self.incoming_loc,
+                                   dt_execution=self.dt_test1,
+                                   state='done')
+                    for _ in range(20)]
+        kept = Arrival.create(goods_type=self.goods_type,
+                              location=self.incoming_loc,
+                              dt_execution=self.dt_test1,
+                              state='done')
+        kept_avatar = self.assert_singleton(kept.outcomes)
+        for arrival in arrivals[::2]:
+            self.Operation.Move.create(
+                input=self.assert_singleton(arrival.outcomes),
+                dt_execution=self.dt_test2,
+                destination=self.stock,
+                state='done')
+        self.registry.flush()
+
+        Arrival.obliviate_several(arrivals)
+        self.assertEqual(self.Operation.query().all(), [kept])
+        Avatar = self.PhysObj.Avatar
+        self.assertEqual(Avatar.query().all(), [kept_avatar])
+        self.assertEqual(kept_avatar.state, 'present')
+        self.assertEqual(
+            self.PhysObj.query().filter_by(type=self.goods_type).all(),
+            [kept_avatar.obj])
+
+    def test_obliviate_several_wrong_state(self):
+        arrival = self.Operation.Arrival.create(goods_type=self.goods_type,
+                                                location=self.incoming_loc,
+                                                dt_execution=self.dt_test1,
+                                                state='done')
+        avatar = self.assert_singleton(arrival.outcomes)
+        move = self.Operation.Move.create(input=avatar,
+                                          dt_execution=self.dt_test2,
+                                          destination=self.stock,
+                                          state='planned')
+        with self.assertRaises(OperationError) as arc:
+            self.Operation.obliviate_several([arrival])
+        self.assertEqual(arc.exception.operation, move)
+
     def test_plan_revert_recurse_linear(self):
         workshop = self.PhysObj.insert(code="Workshop",
                                        type=self.stock.type)
@@ -229,6 +430,58 @@ class TestOperation(WmsTestCase):
         self.assertIsNone(avatar.dt_until)
         self.assertEqual(avatar.location, self.incoming_loc)
 
+    def test_plan_revert_long_chain(self):
+        """No recursion is involved, even for very long histories."""
+        arrival = self.Operation.Arrival.create(goods_type=self.goods_type,
+                                                location=self.incoming_loc,
+                                                dt_execution=self.dt_test1,
+                                                state='done')
+        avatar = self.assert_singleton(arrival.outcomes)
+        Move = self.Operation.Move
+        locs = (self.stock, self.incoming_loc)
+        moves = []
+        for i in range(1200):
+            moves.append(Move.create(input=avatar,
+                                     dt_execution=self.dt_test2,
+                                     destination=locs[i % 2],
+                                     state='done'))
+            avatar = self.assert_singleton(moves[-1].outcomes)
+
+        first_rev, rev_leafs = moves[0].plan_revert(dt_execution=self.dt_test3)
+        last_rev = self.assert_singleton(rev_leafs)
+        self.assertEqual(last_rev.follows, [moves[-1]])
+        self.assertEqual(last_rev.destination, locs[0])
+        self.assertEqual(first_rev.destination, self.incoming_loc)
+        self.assertEqual(
+            Move.query().filter_by(state='planned').count(), len(moves))
+
+    def test_plan_revert_level(self):
+        Operation = self.Operation
+        moves = []
+        for _ in range(2):
+            arrival = Operation.Arrival.create(goods_type=self.goods_type,
+                                               location=self.incoming_loc,
+                                               dt_execution=self.dt_test1,
+                                               state='done')
+            moves.append(Operation.Move.create(
+                input=self.assert_singleton(arrival.outcomes),
+                dt_execution=self.dt_test2,
+                destination=self.stock,
+                state='done'))
+        self.assertTrue(Operation.Move.has_revert_spec())
+        self.assertFalse(Operation.Arrival.has_revert_spec())
+
+        reversals = {}
+        Operation.plan_revert_level(moves, {}, reversals, self.dt_test3)
+        self.assertEqual(set(reversals), set(move.id for move in moves))
+        for move in moves:
+            rev = reversals[move.id]
+            self.assertEqual(rev.type, 'wms_move')
+            self.assertEqual(rev.state, 'planned')
+            self.assertEqual(rev.dt_execution, self.dt_test3)
+            self.assertEqual(rev.destination, self.incoming_loc)
+            self.assertEqual(rev.follows, [move])
+
     def test_plan_revert_recurse_wrong_state(self):
         arrival = self.Operation.Arrival.create(goods_type=self.goods_type,
                                                 location=self.incoming_loc,
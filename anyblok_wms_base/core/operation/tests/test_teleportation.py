@@ -83,5 +83,28 @@ class TestTeleportation(WmsTestCaseWithPhysObj):
         repr(exc)
         self.assertEqual(exc.kwargs['offender'], wrong_loc)
 
+    def test_create_batch(self):
+        arrival = self.Operation.Arrival.create(goods_type=self.physobj_type,
+                                                location=self.incoming_loc,
+                                                state='done',
+                                                dt_execution=self.dt_test1)
+        avatars = [self.avatar, arrival.outcomes[0]]
+        telps = self.Teleportation.create_batch(
+            dict(state='done',
+                 dt_execution=self.dt_test2,
+                 new_location=self.stock,
+                 input=avatar) for avatar in avatars)
+        for telep, avatar in zip(telps, avatars):
+            self.assertEqual(telep.input, avatar)
+            self.assertEqual(avatar.state, 'past')
+            self.assertEqual(avatar.reason, telep)
+            self.assertEqual(avatar.dt_until, self.dt_test2)
+
+            outcome = self.assert_singleton(telep.outcomes)
+            self.assertEqual(outcome.state, 'present')
+            self.assertEqual(outcome.obj, avatar.obj)
+            self.assertEqual(outcome.dt_from, self.dt_test2)
+            self.assertEqual(outcome.location, self.stock)
+
 
 del WmsTestCaseWithPhysObj
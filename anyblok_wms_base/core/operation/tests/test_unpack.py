@@ -6,6 +6,8 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
+import copy
+
 from anyblok_wms_base.testing import WmsTestCase
 from anyblok_wms_base.exceptions import (
     OperationInputsError,
@@ -451,7 +453,9 @@ class TestUnpack(WmsTestCase):
         unp = self.Unpack.create(state='planned', input=self.packs,
                                  dt_execution=self.dt_test2)
 
-        del self.packed_goods_type.behaviours['unpack']
+        behaviours = dict(self.packed_goods_type.behaviours)
+        del behaviours['unpack']
+        self.packed_goods_type.behaviours = behaviours
         self.assertEqual(unp.reverse_assembly_name(), 'pack')
 
     def test_revert_default_assembly_final(self):
@@ -551,10 +555,15 @@ class TestUnpack(WmsTestCase):
                                  input=self.packs)
         self.assertTrue(unp.is_reversible())
 
-        del self.packs.obj.type.behaviours['assembly']['bolt']
+        gt = self.packs.obj.type
+        behaviours = copy.deepcopy(gt.behaviours)
+        del behaviours['assembly']['bolt']
+        gt.behaviours = behaviours
         self.assertFalse(unp.is_reversible())
 
-        del self.packs.obj.type.behaviours['assembly']
+        behaviours = dict(behaviours)
+        del behaviours['assembly']
+        gt.behaviours = behaviours
         self.assertFalse(unp.is_reversible())
         # and that's enough testing: once the name is properly resolved
         # it works the same as in the default name case.
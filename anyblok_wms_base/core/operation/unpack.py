@@ -7,6 +7,8 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
+import copy
+
 from anyblok import Declarations
 from anyblok.column import Integer
 
@@ -70,6 +72,13 @@ class Unpack(Mixin.WmsSingleInputOperation, Operation):
             outcome.state = 'present'
         packs.update(state='past', reason=self)
 
+    @classmethod
+    def execute_planned_batch(cls, op_ids, dt_execution):
+        """Set-based version of :meth:`execute_planned`."""
+        op = cls.registry.Wms.Operation.__table__
+        cls.update_outcomes_batch(op_ids, state='present')
+        cls.update_inputs_batch(op_ids, state='past', reason_id=op.c.id)
+
     def create_unpacked_goods(self, fields, spec):
         """Create PhysObj record according to given specification.
 
@@ -114,8 +123,7 @@ class Unpack(Mixin.WmsSingleInputOperation, Operation):
         dt_execution = self.dt_execution
         spec = self.get_outcome_specs()
         type_codes = set(outcome['type'] for outcome in spec)
-        outcome_types = {gt.code: gt for gt in PhysObjType.query().filter(
-            PhysObjType.code.in_(type_codes)).all()}
+        outcome_types = PhysObjType.get_by_codes(type_codes)
 
         outcome_state = 'present' if self.state == 'done' else 'future'
         if self.state == 'done':
@@ -261,13 +269,11 @@ class Unpack(Mixin.WmsSingleInputOperation, Operation):
 
         TODO DOC move a lot to global doc
         """
-        # TODO PERF playing safe by performing a copy, in order not
-        # to propagate mutability to the DB. Not sure how much of it
-        # is necessary.
         packs = self.input
         goods_type = packs.obj.type
         behaviour = goods_type.get_behaviour('unpack')
-        specs = behaviour.get('outcomes', [])[:]
+        # behaviours are read-only, and the outcome specs get updated below
+        specs = copy.deepcopy(behaviour.get('outcomes', []))
         if behaviour.get('uniform_outcomes', False):
             for outcome in specs:
                 outcome['forward_properties'] = 'clone'
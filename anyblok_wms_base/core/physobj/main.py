@@ -7,11 +7,27 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 from copy import deepcopy
+from decimal import Decimal
+import hashlib
+import json
 import warnings
 
 from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy import orm
-from sqlalchemy import or_
+from sqlalchemy import event
+from sqlalchemy import select
+from sqlalchemy import and_
+from sqlalchemy import cast
+from sqlalchemy import union_all
+from sqlalchemy import func
+from sqlalchemy import literal
+from sqlalchemy import text
+from sqlalchemy import Index
+from sqlalchemy import TIMESTAMP
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import TSTZRANGE
+from sqlalchemy.sql.expression import ClauseElement
 
 from anyblok import Declarations
 from anyblok.column import Text
@@ -23,6 +39,7 @@ from anyblok.field import Function
 from anyblok_postgres.column import Jsonb
 
 from anyblok_wms_base.utils import dict_merge
+from anyblok_wms_base.utils import freeze
 from anyblok_wms_base.constants import (
     AVATAR_STATES,
     DATE_TIME_INFINITY,
@@ -144,20 +161,66 @@ class PhysObj:
             return self.type.get_property(k, default=default)
         return val
 
+    merged_props_generation = 0
+    """Incremented at each flush, invalidating all
+    :meth:`merged_properties_view` results."""
+
+    def merged_properties_view(self):
+        """Return all Properties, merged with the Type properties.
+
+        :rtype: :class:`FrozenDict <anyblok_wms_base.utils.FrozenDict>`
+
+        The result is read-only, and memoized until the next flush, or
+        until :attr:`properties` is changed through :meth:`set_property`,
+        :meth:`update_properties`, or assignment.
+        It is the preferred way to read many properties repeatedly, since
+        it doesn't copy anything once computed.
+
+        .. warning:: direct changes to the :class:`Properties` record,
+                     (e.g, ``physobj.properties['foo'] = 'bar'``) aren't
+                     taken into account until the next flush.
+        """
+        type_props = self.type.merged_properties_view()
+        memo = getattr(self, '_merged_props_memo', None)
+        if (memo is not None and memo[0] == self.merged_props_generation
+                and memo[1] is type_props):
+            return memo[2]
+
+        props = self.properties
+        if props is None:
+            merged = type_props
+        else:
+            fields = {k: getattr(props, k)
+                      for k in props._field_property_names()}
+            merged = freeze(dict_merge(
+                dict_merge(props.flexible, fields), type_props))
+        self._merged_props_memo = (self.merged_props_generation,
+                                   type_props, merged)
+        return merged
+
     def merged_properties(self):
         """Return all Properties, merged with the Type properties.
 
         :rtype: dict
 
+        This is a modifiable copy of :meth:`merged_properties_view`.
+
         To retrieve just one Property, prefer :meth:`get_property`, which
         is meant to be more efficient.
         """
-        props = self.properties
-        type_props = self.type.merged_properties()
-        if props is None:
-            return type_props
+        return deepcopy(self.merged_properties_view())
+
+    def invalidate_merged_properties(self, *args):
+        """Discard the memoized :meth:`merged_properties_view`.
 
-        return dict_merge(props.as_dict(), type_props)
+        Extra arguments are ignored, so that this can be used directly
+        as an instance event listener.
+        """
+        self._merged_props_memo = None
+
+    @classmethod
+    def _merged_props_after_flush(cls, session, flush_context):
+        cls.merged_props_generation += 1
 
     def _maybe_duplicate_props(self):
         """Internal method to duplicate Properties
@@ -168,13 +231,59 @@ class PhysObj:
         The caller must have already checked that ``self.properties`` is not
         ``None``.
         """
-        cls = self.__class__
         existing = self.properties
-        if cls.query(cls.id).filter(
-                cls.properties == existing,
-                cls.id != self.id).limit(1).count():
+        count = existing.share_count
+        if isinstance(count, ClauseElement):
+            # there's a pending update of the count
+            self.registry.flush()
+            count = existing.share_count
+        if count > 1:
             self.properties = existing.duplicate()
 
+    @classmethod
+    def initialize_model(cls):
+        """Set up the maintenance of :attr:`Properties.share_count`, and
+        the invalidation of :meth:`merged_properties_view`.
+
+        The count is updated whenever :attr:`properties` is assigned,
+        and upon deletion.
+        """
+        super(PhysObj, cls).initialize_model()
+        # AnyBlok wraps fields, we need the actual mapped attribute
+        table = cls.__table__
+        for rel in orm.class_mapper(cls).relationships:
+            if table.c.properties_id in rel.local_columns:
+                event.listen(rel.class_attribute, 'set',
+                             cls._share_count_properties_set,
+                             active_history=True)
+        event.listen(cls.registry.session, 'before_flush',
+                     cls._share_count_before_flush)
+        event.listen(cls.registry.session, 'after_flush',
+                     cls._merged_props_after_flush)
+        # expiration happens, e.g., at commit, rollback, and after
+        # bulk_update_properties()
+        event.listen(cls, 'expire', cls.invalidate_merged_properties)
+        event.listen(cls, 'refresh', cls.invalidate_merged_properties)
+
+    @classmethod
+    def _share_count_properties_set(cls, target, value, oldvalue, initiator):
+        if value is oldvalue:
+            return
+        target.invalidate_merged_properties()
+        if isinstance(oldvalue, cls.registry.Wms.PhysObj.Properties):
+            oldvalue.incr_share_count(-1)
+        if value is not None:
+            value.incr_share_count(1)
+
+    @classmethod
+    def _share_count_before_flush(cls, session, flush_context, instances):
+        for obj in session.deleted:
+            if not isinstance(obj, cls):
+                continue
+            props = obj.properties
+            if props is not None and props not in session.deleted:
+                props.incr_share_count(-1)
+
     def set_property(self, k, v):
         """Property setter.
 
@@ -185,12 +294,18 @@ class PhysObj:
         will duplicate them before actually setting the wished value.
         """
         existing_props = self.properties
+        if self.registry.Wms.PhysObj.Properties.interning:
+            if existing_props is None or existing_props.get(
+                    k, _missing) != v:
+                self._update_interned_props(((k, v), ))
+            return
         if existing_props is None:
             self.properties = self.registry.Wms.PhysObj.Properties(
                 flexible=dict())
         elif existing_props.get(k) != v:
             self._maybe_duplicate_props()
         self.properties.set(k, v)
+        self.invalidate_merged_properties()
 
     def update_properties(self, mapping):
         """Update Properties in one shot, similar to :meth:`dict.update`
@@ -221,8 +336,130 @@ class PhysObj:
         if not actual_upd:
             return
 
+        if self.registry.Wms.PhysObj.Properties.interning:
+            self._update_interned_props(actual_upd)
+            return
         self._maybe_duplicate_props()
         self.properties.update(actual_upd)
+        self.invalidate_merged_properties()
+
+    @classmethod
+    def bulk_update_properties(cls, targets, mapping):
+        """Update Properties of many PhysObj at once, similar to
+        :meth:`update_properties`.
+
+        :param targets: a query of PhysObj, or an iterable of their ids
+        :param dict mapping: the properties to set
+
+        The PhysObj are grouped by their current Properties records, and:
+
+        - a Properties record that is used by targets only is updated
+          in place.
+        - a Properties record that is shared with other PhysObj is
+          duplicated once, and the targets that use it get the copy.
+        - the targets that don't have Properties get a single new
+          Properties record.
+        - in :attr:`interning <Properties.interning>` mode, the targets get
+          the interned records of the updated contents instead.
+
+        The reassignments are done with a single ``UPDATE ... FROM``, and
+        so is the update of the contents, merging ``mapping`` into
+        :attr:`flexible <Properties.flexible>` with the ``||`` operator.
+        The number of other queries depends only on the number of
+        Properties records that need to be created.
+
+        All ORM instances are expired afterwards.
+        """
+        if not mapping:
+            return
+        Properties = cls.Properties
+        columns, flexible = Properties.split_properties(mapping)
+        cls.registry.flush()
+        execute = cls.registry.execute
+        physobj = cls.__table__
+        props = Properties.__table__
+
+        if hasattr(targets, 'with_entities'):
+            targets = targets.with_entities(cls.id).subquery()
+            targeted = physobj.c.id.in_(select([targets.c.id]))
+        else:
+            targeted = physobj.c.id.in_(list(targets))
+
+        groups = execute(
+            select([props.c.id, props.c.share_count,
+                    func.count(physobj.c.id)])
+            .select_from(physobj.outerjoin(
+                props, props.c.id == physobj.c.properties_id))
+            .where(targeted)
+            .group_by(props.c.id, props.c.share_count)).fetchall()
+
+        replacements = cls._bulk_props_replacements(groups, mapping)
+        cls.registry.flush()
+
+        if None in replacements:
+            execute(physobj.update().where(targeted).where(
+                physobj.c.properties_id.is_(None)).values(
+                    properties_id=replacements.pop(None)))
+        if replacements:
+            repl = union_all(*(
+                select([literal(old).label('old_id'),
+                        literal(new).label('new_id')])
+                for old, new in replacements.items())).alias('repl')
+            execute(physobj.update().where(targeted).where(
+                physobj.c.properties_id == repl.c.old_id).values(
+                    properties_id=repl.c.new_id))
+
+        if not Properties.interning:
+            values = dict(columns)
+            if flexible:
+                values['flexible'] = func.coalesce(
+                    props.c.flexible, literal({}, type_=JSONB)).op('||')(
+                        literal(flexible, type_=JSONB))
+            execute(props.update().where(props.c.id.in_(
+                select([physobj.c.properties_id]).where(targeted))).values(
+                    **values))
+
+        involved = set(replacements)
+        involved.update(replacements.values())
+        involved.update(row[0] for row in groups if row[0] is not None)
+        Properties.refresh_share_counts(ids=involved)
+        cls.registry.session.expire_all()
+
+    @classmethod
+    def _bulk_props_replacements(cls, groups, mapping):
+        """Create the Properties records for :meth:`bulk_update_properties`.
+
+        :param groups: rows of (Properties id, share count, count of targets)
+        :return: new Properties ids, by the ids they replace (``None`` for
+                 targets without Properties)
+        """
+        Properties = cls.Properties
+        replacements = {}
+        for props_id, share_count, count in groups:
+            if props_id is None:
+                replacements[None] = Properties.create(**mapping).id
+            elif Properties.interning:
+                content = Properties.query().get(props_id).as_dict()
+                content.update(mapping)
+                replacements[props_id] = Properties.create(**content).id
+            elif count < share_count:
+                replacements[props_id] = Properties.query().get(
+                    props_id).duplicate().id
+        return replacements
+
+    def _update_interned_props(self, items):
+        """Internal method to update Properties in interning mode.
+
+        Instead of mutating, the updated content is looked up or
+        created by :meth:`Properties.create`.
+
+        :param items: iterable of (key, value) pairs
+        """
+        existing = self.properties
+        content = {} if existing is None else existing.as_dict()
+        content.update(items)
+        self.properties = self.registry.Wms.PhysObj.Properties.create(
+            **content)
 
     def has_property(self, name):
         """Check if a Property with given name is present."""
@@ -325,24 +562,94 @@ class PhysObj:
                          Avatar, Avatar.obj_id == child.id).filter(
                              Avatar.location_id == parent.c.id)
 
-        # taking additional states and datetime query into account
+        tail = cls._flatten_containers_tail_filter(
+            tail, additional_states=additional_states, at_datetime=at_datetime)
+        cte = cte.union_all(tail)
+        return cte
+
+    @classmethod
+    def flatten_containers_tops_subquery(cls, tops,
+                                         additional_states=None,
+                                         at_datetime=None):
+        """Flatten the containment graph below several tops at once.
+
+        This is the same as :meth:`flatten_containers_subquery`, except that
+        it has two columns: ``top_id`` and ``id``, the former
+        telling below which of the given tops the latter is, so that
+        several top locations can be dealt with in a single query.
+
+        A given container may appear below several of the tops.
+
+        :param tops: iterable of containers, all of them are included in
+                     the results, with themselves as ``top_id``.
+
+        As for :meth:`flatten_containers_subquery`, it is possible to
+        override this method with anything providing the same columns.
+        """
+        Avatar = cls.Avatar
+        query = cls.registry.session.query
+        cte = cls.query(cls.id.label('top_id'), cls.id).filter(
+            cls.id.in_(set(top.id for top in tops))).cte(name="container",
+                                                         recursive=True)
+        parent = orm.aliased(cte, name='parent')
+        child = orm.aliased(cls, name='child')
+        tail = query(parent.c.top_id, child.id).join(
+            Avatar, Avatar.obj_id == child.id).filter(
+                Avatar.location_id == parent.c.id)
+        tail = cls._flatten_containers_tail_filter(
+            tail, additional_states=additional_states, at_datetime=at_datetime)
+        return cte.union_all(tail)
+
+    @classmethod
+    def flatten_containers_series_subquery(cls, top, at_datetimes,
+                                           additional_states=None):
+        """Flatten the containment graph for several dates and times at once.
+
+        This is a variant of :meth:`flatten_containers_subquery` for
+        :meth:`Wms.quantity_series
+        <anyblok_wms_base.core.wms.Wms.quantity_series>`.
+
+        :param at_datetimes: selectable with ``idx`` and ``at_datetime``
+                             columns
+        :return: a recursive CTE, whose columns are ``idx``,
+                 ``at_datetime``, and ``id``, the latter being the ids of
+                 the containers that are below ``top`` at ``at_datetime``.
+        """
+        Avatar = cls.Avatar
+        query = cls.registry.session.query
+        cte = query(at_datetimes.c.idx,
+                    at_datetimes.c.at_datetime,
+                    literal(top.id).label('id')).cte(name='container',
+                                                     recursive=True)
+        parent = orm.aliased(cte, name='parent')
+        child = orm.aliased(cls, name='child')
+        tail = query(parent.c.idx, parent.c.at_datetime, child.id).join(
+            Avatar, Avatar.obj_id == child.id).filter(
+                Avatar.location_id == parent.c.id,
+                Avatar.dt_range.op('@>')(parent.c.at_datetime))
+        tail = cls._flatten_containers_tail_filter(
+            tail, additional_states=additional_states)
+        return cte.union_all(tail)
+
+    @classmethod
+    def _flatten_containers_tail_filter(cls, tail,
+                                        additional_states=None,
+                                        at_datetime=None):
+        """Apply Avatar states and date/time filtering for recursive CTEs.
+        """
         # TODO, this location part is very redundant with what's done in
         # Wms.quantity() itself for the PhysObj been counted,
         # we should refactor
+        Avatar = cls.Avatar
         if additional_states is None:
             tail = tail.filter(Avatar.state == 'present')
         else:
             tail = tail.filter(Avatar.state.in_(
                 ('present', ) + tuple(additional_states)))
 
-        if at_datetime is DATE_TIME_INFINITY:
-            tail = tail.filter(Avatar.dt_until.is_(None))
-        elif at_datetime is not None:
-            tail = tail.filter(Avatar.dt_from <= at_datetime,
-                               or_(Avatar.dt_until.is_(None),
-                                   Avatar.dt_until > at_datetime))
-        cte = cte.union_all(tail)
-        return cte
+        if at_datetime is not None:
+            tail = tail.filter(Avatar.at_datetime_criterion(at_datetime))
+        return tail
 
     def is_container(self):
         return self.type.is_container()
@@ -351,6 +658,49 @@ class PhysObj:
 _empty_dict = {}
 
 
+def _typed_json_value(value):
+    """JSON serialization fallback, keeping track of the type of ``value``.
+    """
+    vtype = type(value)
+    return {'__type__': vtype.__module__ + '.' + vtype.__qualname__,
+            '__value__': str(value)}
+
+
+def _canonical_number(value):
+    """Return a canonical form of a number, for JSON serialization.
+
+    Numbers that are equal once stored in PostgreSQL (e.g., ``1``,
+    ``1.0`` and ``Decimal('1.00')``) end up equal: integral values become
+    :class:`int`, and other values :class:`float`, unless that would
+    lose precision, in which case a normalized :class:`Decimal` is kept.
+    """
+    if isinstance(value, int):
+        return value
+    dec = value if isinstance(value, Decimal) else Decimal(repr(value))
+    if not dec.is_finite():
+        return value
+    if dec == dec.to_integral_value():
+        return int(dec)
+    as_float = float(dec)
+    if Decimal(repr(as_float)) == dec:
+        return as_float
+    return dec.normalize()
+
+
+def _canonical_numbers(obj):
+    """Apply :func:`_canonical_number` to all numbers in a JSON-like value.
+    """
+    if isinstance(obj, bool):
+        return obj
+    if isinstance(obj, (int, float, Decimal)):
+        return _canonical_number(obj)
+    if isinstance(obj, dict):
+        return {k: _canonical_numbers(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_canonical_numbers(v) for v in obj]
+    return obj
+
+
 @register(Model.Wms.PhysObj)
 class Properties:
     """Properties of PhysObj.
@@ -382,6 +732,56 @@ class Properties:
     id = Integer(label="Identifier", primary_key=True)
     """Primary key."""
 
+    interning = False
+    """If ``True``, Properties records are interned.
+
+    This means that :meth:`create` reuses an existing record if there's
+    one with the same contents, and that interned records are immutable:
+    :meth:`PhysObj.set_property` and :meth:`PhysObj.update_properties`
+    then replace them rather than updating them.
+
+    Identity of contents is assessed with the help of
+    :attr:`content_hash`.
+
+    This is disabled by default. Applications enable it by overriding
+    the present Model::
+
+      @register(Model.Wms.PhysObj)
+      class Properties:
+          interning = True
+
+    Records created before that aren't interned, but get replaced by
+    interned ones as soon as they are updated through :class:`PhysObj`.
+    """
+
+    RESERVED_NAMES = ('id', 'flexible', 'content_hash', 'share_count')
+    """Names of fields that can't be used as properties."""
+
+    CONTENT_HASH_INDEX = 'idx_wms_physobj_properties_content_hash'
+    """Name of the unique index on :attr:`content_hash`."""
+
+    content_hash = Text(label="Hash of contents")
+    """Canonical hash of the contents, for interned records only.
+
+    This is ``None`` for records that aren't interned, and unique
+    among those that are (see :attr:`interning` and
+    :meth:`canonical_hash`).
+    """
+
+    share_count = Integer(label="Number of PhysObj using these Properties",
+                          default=0, nullable=False)
+    """Number of :class:`PhysObj` records whose :attr:`PhysObj.properties`
+    are the present ones.
+
+    This is maintained by :class:`PhysObj`, and allows it to decide
+    whether to copy on write without any query. The updates are done in
+    SQL (``share_count = share_count + 1``), to avoid losing concurrent
+    ones, hence the value has to be read again after flushing.
+
+    Massive changes that bypass the ORM must be followed by a call to
+    :meth:`refresh_share_counts`.
+    """
+
     flexible = Jsonb(label="Flexible properties")
     """Flexible properties.
 
@@ -394,11 +794,55 @@ class Properties:
               constants in a module
     """
 
+    FLEXIBLE_INDEX = 'idx_wms_physobj_properties_flexible'
+    """Name of the GIN index on :attr:`flexible`."""
+
+    @classmethod
+    def define_table_args(cls):
+        """Add a GIN index on :attr:`flexible` and a unique one for interning.
+
+        The GIN index uses the ``jsonb_path_ops`` operator class, which is
+        smaller and faster than the default one, but supports only the
+        ``@>`` (containment) operator, as used by :meth:`query_criteria`.
+
+        The unique index on :attr:`content_hash` is partial, restricted
+        to interned records.
+        """
+        return super(Properties, cls).define_table_args() + (
+            Index(cls.FLEXIBLE_INDEX, 'flexible',
+                  postgresql_using='gin',
+                  postgresql_ops=dict(flexible='jsonb_path_ops')),
+            Index(cls.CONTENT_HASH_INDEX, 'content_hash',
+                  unique=True,
+                  postgresql_where=text("content_hash IS NOT NULL")),
+        )
+
+    @classmethod
+    def query_criteria(cls, properties):
+        """SQL criteria for Properties having the given values.
+
+        :param dict properties: the wished values, by property name.
+        :return: list of criteria, to be passed to ``filter()`` in a query
+                 involving the present Model (not aliased).
+
+        Field backed properties are compared directly, whereas the
+        remaining ones are looked up with the ``@>`` operator
+        on :attr:`flexible`, which is backed by a GIN index
+        (see :meth:`define_table_args`).
+        """
+        props = dict(properties)
+        criteria = [getattr(cls, p) == props.pop(p)
+                    for p in set(props).intersection(
+                        cls._field_property_names())]
+        if props:
+            criteria.append(cls.flexible.contains(props))
+        return criteria
+
     @classmethod
     def _field_property_names(cls):
         """Iterable over the names of properties that are fields."""
         return (f for f in cls._fields_description()
-                if f not in ('id', 'flexible'))
+                if f not in cls.RESERVED_NAMES)
 
     def as_dict(self):
         """Return the properties as a ``dict``.
@@ -432,10 +876,15 @@ class Properties:
                 return default[0]
             return None
 
+    def _check_mutable(self):
+        if self.content_hash is not None:
+            raise ValueError("Can't mutate interned %r" % self)
+
     def __setitem__(self, k, v):
-        if k in ('id', 'flexible'):
+        if k in self.RESERVED_NAMES:
             raise ValueError("The key %r is reserved, and can't be used "
                              "as a property name" % k)
+        self._check_mutable()
         if k in self.fields_description():
             setattr(self, k, v)
         else:
@@ -448,12 +897,13 @@ class Properties:
     set = __setitem__  # backwards compatibility
 
     def __delitem__(self, k):
-        if k in ('id', 'flexible'):
+        if k in self.RESERVED_NAMES:
             raise ValueError("The key %r is reserved, can't be used "
                              "as a property name and hence can't "
                              "be deleted " % k)
         if k in self._field_property_names():
             raise ValueError("Can't delete field backed property %r" % k)
+        self._check_mutable()
 
         if self.flexible is None:
             raise KeyError(k)
@@ -462,12 +912,13 @@ class Properties:
         flag_modified(self, '__anyblok_field_flexible')
 
     def pop(self, k, *default):
-        if k in ('id', 'flexible'):
+        if k in self.RESERVED_NAMES:
             raise ValueError("The key %r is reserved, can't be used "
                              "as a property name and hence can't "
                              "be deleted " % k)
         if k in self._field_property_names():
             raise ValueError("Can't delete field backed property %r" % k)
+        self._check_mutable()
 
         if self.flexible is None:
             return _empty_dict.pop(k, *default)
@@ -477,12 +928,210 @@ class Properties:
         return res
 
     def duplicate(self):
-        """Insert a copy of ``self`` and return its id."""
+        """Insert a copy of ``self`` and return it.
+
+        The copy is not interned, hence mutable. In :attr:`interning` mode,
+        interned records are returned as is, as they can be shared anyway.
+        """
+        if self.interning and self.content_hash is not None:
+            return self
         fields = {k: getattr(self, k)
                   for k in self._field_property_names()
                   }
         return self.insert(flexible=deepcopy(self.flexible), **fields)
 
+    def incr_share_count(self, delta):
+        """Increment :attr:`share_count`, atomically for persistent records.
+        """
+        current = self.share_count
+        if isinstance(current, ClauseElement):
+            self.share_count = current + delta
+        elif orm.attributes.instance_state(self).has_identity:
+            self.share_count = self.__class__.share_count + delta
+        else:
+            self.share_count = (current or 0) + delta
+
+    @classmethod
+    def refresh_share_counts(cls, ids=None):
+        """Recompute :attr:`share_count`.
+
+        :param ids: if specified, restricts the recomputation to the
+                    Properties records with these ids, and only their
+                    :attr:`share_count` is expired in the session.
+                    Otherwise, the whole session is expired.
+        """
+        cls.registry.flush()
+        props = cls.__table__
+        physobj = cls.registry.Wms.PhysObj.__table__
+        count = select([func.count(physobj.c.id)]).where(
+            physobj.c.properties_id == props.c.id).as_scalar()
+        update = props.update().values(share_count=count)
+        session = cls.registry.session
+        if ids is None:
+            cls.registry.execute(update)
+            session.expire_all()
+            return
+
+        cls.registry.execute(update.where(props.c.id.in_(ids)))
+        for record in cls.registry.Wms.loaded_records(cls, ids):
+            session.expire(record, ['share_count'])
+
+    @classmethod
+    def orphan_criteria(cls):
+        """Criteria telling that a Properties record isn't referenced.
+
+        :return: list of SQL expressions, to be combined with ``AND``,
+                 about the :attr:`id` column of the Properties table.
+
+        The base implementation checks that no PhysObj refers to the
+        record. Bloks that add references to Properties must override this
+        to protect their own, lest :meth:`collect_garbage` deletes them.
+        """
+        props = cls.__table__
+        physobj = cls.registry.Wms.PhysObj.__table__
+        return [~select([physobj.c.id]).where(
+            physobj.c.properties_id == props.c.id).exists()]
+
+    @classmethod
+    def collect_garbage(cls, batch_size=1000, dry_run=False, start_after=None,
+                        max_batches=None, commit=False):
+        """Delete Properties records that aren't referenced any more.
+
+        The table is walked in order of :attr:`id`, by batches of
+        ``batch_size`` orphaned records.
+
+        :param bool dry_run: if ``True``, nothing gets deleted nor locked,
+                             the orphans are only counted.
+        :param int start_after: only consider records whose :attr:`id` is
+                                greater, typically the ``last_id`` returned
+                                by a previous interrupted run.
+        :param int max_batches: if specified, stop after that many batches,
+                                allowing to resume later with
+                                ``start_after``.
+        :param bool commit: if ``True``, the current transaction is
+                            committed after each batch, including any
+                            pending work of the caller, which can't be
+                            rolled back afterwards. This keeps locks short
+                            under concurrency, and is meant for dedicated
+                            maintenance processes. By default, nothing is
+                            committed: all batches run in the caller's
+                            transaction, holding their locks until it ends.
+        :return: ``dict`` with the number of ``orphans`` (deleted unless
+                 ``dry_run``), the ``last_id`` seen, and ``done``, telling
+                 whether the end of the table has been reached.
+
+        Candidate records are locked with ``FOR UPDATE SKIP LOCKED``, and
+        the criteria of :meth:`orphan_criteria` are evaluated again by the
+        ``DELETE`` statement, so that records that concurrent transactions
+        are about to reference (foreign key checks take a lock on them)
+        are either skipped or left alone. Skipped records will be
+        collected by a later run.
+
+        The ORM session is expired after deletion.
+        """
+        cls.registry.flush()
+        execute = cls.registry.execute
+        props = cls.__table__
+        criteria = cls.orphan_criteria()
+        res = dict(orphans=0, last_id=start_after, done=False)
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            query = select([props.c.id]).where(and_(*criteria))
+            if res['last_id'] is not None:
+                query = query.where(props.c.id > res['last_id'])
+            query = query.order_by(props.c.id).limit(batch_size)
+            if not dry_run:
+                query = query.with_for_update(skip_locked=True)
+            ids = [row[0] for row in execute(query)]
+            if not ids:
+                res['done'] = True
+                break
+            batches += 1
+            res['last_id'] = ids[-1]
+            if dry_run:
+                res['orphans'] += len(ids)
+                continue
+            res['orphans'] += execute(props.delete().where(
+                and_(props.c.id.in_(ids), *criteria))).rowcount
+            if commit:
+                cls.registry.commit()
+
+        if not dry_run:
+            cls.registry.session.expire_all()
+        return res
+
+    @classmethod
+    def canonical_hash(cls, columns, flexible):
+        """Compute the canonical hash of some Properties contents.
+
+        :param dict columns: values of field based properties. Missing
+                             fields are considered to be ``None``.
+        :param dict flexible: the other properties
+        :return: hexadecimal SHA-256 of a canonical JSON serialization.
+                 Values that aren't natively JSON serializable are
+                 serialized with :func:`str`, together with the qualified
+                 name of their type, so that, e.g., a :class:`date
+                 <datetime.date>` doesn't have the same hash as its string
+                 form. Numbers are compared by value, as PostgreSQL does,
+                 so that, e.g., ``Decimal('1.50')`` read from a column
+                 has the same hash as ``1.5`` in Python code.
+        """
+        columns = {f: columns.get(f) for f in cls._field_property_names()}
+        # first pass for keys that aren't strings (and values)
+        content = json.loads(json.dumps(
+            _canonical_numbers([columns, flexible]),
+            default=_typed_json_value))
+        return hashlib.sha256(
+            json.dumps(content, sort_keys=True,
+                       separators=(',', ':')).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _intern(cls, columns, flexible):
+        """Return an interned record with the given contents.
+
+        This takes care of concurrent insertions of the same contents.
+        """
+        content_hash = cls.canonical_hash(columns, flexible)
+        # the lock prevents the garbage collector from deleting it until
+        # the end of the transaction
+        existing = cls.query().filter_by(
+            content_hash=content_hash).with_for_update(
+                read=True, key_share=True).first()
+        if existing is not None:
+            return existing
+        try:
+            with cls.registry.begin_nested():
+                return cls.insert(flexible=flexible,
+                                  content_hash=content_hash,
+                                  **columns)
+        except IntegrityError:
+            return cls.query().filter_by(content_hash=content_hash).one()
+
+    @classmethod
+    def split_properties(cls, props):
+        """Sort properties between fields and :attr:`flexible`.
+
+        :param dict props: values, by property name
+        :return: pair of :class:`dict` instances, the first for field based
+                 properties, the second for those that go in
+                 :attr:`flexible`.
+        :raises: ValueError if some of ``props`` keys are reserved.
+        """
+        fields = set(cls._field_property_names())
+        columns = {}
+        flexible = {}
+        forbidden = cls.RESERVED_NAMES
+        for k, v in props.items():
+            if k in forbidden:
+                raise ValueError(
+                    "The key %r is reserved, and can't be used as "
+                    "a property key" % k)
+            if k in fields:
+                columns[k] = v
+            else:
+                flexible[k] = v
+        return columns, flexible
+
     @classmethod
     def create(cls, **props):
         """Direct creation.
@@ -499,23 +1148,16 @@ class Properties:
         This may seem trivial, but it spares a test for callers that would
         pass a ``dict``, using the ``**`` syntax, which could turn out to
         be empty.
+
+        In :attr:`interning` mode, an existing record with the same
+        contents is returned if there is one.
         """
         if not props:
             return
 
-        fields = set(cls._field_property_names())
-        columns = {}
-        flexible = {}
-        forbidden = ('id', 'flexible')
-        for k, v in props.items():
-            if k in forbidden:
-                raise ValueError(
-                    "The key %r is reserved, and can't be used as "
-                    "a property key" % k)
-            if k in fields:
-                columns[k] = v
-            else:
-                flexible[k] = v
+        columns, flexible = cls.split_properties(props)
+        if cls.interning:
+            return cls._intern(columns, flexible)
         return cls.insert(flexible=flexible, **columns)
 
     def update(self, *args, **kwargs):
@@ -680,6 +1322,94 @@ class Avatar:
     column.
     """
 
+    dt_range = Function(fget='_dt_range_get', fexpr='_dt_range_expr')
+    """Date and time range of the Avatar, as a PostgreSQL ``tstzrange``.
+
+    This is made of :attr:`dt_from` (inclusive) and :attr:`dt_until`
+    (exclusive), ``None`` for the latter meaning +infinity, exactly as
+    the default ``'[)'`` bounds of ``tstzrange`` do.
+
+    On instances, this simply returns the ``(dt_from, dt_until)`` pair.
+
+    The SQL expression is backed by a GiST index
+    (see :meth:`define_table_args`),
+    hence filtering with the ``@>`` (containment) operator on it, as
+    :meth:`at_datetime_criterion` does, can use that index. Since it's an
+    expression index, there is no extra column to maintain.
+    """
+
+    DT_RANGE_INDEX = 'idx_wms_physobj_avatar_dt_range'
+    """Name of the GiST index backing :attr:`dt_range`."""
+
+    NOT_PAST_INDEXES = (
+        ('idx_wms_physobj_avatar_not_past_location', ('location_id', 'state')),
+        ('idx_wms_physobj_avatar_not_past_obj', ('obj_id', )),
+        ('idx_wms_physobj_avatar_not_past_reason', ('reason_id', )),
+    )
+    """Names and columns of the partial indexes restricted to non past states.
+
+    See :meth:`define_table_args`. Their effect on the hot queries can be
+    measured on a generated history-heavy dataset with the
+    ``benchmarks/avatar_partial_indexes.py`` script of the source
+    distribution, which compares best-of-N timings with and without them,
+    in alternate order.
+    """
+
+    @classmethod
+    def define_table_args(cls):
+        """Add the GiST index on :attr:`dt_range` and partial indexes.
+
+        The indexed expression of the GiST index must stay in sync with
+        :meth:`_dt_range_expr`, otherwise the planner won't recognize it.
+
+        Over time, most Avatars are in the ``past`` state, whereas most
+        queries (quantities, :attr:`outcomes
+        <anyblok_wms_base.core.operation.base.Operation.outcomes>`,
+        reservation lookups, containers recursion) are about the
+        ``present`` and ``future`` ones. The partial indexes listed in
+        :attr:`NOT_PAST_INDEXES` are restricted to the latter: they stay
+        small and can be used for any condition on :attr:`state` that
+        excludes ``past`` (e.g., ``state = 'present'``,
+        ``state IN ('present', 'future')`` or ``state != 'past'``).
+
+        The plain indexes on the same columns are kept for queries about
+        the past, and for foreign keys.
+        """
+        not_past = text("state != 'past'")
+        return super(Avatar, cls).define_table_args() + (
+            Index(cls.DT_RANGE_INDEX,
+                  text('tstzrange(dt_from, dt_until)'),
+                  postgresql_using='gist'),
+        ) + tuple(Index(name, *cols, postgresql_where=not_past)
+                  for name, cols in cls.NOT_PAST_INDEXES)
+
+    def _dt_range_get(self):
+        return self.dt_from, self.dt_until
+
+    @classmethod
+    def _dt_range_expr(cls):
+        return func.tstzrange(cls.dt_from, cls.dt_until, type_=TSTZRANGE)
+
+    @classmethod
+    def at_datetime_criterion(cls, at_datetime):
+        """SQL criterion for Avatars whose date/time range contains a value.
+
+        :param at_datetime: a :class:`datetime` or
+                            ``anyblok_wms_base.constants.DATE_TIME_INFINITY``,
+                            the latter selecting the Avatars whose
+                            :attr:`dt_until` is ``None``, or a SQL column
+                            expression of date/time values.
+
+        This is meant to be passed to ``filter()`` in queries involving
+        Avatars (not aliased).
+        """
+        if at_datetime is DATE_TIME_INFINITY:
+            return cls.dt_until.is_(None)
+        # explicit cast, because naive datetimes would otherwise be
+        # sent as 'timestamp', for which @> on tstzrange is not defined
+        return cls.dt_range.op('@>')(
+            cast(at_datetime, TIMESTAMP(timezone=True)))
+
     def _goods_get(self):
         deprecation_warn_goods()
         return self.obj
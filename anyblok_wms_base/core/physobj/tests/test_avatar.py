@@ -6,6 +6,10 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
+from datetime import datetime
+from sqlalchemy import text
+
+from anyblok_wms_base.constants import DATE_TIME_INFINITY
 from anyblok_wms_base.testing import WmsTestCaseWithPhysObj
 
 
@@ -45,6 +49,66 @@ class TestAvatar(WmsTestCaseWithPhysObj):
         self.assertEqual(avatar.get_property('foo'), [1])
         self.assertEqual(avatar.get_property('bar', default='graal'), 'graal')
 
+    def test_dt_range(self):
+        avatar = self.avatar
+        self.assertEqual(avatar.dt_range, (self.dt_test1, None))
+
+        Avatar = self.Avatar
+        query = Avatar.query().filter(Avatar.id == avatar.id)
+        self.assertEqual(
+            query.filter(Avatar.at_datetime_criterion(self.dt_test1)).all(),
+            [avatar])
+        self.assertEqual(
+            query.filter(Avatar.at_datetime_criterion(self.dt_test3)).all(),
+            [avatar])
+        self.assertEqual(
+            query.filter(Avatar.at_datetime_criterion(
+                DATE_TIME_INFINITY)).all(),
+            [avatar])
+
+        avatar.dt_until = self.dt_test2
+        self.assertEqual(
+            query.filter(Avatar.at_datetime_criterion(self.dt_test1)).all(),
+            [avatar])
+        # dt_until is exclusive
+        self.assertEqual(
+            query.filter(Avatar.at_datetime_criterion(self.dt_test2)).all(),
+            [])
+        self.assertEqual(
+            query.filter(Avatar.at_datetime_criterion(
+                DATE_TIME_INFINITY)).all(),
+            [])
+        # dt_from is inclusive, and before it, there's nothing
+        self.assertEqual(
+            query.filter(Avatar.at_datetime_criterion(
+                datetime(2017, 12, 31, tzinfo=self.tz))).all(),
+            [])
+
+    def test_dt_range_index(self):
+        """The GiST index on the dt_range expression does exist."""
+        indexdef = self.registry.execute(
+            text("SELECT indexdef FROM pg_indexes "
+                 "WHERE tablename='wms_physobj_avatar' "
+                 "AND indexname=:name"),
+            dict(name=self.Avatar.DT_RANGE_INDEX)).fetchone()
+        self.assertIsNotNone(indexdef)
+        self.assertIn('gist', indexdef[0].lower())
+
+    def test_not_past_indexes(self):
+        """The partial indexes restricted to non past Avatars do exist."""
+        for name, cols in self.Avatar.NOT_PAST_INDEXES:
+            indexdef = self.registry.execute(
+                text("SELECT indexdef FROM pg_indexes "
+                     "WHERE tablename='wms_physobj_avatar' "
+                     "AND indexname=:name"),
+                dict(name=name)).fetchone()
+            self.assertIsNotNone(indexdef, name)
+            indexdef = indexdef[0]
+            self.assertIn('WHERE', indexdef)
+            self.assertIn("'past'", indexdef)
+            for col in cols:
+                self.assertIn(col, indexdef)
+
     def test_compatibility_goods_field(self):
         """Test compatibility function field for the rename goods->obj.
 
@@ -129,6 +129,126 @@ class TestPhysObj(BlokTestCase):
         goods2.update_properties(upd)
         self.assertEqual(goods.properties, goods2.properties)
 
+    def test_properties_share_count(self):
+        Properties = self.PhysObj.Properties
+        props = Properties.create(batch='12345')
+        other = Properties.create(batch='6789')
+        self.assertEqual(props.share_count, 0)
+
+        goods = [self.PhysObj.insert(type=self.goods_type, properties=props)
+                 for _ in range(3)]
+        self.registry.flush()
+        self.assertEqual(props.share_count, 3)
+
+        goods[0].properties = other
+        goods[1].properties = None
+        self.registry.flush()
+        self.assertEqual(props.share_count, 1)
+        self.assertEqual(other.share_count, 1)
+
+        goods[0].delete()
+        self.assertEqual(other.share_count, 0)
+
+        # not shared any more, hence no duplication
+        goods[2].set_property('batch', '2468')
+        self.assertEqual(goods[2].properties, props)
+
+        # direct SQL changes
+        self.registry.execute(
+            "UPDATE wms_physobj_properties SET share_count=0")
+        Properties.refresh_share_counts()
+        self.assertEqual(props.share_count, 1)
+        self.assertEqual(other.share_count, 0)
+
+    def test_bulk_update_properties(self):
+        PhysObj = self.PhysObj
+        Properties = PhysObj.Properties
+        shared = Properties.create(batch='abc', foo=1)
+        own = Properties.create(batch='def')
+
+        outsider = PhysObj.insert(type=self.goods_type, properties=shared)
+        sharing = [PhysObj.insert(type=self.goods_type, properties=shared)
+                   for _ in range(2)]
+        owning = PhysObj.insert(type=self.goods_type, properties=own)
+        bare = [PhysObj.insert(type=self.goods_type) for _ in range(2)]
+        targets = sharing + [owning] + bare
+
+        PhysObj.bulk_update_properties([g.id for g in targets],
+                                       dict(batch='new', bar=2))
+
+        self.assertEqual(outsider.properties, shared)
+        self.assertEqual(shared.as_dict(), dict(batch='abc', foo=1))
+        self.assertEqual(shared.share_count, 1)
+
+        # copy shared by the targets that were sharing
+        self.assertNotEqual(sharing[0].properties, shared)
+        self.assertEqual(sharing[0].properties, sharing[1].properties)
+        self.assertEqual(sharing[0].properties.as_dict(),
+                         dict(batch='new', foo=1, bar=2))
+        self.assertEqual(sharing[0].properties.share_count, 2)
+
+        # updated in place
+        self.assertEqual(owning.properties, own)
+        self.assertEqual(own.as_dict(), dict(batch='new', bar=2))
+
+        # single creation
+        self.assertEqual(bare[0].properties, bare[1].properties)
+        self.assertEqual(bare[0].properties.as_dict(),
+                         dict(batch='new', bar=2))
+        self.assertEqual(bare[0].properties.share_count, 2)
+
+    def test_bulk_update_properties_query(self):
+        PhysObj = self.PhysObj
+        other_type = PhysObj.Type.insert(code='other')
+        props = PhysObj.Properties.create(batch='abc')
+        targets = [PhysObj.insert(type=self.goods_type, properties=props)
+                   for _ in range(2)]
+        other = PhysObj.insert(type=other_type, properties=props)
+
+        PhysObj.bulk_update_properties(
+            PhysObj.query().filter_by(type=self.goods_type),
+            dict(batch='xyz'))
+        self.assertEqual(targets[0].properties, targets[1].properties)
+        self.assertEqual(targets[0].get_property('batch'), 'xyz')
+        self.assertEqual(other.get_property('batch'), 'abc')
+
+    def test_properties_collect_garbage(self):
+        Properties = self.PhysObj.Properties
+        # leftovers from other tests or data loading. Nothing gets
+        # committed by default.
+        Properties.collect_garbage()
+
+        used = Properties.create(batch='used')
+        goods = self.PhysObj.insert(type=self.goods_type, properties=used)
+        orphans = [Properties.create(batch=str(i)) for i in range(5)]
+        orphan_ids = [o.id for o in orphans]
+        gone = self.PhysObj.insert(type=self.goods_type,
+                                   properties=orphans[0])
+        gone.delete()
+
+        self.assertEqual(
+            Properties.collect_garbage(dry_run=True, batch_size=2),
+            dict(orphans=5, last_id=orphan_ids[-1], done=True))
+        self.assertEqual(
+            Properties.query().filter(Properties.id.in_(orphan_ids)).count(),
+            5)
+
+        # interrupted run and resumption
+        res = Properties.collect_garbage(batch_size=2, max_batches=1,
+                                         commit=False)
+        self.assertEqual(res, dict(orphans=2, last_id=orphan_ids[1],
+                                   done=False))
+        res = Properties.collect_garbage(start_after=res['last_id'],
+                                         batch_size=2, commit=False)
+        self.assertEqual(res['orphans'], 3)
+        self.assertTrue(res['done'])
+
+        self.assertEqual(
+            Properties.query().filter(Properties.id.in_(orphan_ids)).count(),
+            0)
+        self.assertEqual(goods.properties, used)
+        self.assertEqual(used.get('batch'), 'used')
+
     def test_prop_api_reserved_property_names(self):
         goods = self.PhysObj.insert(type=self.goods_type)
 
@@ -154,6 +274,45 @@ class TestPhysObj(BlokTestCase):
                               batch=None),  # always present (column)
                          )
 
+    def test_merged_properties_view(self):
+        parent = self.goods_type
+        parent.properties = dict(holy='arthur', contents=[dict(a=1)])
+        child = self.PhysObj.Type.insert(code='child', parent=parent)
+        goods = self.PhysObj.insert(type=child)
+        self.registry.flush()
+
+        view = goods.merged_properties_view()
+        self.assertEqual(view, dict(holy='arthur', contents=[dict(a=1)]))
+        self.assertIs(goods.merged_properties_view(), view)
+        with self.assertRaises(TypeError):
+            view['holy'] = 'grail'
+        with self.assertRaises(TypeError):
+            view['contents'].append(2)
+
+        # merged_properties() returns a modifiable copy
+        merged = goods.merged_properties()
+        merged['contents'].append(2)
+        self.assertEqual(view['contents'], [dict(a=1)])
+
+        goods.set_property('holy', 'grail')
+        view = goods.merged_properties_view()
+        self.assertEqual(view['holy'], 'grail')
+        self.assertIs(goods.merged_properties_view(), view)
+
+        goods.update_properties(dict(batch='ABC'))
+        self.assertEqual(goods.merged_properties_view()['batch'], 'ABC')
+
+        child.properties = dict(bar=2)
+        self.assertEqual(goods.merged_properties_view(),
+                         dict(holy='grail', bar=2, batch='ABC',
+                              contents=[dict(a=1)]))
+
+        # direct change, taken into account at flush time
+        goods.properties['holy'] = 'hand grenade'
+        self.registry.flush()
+        self.assertEqual(goods.merged_properties_view()['holy'],
+                         'hand grenade')
+
     def test_merged_properties_type_only(self):
         parent = self.goods_type
         child = self.PhysObj.Type.insert(code='child', parent=parent)
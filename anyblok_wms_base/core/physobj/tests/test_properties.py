@@ -11,7 +11,11 @@
 This is not about tests of Wms.PhysObj involving properties
 (for these, see test_goods).
 """
+from datetime import date
+from decimal import Decimal
+import json
 
+from sqlalchemy import text
 from anyblok.tests.testcase import BlokTestCase
 
 
@@ -78,6 +82,8 @@ class TestPhysObjProperties(BlokTestCase):
         self.assertEqual(props.to_dict(),
                          dict(batch='abcd',
                               id=props.id,
+                              content_hash=None,
+                              share_count=0,
                               flexible=dict(serial=1234, expiry='2018-03-01')))
 
         self.assertIsNone(self.Props.create())
@@ -116,6 +122,111 @@ class TestPhysObjProperties(BlokTestCase):
         self.assertEqual(dup.get('history'), ['a', 'b'])
         self.assertEqual(props.get('history'), ['a'])
 
+    def enable_interning(self):
+        self.Props.interning = True
+        self.addCleanup(setattr, self.Props, 'interning', False)
+
+    def test_canonical_hash(self):
+        chash = self.Props.canonical_hash
+        self.assertEqual(chash(dict(batch='abc'), dict(x=1, y=[2, 3])),
+                         chash(dict(batch='abc'), dict(y=[2, 3], x=1)))
+        self.assertEqual(chash({}, {1: 2}), chash({}, {'1': 2}))
+        self.assertEqual(chash({}, {}), chash(dict(batch=None), {}))
+        self.assertNotEqual(chash(dict(batch='abc'), {}),
+                            chash({}, dict(batch='abc')))
+        self.assertNotEqual(chash({}, dict(x=1)), chash({}, dict(x=2)))
+
+        # values that aren't natively JSON serializable keep their type
+        self.assertNotEqual(chash({}, dict(x=date(2019, 1, 2))),
+                            chash({}, dict(x='2019-01-02')))
+        self.assertEqual(chash({}, dict(x=date(2019, 1, 2))),
+                         chash({}, dict(x=date(2019, 1, 2))))
+        self.assertNotEqual(chash({}, dict(x=Decimal('1.5'))),
+                            chash({}, dict(x='1.5')))
+        self.assertNotEqual(chash(dict(batch=date(2019, 1, 2)), {}),
+                            chash(dict(batch='2019-01-02'), {}))
+        # numbers are compared by value
+        self.assertEqual(chash({}, dict(x=Decimal('1'))), chash({}, dict(x=1)))
+        self.assertEqual(chash({}, dict(x=[1.0])), chash({}, dict(x=[1])))
+        self.assertEqual(chash({}, dict(x=Decimal('1.50'))),
+                         chash({}, dict(x=1.5)))
+        self.assertNotEqual(chash({}, dict(x=Decimal('1.5'))),
+                            chash({}, dict(x=Decimal('1.5000000000000001'))))
+        self.assertNotEqual(chash({}, dict(x=True)), chash({}, dict(x=1)))
+
+    def test_interning(self):
+        self.enable_interning()
+        props = self.Props.create(batch='abcd', expiry='2018-07-01')
+        self.assertIsNotNone(props.content_hash)
+        self.assertEqual(self.Props.create(expiry='2018-07-01',
+                                           batch='abcd'), props)
+        other = self.Props.create(batch='abcd', expiry='2018-08-01')
+        self.assertNotEqual(other, props)
+
+        # interned records are immutable, and don't need duplication
+        with self.assertRaises(ValueError):
+            props['expiry'] = '2018-09-01'
+        with self.assertRaises(ValueError):
+            props.pop('expiry')
+        with self.assertRaises(ValueError):
+            del props['expiry']
+        self.assertEqual(props.duplicate(), props)
+
+        # records created before are reused only if interned
+        self.Props.interning = False
+        legacy = self.Props.create(batch='abcd', expiry='2018-07-01')
+        self.assertIsNone(legacy.content_hash)
+        self.assertNotEqual(legacy, props)
+        legacy['expiry'] = '2018-08-01'
+        dup = props.duplicate()
+        self.assertNotEqual(dup, props)
+        self.assertIsNone(dup.content_hash)
+
+    def test_interning_reloaded(self):
+        """Values read back from the database intern to the same record."""
+        self.enable_interning()
+        contents = dict(batch='abcd', qty=2, ratio=1.5, weight=3.0,
+                        dims=dict(h=10, w=2.5))
+        props = self.Props.create(**contents)
+        self.registry.flush()
+        self.registry.session.expire(props)
+        reloaded = props.as_dict()
+        self.assertEqual(self.Props.create(**reloaded), props)
+
+        # as read by other means than the ORM, e.g., in a report
+        flexible = self.registry.execute(text(
+            "SELECT flexible FROM wms_physobj_properties WHERE id=:id"),
+            dict(id=props.id)).fetchone()[0]
+        flexible = json.loads(json.dumps(flexible), parse_float=Decimal)
+        self.assertEqual(self.Props.create(batch='abcd', **flexible), props)
+
+    def test_interning_physobj(self):
+        self.enable_interning()
+        PhysObj = self.registry.Wms.PhysObj
+        gt = PhysObj.Type.insert(code='GT')
+        goods = [PhysObj.insert(type=gt) for _ in range(3)]
+        for g in goods:
+            g.set_property('expiry', '2018-07-01')
+        props = goods[0].properties
+        self.assertEqual(set(g.properties for g in goods), {props})
+        self.assertEqual(props.as_dict(), dict(batch=None,
+                                               expiry='2018-07-01'))
+
+        goods[0].update_properties(dict(batch='abcd'))
+        self.assertNotEqual(goods[0].properties, props)
+        self.assertEqual(goods[1].properties, props)
+        self.assertEqual(goods[0].get_property('batch'), 'abcd')
+        self.assertEqual(goods[0].get_property('expiry'), '2018-07-01')
+
+        goods[1].set_property('batch', 'abcd')
+        self.assertEqual(goods[1].properties, goods[0].properties)
+        self.assertEqual(goods[2].properties, props)
+
+        # no change
+        goods[2].set_property('expiry', '2018-07-01')
+        goods[2].update_properties(dict(expiry='2018-07-01'))
+        self.assertEqual(goods[2].properties, props)
+
     def test_del_pop(self):
         missing = object()
         props = self.Props(batch='abcd')
@@ -152,3 +263,28 @@ class TestPhysObjProperties(BlokTestCase):
                 props.pop(k)
         with self.assertRaises(TypeError):
             props.pop('foo', 1, 2)
+
+    def test_query_criteria(self):
+        props = self.Props.create(batch='abcd', expiry='2018-07-01',
+                                  history=['a'])
+        other = self.Props.create(batch='efgh', expiry='2018-07-01')
+
+        def lookup(**wished):
+            return set(self.Props.query().filter(
+                *self.Props.query_criteria(wished)).all())
+
+        self.assertEqual(lookup(batch='abcd'), {props})
+        self.assertEqual(lookup(expiry='2018-07-01'), {props, other})
+        self.assertEqual(lookup(batch='efgh', expiry='2018-07-01'), {other})
+        self.assertEqual(lookup(history=['a']), {props})
+        self.assertEqual(lookup(batch='abcd', expiry='2018-08-01'), set())
+
+    def test_flexible_index(self):
+        indexdef = self.registry.execute(
+            text("SELECT indexdef FROM pg_indexes "
+                 "WHERE tablename='wms_physobj_properties' "
+                 "AND indexname=:name"),
+            dict(name=self.Props.FLEXIBLE_INDEX)).fetchone()
+        self.assertIsNotNone(indexdef)
+        self.assertIn('gin', indexdef[0].lower())
+        self.assertIn('jsonb_path_ops', indexdef[0])
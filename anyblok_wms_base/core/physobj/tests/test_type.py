@@ -6,6 +6,7 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
+from sqlalchemy.orm.exc import NoResultFound
 from anyblok.tests.testcase import BlokTestCase
 
 
@@ -41,7 +42,7 @@ class TestPhysObjType(BlokTestCase):
         self.assertEqual(child.get_behaviour('foo'), 'bar')
 
         # child shadows parent for non-dict values
-        child.behaviours['foo'] = 'spam'
+        child.behaviours = dict(child.behaviours, foo='spam')
         self.assertEqual(child.get_behaviour('foo'), 'spam')
 
     def test_get_behaviour_parent_merge(self):
@@ -101,6 +102,58 @@ class TestPhysObjType(BlokTestCase):
                              inputs=[dict(type='material2', quantity=3)],
                          )))
 
+    def test_behaviours_cache(self):
+        parent = self.Type.insert(code='gtp',
+                                  behaviours=dict(foo=dict(x=1), bar=2))
+        child = self.Type.insert(code='gtc', parent=parent,
+                                 behaviours=dict(foo=dict(y=[3])))
+
+        merged = child.merged_behaviours()
+        self.assertEqual(merged, dict(foo=dict(x=1, y=[3]), bar=2))
+        self.assertIs(child.merged_behaviours(), merged)
+        self.assertEqual(self.Type.caches()['behaviours_cache'][child.id],
+                         merged)
+
+        # callers can't corrupt the cache
+        with self.assertRaises(TypeError):
+            merged['bar'] = 3
+        with self.assertRaises(TypeError):
+            child.get_behaviour('foo')['x'] = 2
+        with self.assertRaises(TypeError):
+            child.get_behaviour('foo')['y'].append(2)
+
+        # this transaction changed some Types: other sessions don't see
+        # its cached values
+        self.assertNotIn(child.id, self.Type.behaviours_cache)
+
+        # invalidation by changes on ancestors
+        parent.behaviours = dict(foo=dict(x=2))
+        self.assertEqual(child.get_behaviour('foo'), dict(x=2, y=[3]))
+        self.assertIsNone(child.get_behaviour('bar'))
+
+        # by change of parent
+        other = self.Type.insert(code='other', behaviours=dict(bar=5))
+        child.get_behaviour('bar')
+        child.parent = other
+        self.assertEqual(child.get_behaviour('bar'), 5)
+        self.assertEqual(child.get_behaviour('foo'), dict(y=[3]))
+
+    def test_get_by_codes(self):
+        gt1 = self.Type.insert(code='gt1')
+        gt2 = self.Type.insert(code='gt2')
+        self.assertEqual(self.Type.get_by_codes(['gt1', 'gt2', 'unknown']),
+                         dict(gt1=gt1, gt2=gt2))
+        self.assertEqual(self.Type.caches()['codes_cache'],
+                         dict(gt1=gt1.id, gt2=gt2.id))
+        self.assertEqual(self.Type.get_by_code('gt1'), gt1)
+        with self.assertRaises(NoResultFound):
+            self.Type.get_by_code('unknown')
+
+        # invalidation
+        gt1.code = 'renamed'
+        self.assertEqual(self.Type.get_by_codes(['gt1', 'renamed']),
+                         dict(renamed=gt1))
+
     def test_is_subtype(self):
         grand = self.Type.insert(code='grand')
         parent = self.Type.insert(code='parent', parent=grand)
@@ -116,6 +169,33 @@ class TestPhysObjType(BlokTestCase):
         self.assertFalse(stranger.is_sub_type(grand))
         self.assertFalse(stranger.is_sub_type(parent))
 
+        self.assertEqual(child.ancestor_ids(),
+                         {child.id, parent.id, grand.id})
+        self.assertEqual(self.Type.caches()['ancestors_cache'][child.id],
+                         {child.id, parent.id, grand.id})
+
+        # changes in the hierarchy are taken into account
+        parent.parent = stranger
+        self.assertFalse(child.is_sub_type(grand))
+        self.assertTrue(child.is_sub_type(stranger))
+
+    def test_flatten_subtypes_subquery(self):
+        grand = self.Type.insert(code='grand')
+        parent = self.Type.insert(code='parent', parent=grand)
+        child = self.Type.insert(code='child', parent=parent)
+        sibling = self.Type.insert(code='other', parent=grand)
+        self.Type.insert(code='stranger')
+
+        def subtypes(gt):
+            cte = self.Type.flatten_subtypes_subquery(gt)
+            return set(r[0] for r in self.registry.session.query(
+                cte.c.id).all())
+
+        self.assertEqual(subtypes(grand),
+                         {grand.id, parent.id, child.id, sibling.id})
+        self.assertEqual(subtypes(parent), {parent.id, child.id})
+        self.assertEqual(subtypes(child), {child.id})
+
     def test_properties(self):
         parent = self.Type.insert(code='parent')
 
@@ -6,17 +6,40 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
+from copy import deepcopy
+import itertools
 
+from sqlalchemy import event
+from sqlalchemy import orm
+from sqlalchemy.orm.exc import NoResultFound
 from anyblok import Declarations
 from anyblok.column import Text
 from anyblok.column import Integer
 from anyblok.relationship import Many2One
 from anyblok_postgres.column import Jsonb
 from anyblok_wms_base.utils import dict_merge
+from anyblok_wms_base.utils import freeze
 
 _missing = object()
 """A marker to use as default value in get-like functions/methods."""
 
+_SESSION_CACHES = 'wms_physobj_type_caches'
+"""Key, in the ``info`` of a session, for its specific caches.
+
+Present if the current transaction changed some Types.
+"""
+
+_SESSION_GENERATION = 'wms_physobj_type_caches_generation'
+"""Key, in the ``info`` of a session, for the cache generation at the start
+of its current transaction."""
+
+
+def _new_caches():
+    return dict(behaviours_cache={},
+                ancestors_cache={},
+                codes_cache={},
+                properties_cache={})
+
 
 register = Declarations.register
 Model = Declarations.Model
@@ -89,7 +112,252 @@ class Type:
     def __repr__(self):
         return "Wms.PhysObj.Type" + str(self)
 
-    # TODO PERF cache ?
+    behaviours_cache = None
+    """Fully merged behaviours, by Type id.
+
+    This is shared by all sessions of the registry, and filled
+    by :meth:`merged_behaviours`, together with
+    :attr:`ancestors_cache`, :attr:`codes_cache` and
+    :attr:`properties_cache`, only in sessions that didn't
+    change any Type in their current transaction (see :meth:`caches`).
+
+    These shared caches are cleared at the end of each transaction
+    that changed some Types, i.e., assigned :attr:`behaviours`,
+    :attr:`properties` or :attr:`parent`, or flushed some Type.
+
+    .. warning:: changes done by other processes aren't detected;
+                 call :meth:`clear_caches` after changing
+                 Types in such a way. Also, as for any JSON field,
+                 in-place mutations of :attr:`behaviours` aren't
+                 detected: reassign it, or call SQLAlchemy's
+                 ``flag_modified()`` on it.
+    """
+
+    ancestors_cache = None
+    """Ids of ancestors, by Type id.
+
+    This is filled by :meth:`ancestor_ids`, and has the same lifecycle
+    as :attr:`behaviours_cache`.
+    """
+
+    codes_cache = None
+    """Ids of Types, by code.
+
+    This is filled by :meth:`get_by_codes`, and has the same lifecycle
+    as :attr:`behaviours_cache`.
+    """
+
+    properties_cache = None
+    """Fully merged properties, by Type id.
+
+    This is filled by :meth:`merged_properties_view`, and has the same
+    lifecycle as :attr:`behaviours_cache`.
+    """
+
+    shared_caches = None
+    """All the caches shared by sessions, by attribute name.
+
+    Keys are ``'behaviours_cache'``, ``'ancestors_cache'``,
+    ``'codes_cache'`` and ``'properties_cache'``.
+    """
+
+    caches_generation = 0
+    """Incremented whenever the shared caches are cleared.
+
+    Sessions whose transaction started before that don't fill them.
+    """
+
+    @classmethod
+    def clear_caches(cls):
+        """Empty :attr:`behaviours_cache`, :attr:`ancestors_cache`,
+        :attr:`codes_cache` and :attr:`properties_cache`.
+
+        This also empties the caches specific to the current session,
+        if any.
+        """
+        if cls.behaviours_cache is None:
+            return
+        for cache in cls.shared_caches.values():
+            cache.clear()
+        cls.caches_generation += 1
+        info = cls.registry.session.info
+        if _SESSION_CACHES in info:
+            info[_SESSION_CACHES] = _new_caches()
+
+    @classmethod
+    def caches(cls, filling=False):
+        """Return the caches to use in the current session.
+
+        If the current transaction changed some Types, these are
+        specific to the session, and are emptied on each new change,
+        otherwise, these are the caches shared by all sessions
+        (:attr:`shared_caches`).
+
+        :param bool filling: if ``True``, the caches are about to be
+                             filled. Results computed in a transaction that
+                             started before the shared caches were last
+                             cleared may be outdated, and must not be put
+                             in them.
+        :return: :class:`dict` of caches, with the same keys as
+                 :attr:`shared_caches`, or ``None`` if ``filling`` is
+                 ``True`` and the results can't be cached.
+        """
+        if cls.behaviours_cache is None:
+            cls.init_caches()
+        info = cls.registry.session.info
+        caches = info.get(_SESSION_CACHES)
+        if caches is not None:
+            return caches
+        if filling and info.get(_SESSION_GENERATION) != cls.caches_generation:
+            return None
+        return cls.shared_caches
+
+    @classmethod
+    def _fill_cache(cls, name, key, value):
+        """Store ``value`` in the cache called ``name``, if possible.
+
+        :param name: the name of the cache, see :meth:`caches`
+        """
+        if key is None:
+            return
+        caches = cls.caches(filling=True)
+        if caches is not None:
+            caches[name][key] = value
+
+    @classmethod
+    def init_caches(cls):
+        """Create :attr:`behaviours_cache`, :attr:`ancestors_cache`,
+        :attr:`codes_cache` and :attr:`properties_cache`.
+
+        This also sets their invalidation up. The state about the current
+        transaction is kept in the ``info`` of each session.
+        """
+        cls.shared_caches = _new_caches()
+        for name, cache in cls.shared_caches.items():
+            setattr(cls, name, cache)
+
+        def changed(target, *args):
+            cls._caches_changed_in(orm.object_session(target))
+
+        # AnyBlok wraps fields, we need the actual mapped attributes
+        mapper = orm.class_mapper(cls)
+        table = cls.__table__
+        for col in (table.c.behaviours, table.c.properties):
+            attr = mapper.get_property_by_column(col).class_attribute
+            event.listen(attr, 'set', changed)
+            event.listen(attr, 'modified', changed)
+        for rel in mapper.relationships:
+            if table.c.parent_id in rel.local_columns:
+                event.listen(rel.class_attribute, 'set', changed)
+
+        session = cls.registry.session
+        event.listen(session, 'after_begin', cls._caches_after_begin)
+        event.listen(session, 'after_flush', cls._caches_after_flush)
+        event.listen(session, 'after_soft_rollback',
+                     cls._caches_after_rollback)
+        event.listen(session, 'after_transaction_end',
+                     cls._caches_after_transaction_end)
+
+    @classmethod
+    def _caches_changed_in(cls, session):
+        """Switch ``session`` to its own, new, caches."""
+        if session is not None:
+            session.info[_SESSION_CACHES] = _new_caches()
+
+    @classmethod
+    def _caches_after_begin(cls, session, transaction, connection):
+        session.info.setdefault(_SESSION_GENERATION, cls.caches_generation)
+
+    @classmethod
+    def _caches_after_flush(cls, session, flush_context):
+        if any(isinstance(obj, cls)
+               for obj in itertools.chain(session.new,
+                                          session.dirty,
+                                          session.deleted)):
+            cls._caches_changed_in(session)
+
+    @classmethod
+    def _caches_after_rollback(cls, session, previous_transaction):
+        # the session caches may hold data of a rolled back SAVEPOINT
+        if _SESSION_CACHES in session.info:
+            cls._caches_changed_in(session)
+
+    @classmethod
+    def _caches_after_transaction_end(cls, session, transaction):
+        if transaction.parent is not None:
+            return
+        info = session.info
+        info.pop(_SESSION_GENERATION, None)
+        if info.pop(_SESSION_CACHES, None) is not None:
+            cls.clear_caches()
+
+    @classmethod
+    def get_by_codes(cls, codes):
+        """Return the Types having the given codes.
+
+        The ids of Types are cached in :attr:`codes_cache`, so that
+        only unknown codes are queried, all at once. The Types themselves
+        are then usually found in the session, without any query.
+
+        :param codes: iterable of codes
+        :return: :class:`dict` whose keys are the codes, and values the
+                 corresponding Types. Unknown codes are omitted.
+        """
+        cache = cls.caches()['codes_cache']
+        res = {}
+        missing = set()
+        for code in codes:
+            type_id = cache.get(code)
+            gt = None if type_id is None else cls.query().get(type_id)
+            if gt is None:
+                missing.add(code)
+            else:
+                res[code] = gt
+        if missing:
+            for gt in cls.query().filter(cls.code.in_(missing)).all():
+                cls._fill_cache('codes_cache', gt.code, gt.id)
+                res[gt.code] = gt
+        return res
+
+    @classmethod
+    def get_by_code(cls, code):
+        """Return the Type having the given code, using :meth:`get_by_codes`.
+
+        :raises: :class:`NoResultFound <sqlalchemy.orm.exc.NoResultFound>`
+                 if there's no such Type.
+        """
+        gt = cls.get_by_codes((code, )).get(code)
+        if gt is None:
+            raise NoResultFound("No PhysObj Type with code %r" % code)
+        return gt
+
+    def merged_behaviours(self):
+        """Return all behaviours, merged with those of the ancestors.
+
+        For each behaviour name, the value is that of :attr:`behaviours`,
+        merged with the parent's value, using :func:`dict_merge
+        <anyblok_wms_base.utils.dict_merge>`.
+
+        The result is cached in :attr:`behaviours_cache`, and therefore
+        read-only (see :func:`freeze <anyblok_wms_base.utils.freeze>`).
+        Callers that need to modify it must use :func:`copy.deepcopy`.
+
+        :rtype: :class:`FrozenDict <anyblok_wms_base.utils.FrozenDict>`
+        """
+        merged = self.caches()['behaviours_cache'].get(self.id, _missing)
+        if merged is not _missing:
+            return merged
+
+        parent = self.parent
+        merged = {} if parent is None else dict(parent.merged_behaviours())
+        behaviours = self.behaviours
+        if behaviours is not None:
+            for name, beh in behaviours.items():
+                merged[name] = dict_merge(beh, merged.get(name))
+        merged = freeze(merged)
+        self._fill_cache('behaviours_cache', self.id, merged)
+        return merged
+
     def get_behaviour(self, name, default=None):
         """Get the value of the behaviour with given name.
 
@@ -99,41 +367,79 @@ class Type:
 
         It also takes care of corner cases, such as when :attr:`behaviours` is
         ``None`` as a whole.
+
+        The result is read-only, see :meth:`merged_behaviours`.
         """
-        behaviours = self.behaviours
-        parent = self.parent
+        return self.merged_behaviours().get(name, default)
 
-        if parent is None:
-            parent_beh = _missing
-        else:
-            parent_beh = self.parent.get_behaviour(name, default=_missing)
+    def ancestor_ids(self):
+        """Return the ids of all ancestors of this Type, including itself.
 
-        if behaviours is None:
-            beh = _missing
-        else:
-            beh = behaviours.get(name, _missing)
+        The result is cached in :attr:`ancestors_cache`.
 
-        if beh is _missing:
-            if parent_beh is _missing:
-                return default
-            return parent_beh
-        if parent_beh is _missing:
-            return beh
-        return dict_merge(beh, parent_beh)
+        :rtype: frozenset
+        """
+        ancestors = self.caches()['ancestors_cache'].get(self.id)
+        if ancestors is not None:
+            return ancestors
+
+        parent = self.parent
+        ancestors = frozenset((self.id, ))
+        if parent is not None:
+            ancestors = ancestors.union(parent.ancestor_ids())
+        self._fill_cache('ancestors_cache', self.id, ancestors)
+        return ancestors
 
     def is_sub_type(self, gt):
         """True if ``self``  is a sub type of ``gt``, inclusively.
 
-        TODO PERF the current implementation recurses over ancestors.
-        A subsequent implementation could add caching and/or recursive SQL
-        queries.
+        Once :meth:`ancestor_ids` is cached, this doesn't issue any
+        query.
         """
         if self == gt:
             return True
-        parent = self.parent
-        if parent is None:
+        if gt.id is None:
             return False
-        return parent.is_sub_type(gt)
+        return gt.id in self.ancestor_ids()
+
+    @classmethod
+    def flatten_subtypes_subquery(cls, goods_type):
+        """Return an SQL subquery of the ids of all subtypes of a Type.
+
+        This is a recursive CTE (``WITH RECURSIVE``), climbing down the
+        :attr:`parent` hierarchy.
+
+        :param goods_type: the Type to start from (inclusive)
+        :return: CTE having the ``id`` column
+        """
+        cte = cls.query(cls.id).filter(cls.id == goods_type.id).cte(
+            name='subtypes', recursive=True)
+        parent = orm.aliased(cte, name='parent')
+        child = orm.aliased(cls, name='child')
+        tail = cls.registry.session.query(child.id).filter(
+            child.parent_id == parent.c.id)
+        return cte.union_all(tail)
+
+    @classmethod
+    def flatten_subtypes_tops_subquery(cls, goods_types):
+        """Flatten the Type hierarchy below several Types at once.
+
+        This is the same as :meth:`flatten_subtypes_subquery`, except that
+        it has two columns: ``top_id`` and ``id``, the former
+        telling below which of the given Types the latter is.
+
+        :param goods_types: iterable of Types, all of them are included in
+                            the results, with themselves as ``top_id``.
+        :return: CTE having the ``top_id`` and ``id`` columns
+        """
+        cte = cls.query(cls.id.label('top_id'), cls.id).filter(
+            cls.id.in_(set(gt.id for gt in goods_types))).cte(
+                name='subtypes', recursive=True)
+        parent = orm.aliased(cte, name='parent')
+        child = orm.aliased(cls, name='child')
+        tail = cls.registry.session.query(parent.c.top_id, child.id).filter(
+            child.parent_id == parent.c.id)
+        return cte.union_all(tail)
 
     def is_container(self):
         return self.get_behaviour('container') is not None
@@ -153,13 +459,34 @@ class Type:
             return parent.get_property(k, default=default)
         return val
 
-    def merged_properties(self):
-        """Return this Type properties, merged with its parent."""
+    def merged_properties_view(self):
+        """Return this Type properties, merged with its parent.
+
+        The result is cached in :attr:`properties_cache`, and therefore
+        read-only, as in :meth:`merged_behaviours`.
+
+        :rtype: :class:`FrozenDict <anyblok_wms_base.utils.FrozenDict>`
+        """
+        merged = self.caches()['properties_cache'].get(self.id)
+        if merged is not None:
+            return merged
+
         parent = self.parent
         properties = self.properties
         if parent is None:
-            return properties if properties is not None else {}
-        return dict_merge(properties, parent.merged_properties())
+            merged = properties if properties is not None else {}
+        else:
+            merged = dict_merge(properties, parent.merged_properties_view())
+        merged = freeze(merged)
+        self._fill_cache('properties_cache', self.id, merged)
+        return merged
+
+    def merged_properties(self):
+        """Return this Type properties, merged with its parent.
+
+        This is a modifiable copy of :meth:`merged_properties_view`.
+        """
+        return deepcopy(self.merged_properties_view())
 
     def has_property_values(self, mapping):
         return all(self.get_property(k, default=_missing) == v
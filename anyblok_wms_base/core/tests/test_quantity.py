@@ -65,6 +65,60 @@ class TestQuantity(WmsTestCase):
         self.assert_quantity(3, additional_states=['past'],
                              at_datetime=self.dt_test2)
 
+    def test_quantity_properties(self):
+        Props = self.PhysObj.Properties
+        july = Props.create(batch='abc', expiry='2018-07-01')
+        august = Props.create(batch='def', expiry='2018-08-01')
+        for avatar in self.insert_goods(2, 'present', self.dt_test1):
+            avatar.obj.properties = july
+        for avatar in self.insert_goods(3, 'present', self.dt_test1):
+            avatar.obj.properties = august
+        self.insert_goods(1, 'present', self.dt_test1)
+
+        self.assert_quantity(6)
+        self.assert_quantity(2, properties=dict(batch='abc'))
+        self.assert_quantity(3, properties=dict(expiry='2018-08-01'))
+        self.assert_quantity(3, properties=dict(batch='def',
+                                                expiry='2018-08-01'))
+        self.assert_quantity(0, properties=dict(batch='abc',
+                                                expiry='2018-08-01'))
+        self.assert_quantity(2, properties=dict(expiry='2018-07-01'),
+                             location=self.stock)
+        self.assert_quantity(6, properties={})
+
+    def test_quantity_goods_type_subtree(self):
+        gt = self.physobj_type
+        subtype = self.PhysObj.Type.insert(code='MySubGT', parent=gt)
+        subsub = self.PhysObj.Type.insert(code='MySubSubGT', parent=subtype)
+        self.insert_goods(2, 'present', self.dt_test1)
+        for t in (subtype, subsub, subsub):
+            self.Avatar.insert(obj=self.PhysObj.insert(type=t),
+                               reason=self.arrival,
+                               location=self.stock,
+                               dt_from=self.dt_test1,
+                               state='present')
+
+        self.assertEqual(self.Wms.quantity(goods_type=gt), 2)
+        self.assertEqual(self.Wms.quantity(goods_type=gt,
+                                           goods_type_subtree=True), 5)
+        self.assertEqual(self.Wms.quantity(goods_type=subtype,
+                                           goods_type_subtree=True), 3)
+        self.assertEqual(self.Wms.quantity(goods_type=subsub,
+                                           goods_type_subtree=True), 2)
+
+        # several Types (one being below another) in a single query
+        targets = [(self.stock, gt), (self.stock, subtype),
+                   (self.stock, subsub)]
+        self.assertEqual(self.Wms.quantities(targets,
+                                             goods_type_subtree=True),
+                         {(self.stock, gt): 5,
+                          (self.stock, subtype): 3,
+                          (self.stock, subsub): 2})
+        self.assertEqual(self.Wms.quantities(targets),
+                         {(self.stock, gt): 2,
+                          (self.stock, subtype): 1,
+                          (self.stock, subsub): 2})
+
     def test_quantity_recursive(self):
         other = self.insert_location('other')
         self.insert_goods(2, 'present', self.dt_test1)
@@ -139,6 +193,83 @@ class TestQuantity(WmsTestCase):
                  (6, gt),
                  )))
 
+    def test_quantities(self):
+        other = self.insert_location('other')
+        sub = self.insert_location('sub', parent=self.stock)
+        gt = self.physobj_type
+        gt2 = self.PhysObj.Type.insert(code='MyGT2')
+        self.insert_goods(2, 'present', self.dt_test1)
+        self.insert_goods(1, 'present', self.dt_test1, location=other)
+        self.insert_goods(3, 'present', self.dt_test1, location=sub)
+        self.insert_goods(4, 'future', self.dt_test2, location=sub)
+
+        targets = [(self.stock, gt), (sub, gt), (other, gt), (sub, gt2)]
+        self.assertEqual(self.Wms.quantities(targets),
+                         {(self.stock, gt): 5,
+                          (sub, gt): 3,
+                          (other, gt): 1,
+                          (sub, gt2): 0})
+        self.assertEqual(self.Wms.quantities(targets,
+                                             location_recurse=False),
+                         {(self.stock, gt): 2,
+                          (sub, gt): 3,
+                          (other, gt): 1,
+                          (sub, gt2): 0})
+        self.assertEqual(
+            self.Wms.quantities(targets,
+                                additional_states=['future'],
+                                at_datetime=DATE_TIME_INFINITY),
+            {(self.stock, gt): 9,
+             (sub, gt): 7,
+             (other, gt): 1,
+             (sub, gt2): 0})
+
+        # consistency with quantity()
+        for loc, goods_type in targets:
+            for recurse in (True, False):
+                self.assertEqual(
+                    self.Wms.quantities([(loc, goods_type)],
+                                        location_recurse=recurse),
+                    {(loc, goods_type): self.Wms.quantity(
+                        location=loc,
+                        goods_type=goods_type,
+                        location_recurse=recurse)})
+
+        self.assertEqual(self.Wms.quantities(()), {})
+
+    def test_stock_export(self):
+        other = self.insert_location('other')
+        sub = self.insert_location('sub', parent=self.stock)
+        gt2 = self.PhysObj.Type.insert(code='MyGT2')
+        self.insert_goods(2, 'present', self.dt_test1)
+        self.insert_goods(1, 'present', self.dt_test1, location=other)
+        self.insert_goods(3, 'present', self.dt_test1, location=sub)
+        self.insert_goods(4, 'future', self.dt_test2, location=sub)
+        self.PhysObj.Avatar.insert(obj=self.PhysObj.insert(type=gt2),
+                                   reason=self.arrival,
+                                   location=sub,
+                                   dt_from=self.dt_test1,
+                                   state='present')
+
+        # ids are increasing in order of creation
+        expected = [(self.stock.id, 'STK', 'MyGT', 2),
+                    (other.id, 'other', 'MyGT', 1),
+                    (sub.id, 'sub', 'MyGT', 3),
+                    (sub.id, 'sub', 'MyGT2', 1)]
+        # various page sizes, including boundary cases
+        for page_size in (1, 2, 3, 4, 10):
+            self.assertEqual(
+                list(self.Wms.stock_export(page_size=page_size,
+                                           fetch_size=2)),
+                expected)
+
+        self.assertEqual(
+            list(self.Wms.stock_export(location=sub,
+                                       additional_states=['future'],
+                                       at_datetime=DATE_TIME_INFINITY,
+                                       page_size=1)),
+            [(sub.id, 'sub', 'MyGT', 7), (sub.id, 'sub', 'MyGT2', 1)])
+
     def test_no_match(self):
         """Test that quantity is not None if no PhysObj match the criteria."""
         self.assert_quantity(0)
@@ -250,6 +381,79 @@ class TestQuantity(WmsTestCase):
                                  location=other,
                                  at_datetime=dt)
 
+    def test_quantity_series(self):
+        loc = self.insert_location('sub', parent=self.stock)
+        loc_av = self.Avatar.query().filter_by(obj=loc).one()
+        other = self.insert_location('other')
+        self.insert_goods(3, 'present', self.dt_test1, location=loc)
+        self.insert_goods(2, 'future', self.dt_test2, location=other)
+        self.Operation.Move.create(input=loc_av,
+                                   destination=other,
+                                   state='planned',
+                                   dt_execution=self.dt_test3)
+        datetimes = (self.dt_test1, self.dt_test2, self.dt_test3,
+                     DATE_TIME_INFINITY)
+        for location in (self.stock, loc, other, None):
+            for recurse in (True, False):
+                self.assertEqual(
+                    self.Wms.quantity_series(datetimes,
+                                             goods_type=self.physobj_type,
+                                             additional_states=['future'],
+                                             location=location,
+                                             location_recurse=recurse),
+                    [(dt, self.Wms.quantity(goods_type=self.physobj_type,
+                                            additional_states=['future'],
+                                            at_datetime=dt,
+                                            location=location,
+                                            location_recurse=recurse))
+                     for dt in datetimes])
+
+        self.assertEqual(
+            self.Wms.quantity_series(datetimes,
+                                     goods_type=self.physobj_type,
+                                     additional_states=['future'],
+                                     location=other),
+            [(self.dt_test1, 0),
+             (self.dt_test2, 2),
+             (self.dt_test3, 5),
+             (DATE_TIME_INFINITY, 5)])
+        self.assertEqual(
+            self.Wms.quantity_series([self.dt_test2],
+                                     goods_type=self.physobj_type,
+                                     location=self.stock),
+            [(self.dt_test2, 3)])
+        self.assertEqual(self.Wms.quantity_series(()), [])
+        with self.assertRaises(TypeError):
+            self.Wms.quantity_series(datetimes, at_datetime=self.dt_test1)
+
+    def test_quantity_series_criteria(self):
+        """quantity_series() applies all the criteria of quantity_query()."""
+        subtype = self.PhysObj.Type.insert(code='MySubGT',
+                                           parent=self.physobj_type)
+        props = self.PhysObj.Properties.create(batch='abc')
+        for avatar in self.insert_goods(2, 'present', self.dt_test1):
+            avatar.obj.properties = props
+        self.insert_goods(1, 'future', self.dt_test2)
+        self.Avatar.insert(obj=self.PhysObj.insert(type=subtype),
+                           reason=self.arrival,
+                           location=self.stock,
+                           dt_from=self.dt_test1,
+                           state='present')
+
+        datetimes = (self.dt_test1, self.dt_test2)
+        self.assertEqual(
+            self.Wms.quantity_series(datetimes,
+                                     goods_type=self.physobj_type,
+                                     additional_states=['future'],
+                                     properties=dict(batch='abc')),
+            [(self.dt_test1, 2), (self.dt_test2, 2)])
+        self.assertEqual(
+            self.Wms.quantity_series(datetimes,
+                                     goods_type=self.physobj_type,
+                                     additional_states=['future'],
+                                     goods_type_subtree=True),
+            [(self.dt_test1, 3), (self.dt_test2, 4)])
+
     def test_dt_quantity_moved_loc_and_goods(self):
         """Test quantity queries with both PhysObj and locations moving."""
         loc = self.insert_location('sub', parent=self.stock)
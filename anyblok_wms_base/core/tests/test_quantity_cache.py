@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Base project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from anyblok_wms_base.testing import WmsTestCase
+from anyblok_wms_base.constants import DATE_TIME_INFINITY
+
+
+class TestQuantityCache(WmsTestCase):
+    """Test the optional cache in front of quantity computations."""
+
+    def setUp(self):
+        super(TestQuantityCache, self).setUp()
+        self.physobj_type = self.PhysObj.Type.insert(label="My goods",
+                                                     code='MyGT')
+        self.other_type = self.PhysObj.Type.insert(label="Other goods",
+                                                   code='OTH')
+        self.stock = self.insert_location('STK')
+        self.sub = self.insert_location('STK/SUB', parent=self.stock)
+        self.other = self.insert_location('OTHER')
+        self.default_quantity_location = self.stock
+        self.cache = self.Wms.enable_quantity_cache(maxsize=10)
+
+    def tearDown(self):
+        self.Wms.disable_quantity_cache()
+        super(TestQuantityCache, self).tearDown()
+
+    def arrival(self, location, goods_type=None, **kwargs):
+        if goods_type is None:
+            goods_type = self.physobj_type
+        kwargs.setdefault('dt_execution', self.dt_test1)
+        kwargs.setdefault('state', 'done')
+        return self.Operation.Arrival.create(location=location,
+                                             goods_type=goods_type,
+                                             **kwargs)
+
+    def test_hit_and_invalidate(self):
+        self.arrival(self.sub)
+        self.assert_quantity(1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+        self.assert_quantity(1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        # unrelated Type and location
+        self.arrival(self.sub, goods_type=self.other_type)
+        self.arrival(self.other)
+        self.assert_quantity(1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+
+        # in the subtree
+        arrival = self.arrival(self.sub)
+        self.assert_quantity(2)
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 2))
+
+        arrival.obliviate()
+        self.assert_quantity(1)
+        self.assertEqual(self.cache.misses, 3)
+
+    def test_planned_cancel_execute(self):
+        self.assert_quantity(0, additional_states=['future'],
+                             at_datetime=DATE_TIME_INFINITY)
+        arrival = self.arrival(self.sub, state='planned')
+        self.assert_quantity(1, additional_states=['future'],
+                             at_datetime=DATE_TIME_INFINITY)
+        arrival.cancel()
+        self.assert_quantity(0, additional_states=['future'],
+                             at_datetime=DATE_TIME_INFINITY)
+
+        arrival = self.arrival(self.sub, state='planned')
+        self.assert_quantity(0)
+        arrival.execute()
+        self.assert_quantity(1)
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_container_move(self):
+        self.arrival(self.sub)
+        self.assert_quantity(1)
+        self.assert_quantity(0, location=self.other)
+
+        sub_av = self.PhysObj.Avatar.query().filter_by(obj=self.sub).one()
+        self.Operation.Move.create(input=sub_av,
+                                   destination=self.other,
+                                   dt_execution=self.dt_test2,
+                                   state='done')
+        self.assert_quantity(0)
+        self.assert_quantity(1, location=self.other)
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_deferred_invalidation(self):
+        self.assert_quantity(0)
+        self.assertEqual(len(self.cache), 1)
+        Wms = self.Wms
+        with Wms.defer_quantity_cache_invalidation():
+            self.arrival(self.sub)
+            self.assertEqual(Wms.quantity_cache_deferred(), {
+                self.Operation.Arrival.query().one().id})
+            # the cache is bypassed, not to return stale values
+            self.assert_quantity(1)
+            with Wms.defer_quantity_cache_invalidation():
+                self.arrival(self.other)
+            self.assertEqual(len(Wms.quantity_cache_deferred()), 2)
+            self.assertEqual(len(self.cache), 1)
+        self.assertIsNone(Wms.quantity_cache_deferred())
+        self.assertEqual(len(self.cache), 0)
+        self.assert_quantity(1)
+
+        # the cache gets cleared in case of errors
+        self.assert_quantity(1)
+        with self.assertRaises(ZeroDivisionError):
+            with Wms.defer_quantity_cache_invalidation():
+                1 / 0
+        self.assertIsNone(Wms.quantity_cache_deferred())
+        self.assertEqual(len(self.cache), 0)
+
+    def test_execute_batch(self):
+        arrivals = [self.arrival(self.sub, state='planned') for _ in (1, 2)]
+        self.assert_quantity(0)
+        self.Operation.execute_batch(arrivals)
+        self.assert_quantity(2)
+
+    def test_grouped_quantity(self):
+        self.arrival(self.sub)
+        expected = [(1, self.sub.id, self.physobj_type.id)]
+        self.assertEqual(self.Wms.grouped_quantity(
+            goods_type=self.physobj_type), expected)
+        self.assertEqual(self.Wms.grouped_quantity(
+            goods_type=self.physobj_type), expected)
+        self.assertEqual(self.cache.hits, 1)
+
+        self.arrival(self.stock)
+        self.assertEqual(
+            set(self.Wms.grouped_quantity(goods_type=self.physobj_type)),
+            {(1, self.sub.id, self.physobj_type.id),
+             (1, self.stock.id, self.physobj_type.id)})
+
+    def test_not_cacheable(self):
+        self.assert_quantity(0, additional_filter=lambda query: query)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.misses, 0)
+
+    def test_disabled(self):
+        self.Wms.disable_quantity_cache()
+        self.assertIsNone(self.Wms.quantity_cache)
+        self.assert_quantity(0)
+        self.assertEqual(self.cache.misses, 0)
@@ -6,17 +6,31 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
-from sqlalchemy import or_
+from contextlib import contextmanager
+
 from sqlalchemy import not_
+from sqlalchemy import cast
 from sqlalchemy import func
+from sqlalchemy import literal
+from sqlalchemy import select
+from sqlalchemy import tuple_
+from sqlalchemy import union_all
 from sqlalchemy import orm
+from sqlalchemy import event
+from sqlalchemy import TIMESTAMP
 from anyblok import Declarations
+
 from anyblok_wms_base.constants import DATE_TIME_INFINITY
+from anyblok_wms_base.utils import QuantityCache
 
 register = Declarations.register
 Model = Declarations.Model
 
 _missing = object()
+
+QUANTITY_CACHE_DEFERRED = 'wms_quantity_cache_deferred'
+"""Key, in the ``info`` of sessions, for deferred quantity cache invalidations.
+"""
 """Marker to know that a kwarg is not passed if ``None`` means something else.
 """
 
@@ -37,7 +51,9 @@ class Wms:
                        at_datetime=None,
                        additional_filter=None,
                        location=None,
-                       location_recurse=True):
+                       location_recurse=True,
+                       properties=None,
+                       goods_type_subtree=False):
         """Query computing the quantity of PhysObj meeting various criteria.
 
         The computation actually involves querying :class:`Avatars
@@ -47,6 +63,11 @@ class Wms:
         :return: Query object, with only one column (the quantity)
         :param goods_type:
             if specified, restrict computation to PhysObj of this type
+        :param bool goods_type_subtree:
+            if ``True``, and ``goods_type`` is specified, the PhysObj
+            whose Types are descendants of ``goods_type`` are also taken
+            into account (see :meth:`Type.flatten_subtypes_subquery
+            <anyblok_wms_base.core.physobj.type.Type.flatten_subtypes_subquery>`).
         :param location:
             if specified, restrict computation to PhysObj Avatars
             from that location (see also ``location_recurse`` below)
@@ -54,6 +75,13 @@ class Wms:
             If ``True``, and ``location`` is specified, the PhysObj Avatars
             from sublocations of ``location`` will be taken recursively into
             account.
+        :param dict properties:
+            if specified, restrict computation to PhysObj having these
+            values of :ref:`properties <physobj_properties>`
+            (see :meth:`Properties.query_criteria
+            <anyblok_wms_base.core.physobj.main.Properties.query_criteria>`).
+            This is meant for questions such as the quantity of a given
+            batch, or with a given expiry date.
         :param additional_filter:
            optional function to restrict the PhysObj Avatars to take into
            account. It applies to the outer query, i.e., not within
@@ -94,24 +122,38 @@ class Wms:
             can in particular be used to consider only those
             Avatars whose ``dt_until`` is ``None``.
 
-            This parameter is mandatory if ``additional_states`` is specified.
-
-        TODO: provide filtering according to PhysObj properties (should become
-        special PostgreSQL JSON clauses)
+            It can also be a SQL column expression, as is done by
+            :meth:`quantity_series`, in which case it must not be used
+            together with ``location``, since the recursion on
+            containers would not be evaluated with respect to it.
 
-        TODO: provide a way to add more criteria from optional Bloks, e.g,
-        ``wms-reservation`` could add a way to filter only unreserved PhysObj.
+            This parameter is mandatory if ``additional_states`` is specified.
 
-        TODO PERF: for timestamp ranges, use GiST indexes and the @> operator.
-        See the comprehensive answer to `that question
-        <https://dba.stackexchange.com/questions/39589>`_ for an entry point.
-        Let's get a DB with serious volume and datetimes first.
+        Optional Bloks add more criteria by overriding this method with
+        extra keyword arguments, e.g., ``unreserved_only`` in the
+        :meth:`wms-reservation version
+        <anyblok_wms_base.reservation.wms.Wms.quantity_query>`.
+
+        The filtering on ``at_datetime`` is done with the ``@>`` operator
+        on the :attr:`dt_range
+        <anyblok_wms_base.core.physobj.main.Avatar.dt_range>` expression,
+        so that it can use the corresponding GiST index
+        (see :meth:`Avatar.at_datetime_criterion
+        <anyblok_wms_base.core.physobj.main.Avatar.at_datetime_criterion>`).
         """
         PhysObj = cls.registry.Wms.PhysObj
         Avatar = PhysObj.Avatar
         query = cls.base_quantity_query()
         if goods_type is not None:
-            query = query.filter(PhysObj.type == goods_type)
+            if goods_type_subtree:
+                subtypes = PhysObj.Type.flatten_subtypes_subquery(goods_type)
+                query = query.filter(
+                    PhysObj.type_id.in_(select([subtypes.c.id])))
+            else:
+                query = query.filter(PhysObj.type == goods_type)
+        if properties:
+            query = query.join(PhysObj.properties).filter(
+                *PhysObj.Properties.query_criteria(properties))
 
         if location is not None:
             if location_recurse:
@@ -134,12 +176,8 @@ class Wms:
                     "to specify the 'at_datetime' kwarg".format(
                         additional_states))
 
-        if at_datetime is DATE_TIME_INFINITY:
-            query = query.filter(Avatar.dt_until.is_(None))
-        elif at_datetime is not None:
-            query = query.filter(Avatar.dt_from <= at_datetime,
-                                 or_(Avatar.dt_until.is_(None),
-                                     Avatar.dt_until > at_datetime))
+        if at_datetime is not None:
+            query = query.filter(Avatar.at_datetime_criterion(at_datetime))
         if additional_filter is not None:
             query = additional_filter(query)
         return query
@@ -150,10 +188,377 @@ class Wms:
 
         This method executes :meth:`quantity_query` and returns the resulting
         numeric value.
+
+        If the :attr:`quantity_cache` is enabled, it is looked up first.
         """
+        key = cls.quantity_cache_key('quantity', **kwargs)
+        if key is not None:
+            res = cls.quantity_cache.get(key, _missing)
+            if res is not _missing:
+                return res
+
         query = cls.quantity_query(**kwargs)
         res = query.one()[0]
-        return 0 if res is None else res
+        res = 0 if res is None else res
+        if key is not None:
+            cls.quantity_cache_set(key, res, **kwargs)
+        return res
+
+    quantity_cache = None
+    """Optional cache for :meth:`quantity` and :meth:`grouped_quantity`.
+
+    This is ``None`` (disabled) by default, see
+    :meth:`enable_quantity_cache`.
+    """
+
+    @classmethod
+    def enable_quantity_cache(cls, cache=None, maxsize=1024, ttl=None):
+        """Put a cache in front of :meth:`quantity` and
+        :meth:`grouped_quantity`.
+
+        :param cache: the cache to use, by default a new instance of
+                      :class:`QuantityCache
+                      <anyblok_wms_base.utils.QuantityCache>`, with
+                      the given ``maxsize`` and ``ttl``. Any object having
+                      the same methods can be used.
+        :param ttl: if not ``None``, the entries of the default cache
+                    expire after that many seconds.
+        :return: the cache, notably to read its counters.
+
+        The cache is invalidated by the Operations of the current process,
+        for the Types and locations they affect, and entirely cleared on
+        rollbacks in the current process.
+
+        .. warning:: the default cache is process-local: it doesn't know
+                     about Operations done by other processes, nor about
+                     commits of other sessions. Without ``ttl``, it is
+                     therefore valid only if all Operations are done by
+                     the current process (single writer). With several
+                     writer processes, use ``ttl`` to bound the staleness
+                     of results, or pass a ``cache`` whose ``invalidate()``
+                     and ``clear()`` methods are shared between processes.
+
+        The dependencies of an entry on locations are computed when it is
+        stored (see :meth:`quantity_cache_set`): for recursive queries,
+        that's the containers that were below the location at that time.
+        """
+        cls.disable_quantity_cache()
+        if cache is None:
+            cache = QuantityCache(maxsize=maxsize, ttl=ttl)
+        cls.quantity_cache = cache
+
+        def clear(session, previous_transaction):
+            cache.clear()
+
+        cls._quantity_cache_clear_listener = clear
+        event.listen(cls.registry.session, 'after_soft_rollback', clear)
+        return cache
+
+    @classmethod
+    def disable_quantity_cache(cls):
+        """Stop using the cache set up by :meth:`enable_quantity_cache`."""
+        clear = getattr(cls, '_quantity_cache_clear_listener', None)
+        if clear is not None:
+            event.remove(cls.registry.session, 'after_soft_rollback', clear)
+            cls._quantity_cache_clear_listener = None
+        cls.quantity_cache = None
+
+    @classmethod
+    def quantity_cache_key(cls, method, goods_type=None,
+                           additional_states=None,
+                           at_datetime=None,
+                           additional_filter=None,
+                           location=None,
+                           location_recurse=True,
+                           properties=None,
+                           **kwargs):
+        """Normalize the arguments of a quantity computation as a cache key.
+
+        :param method: name of the cached method
+        :return: a hashable key, or ``None`` if the cache is disabled
+                 or if the arguments can't be cached (``additional_filter``
+                 or ``properties`` are specified, the latter because
+                 changes of properties don't go through Operations).
+                 The cache is also bypassed while invalidations are
+                 deferred (see :meth:`quantity_cache_deferred`).
+        """
+        if (cls.quantity_cache is None or
+                additional_filter is not None or properties or
+                cls.quantity_cache_deferred() is not None):
+            return None
+        if at_datetime is DATE_TIME_INFINITY:
+            at_datetime = 'infinity'
+        return (method,
+                None if goods_type is None else goods_type.id,
+                None if location is None else location.id,
+                location is not None and bool(location_recurse),
+                (None if additional_states is None
+                 else frozenset(additional_states)),
+                at_datetime,
+                tuple(sorted(kwargs.items())))
+
+    @classmethod
+    def quantity_cache_set(cls, key, value,
+                           goods_type=None,
+                           additional_states=None,
+                           at_datetime=None,
+                           location=None,
+                           location_recurse=True,
+                           goods_type_subtree=False,
+                           **kwargs):
+        """Store a result in the cache, computing its dependencies.
+
+        In the recursive case, the ids of all containers below ``location``
+        are queried, so that changes to any of them are taken into account.
+        This is a snapshot: containers that are moved below ``location``
+        later on are also taken into account, because the Operations moving
+        them affect ``location`` or one of its sub-containers.
+        With ``goods_type_subtree``, the result depends on all Types.
+        """
+        if location is None:
+            location_ids = None
+        elif not location_recurse:
+            location_ids = (location.id, )
+        else:
+            cte = cls.PhysObj.flatten_containers_subquery(
+                top=location,
+                additional_states=additional_states,
+                at_datetime=at_datetime)
+            location_ids = set(
+                row[0] for row in cls.registry.session.query(cte.c.id).all())
+        cls.quantity_cache.set(
+            key, value,
+            type_id=(None if goods_type is None or goods_type_subtree
+                     else goods_type.id),
+            location_ids=location_ids)
+
+    @classmethod
+    def quantity_cache_deferred(cls):
+        """Return the Operations whose cache invalidations are deferred.
+
+        :return: ``None`` if invalidations aren't deferred in the current
+                 session, otherwise the set of ids of Operations to
+                 invalidate the cache for, at the end of the current
+                 batch (see :meth:`defer_quantity_cache_invalidation`).
+        """
+        return cls.registry.session.info.get(QUANTITY_CACHE_DEFERRED)
+
+    @classmethod
+    @contextmanager
+    def defer_quantity_cache_invalidation(cls):
+        """Context manager to invalidate the quantity cache once for a batch.
+
+        Within the ``with`` block, :meth:`Operation.invalidate_quantity_cache
+        <anyblok_wms_base.core.operation.base.Operation.invalidate_quantity_cache>`
+        only records the Operation, and the quantity cache is bypassed.
+        At the end, the cache is invalidated for all recorded Operations,
+        using :meth:`Operation.quantity_cache_changes_batch
+        <anyblok_wms_base.core.operation.base.Operation.quantity_cache_changes_batch>`,
+        instead of issuing queries for each of them. If an exception
+        occurs, the cache is simply cleared.
+
+        The state is kept in the current session. Nested blocks are
+        part of the outermost one. Nothing happens if the cache is disabled.
+        """
+        if cls.quantity_cache is None or \
+                cls.quantity_cache_deferred() is not None:
+            yield
+            return
+        info = cls.registry.session.info
+        op_ids = info[QUANTITY_CACHE_DEFERRED] = set()
+        try:
+            yield
+        except Exception:
+            info.pop(QUANTITY_CACHE_DEFERRED, None)
+            if cls.quantity_cache is not None:
+                cls.quantity_cache.clear()
+            raise
+        info.pop(QUANTITY_CACHE_DEFERRED, None)
+        if op_ids:
+            cls.invalidate_quantity_cache(
+                cls.Operation.quantity_cache_changes_batch(list(op_ids)))
+
+    @classmethod
+    def invalidate_quantity_cache(cls, changes):
+        """Invalidate the cache for some changes.
+
+        :param changes: as returned by :meth:`Operation.quantity_cache_changes
+            <anyblok_wms_base.core.operation.base.Operation.quantity_cache_changes>`
+        """
+        if changes is None or cls.quantity_cache is None:
+            return
+        cls.quantity_cache.invalidate(*changes)
+
+    @classmethod
+    def grouped_quantity(cls, by_location=True, by_type=True, **kwargs):
+        """Execute :meth:`grouped_quantity_query`, using the cache if enabled.
+
+        The parameters are the same as for :meth:`grouped_quantity_query`,
+        except ``joined``, which is not supported, since the results
+        are kept in the cache outside of the database session.
+
+        :return: list of tuples, as produced by the non-joined
+                 :meth:`grouped_quantity_query`
+        """
+        key = cls.quantity_cache_key('grouped_quantity',
+                                     by_location=by_location,
+                                     by_type=by_type,
+                                     **kwargs)
+        if key is not None:
+            res = cls.quantity_cache.get(key, _missing)
+            if res is not _missing:
+                return list(res)
+
+        res = [tuple(row) for row in cls.grouped_quantity_query(
+            by_location=by_location, by_type=by_type, **kwargs).all()]
+        if key is not None:
+            cls.quantity_cache_set(key, tuple(res), **kwargs)
+        return res
+
+    @classmethod
+    def quantities(cls, targets,
+                   additional_states=None,
+                   at_datetime=None,
+                   additional_filter=None,
+                   location_recurse=True,
+                   properties=None,
+                   goods_type_subtree=False,
+                   **kwargs):
+        """Compute quantities for several locations and Types in one query.
+
+        :param targets: iterable of pairs (location, PhysObj Type)
+        :param location_recurse: if ``True``, the PhysObj Avatars from
+                                 sublocations of each location are taken
+                                 recursively into account, as in
+                                 :meth:`quantity_query`.
+        :param goods_type_subtree:
+            if ``True``, the PhysObj whose Types are descendants of each
+            Type are taken into account, as in :meth:`quantity_query`
+            (see :meth:`Type.flatten_subtypes_tops_subquery
+            <anyblok_wms_base.core.physobj.type.Type.flatten_subtypes_tops_subquery>`).
+        :return: a :class:`dict` whose keys are the given pairs, and
+                 values the corresponding quantities (including ``0``).
+
+        The other parameters have the same meaning as in
+        :meth:`quantity_query`, including those that optional Bloks may
+        add to it (passed as ``kwargs``).
+
+        In the recursive case, this relies on
+        :meth:`Wms.PhysObj.flatten_containers_tops_subquery
+        <anyblok_wms_base.core.physobj.main.PhysObj.flatten_containers_tops_subquery>`
+        """
+        targets = {(loc.id, gt.id): (loc, gt) for loc, gt in targets}
+        res = {target: 0 for target in targets.values()}
+        if not targets:
+            return res
+
+        PhysObj = cls.registry.Wms.PhysObj
+        Avatar = PhysObj.Avatar
+        query = cls.quantity_query(additional_states=additional_states,
+                                   at_datetime=at_datetime,
+                                   additional_filter=additional_filter,
+                                   properties=properties,
+                                   **kwargs)
+        if location_recurse:
+            cte = PhysObj.flatten_containers_tops_subquery(
+                set(loc for loc, _ in targets.values()),
+                at_datetime=at_datetime,
+                additional_states=additional_states)
+            query = query.join(cte, cte.c.id == Avatar.location_id)
+            loc_col = cte.c.top_id
+        else:
+            loc_col = Avatar.location_id
+        if goods_type_subtree:
+            cte = PhysObj.Type.flatten_subtypes_tops_subquery(
+                set(gt for _, gt in targets.values()))
+            query = query.join(cte, cte.c.id == PhysObj.type_id)
+            type_col = cte.c.top_id
+        else:
+            type_col = PhysObj.type_id
+
+        query = query.add_columns(loc_col, type_col).filter(
+            tuple_(loc_col, type_col).in_(list(targets))).group_by(
+                loc_col, type_col)
+
+        for qty, loc_id, type_id in query.all():
+            if qty is not None:
+                res[targets[loc_id, type_id]] = qty
+        return res
+
+    @classmethod
+    def quantity_series(cls, datetimes,
+                        additional_states=None,
+                        location=None,
+                        location_recurse=True,
+                        **kwargs):
+        """Compute quantities at several dates and times in one query.
+
+        This is equivalent to calling :meth:`quantity` once for each of
+        the given ``datetimes``, passing it as ``at_datetime``, but is
+        done with a single SQL query, in which the Avatars are joined on
+        the list of ``datetimes`` with the ``@>`` operator on their
+        :attr:`dt_range
+        <anyblok_wms_base.core.physobj.main.Avatar.dt_range>`.
+
+        To that effect, :meth:`quantity_query` is called with a column
+        of that list as ``at_datetime``, and without ``location``.
+
+        :param datetimes: iterable of :class:`datetime` instances, and
+                          possibly ``DATE_TIME_INFINITY``. Regular grids
+                          (e.g., hourly over the next two days) are best
+                          produced with :class:`datetime.timedelta`.
+        :return: list of pairs ``(at_datetime, quantity)``, in the order
+                 of ``datetimes``.
+
+        The other parameters have the same meaning as in
+        :meth:`quantity_query`, including those that optional Bloks may
+        add to it (passed as ``kwargs``). In the recursive case, the
+        containing hierarchy is itself evaluated separately for each of
+        the ``datetimes``, by :meth:`PhysObj.flatten_containers_series_subquery
+        <anyblok_wms_base.core.physobj.main.PhysObj.flatten_containers_series_subquery>`.
+        """
+        if 'at_datetime' in kwargs:
+            raise TypeError("quantity_series() got an unexpected keyword "
+                            "argument 'at_datetime'")
+        datetimes = list(datetimes)
+        if not datetimes:
+            return []
+
+        PhysObj = cls.registry.Wms.PhysObj
+        Avatar = PhysObj.Avatar
+        tstz = TIMESTAMP(timezone=True)
+        # DATE_TIME_INFINITY is sent to PostgreSQL as 'infinity', which
+        # is contained exactly in ranges with an unbounded upper end.
+        # We group by index rather than by date/time, because psycopg2
+        # can't convert 'infinity' back to Python.
+        at_dts = [select([literal(i).label('idx'),
+                          cast('infinity' if dt is DATE_TIME_INFINITY else dt,
+                               tstz).label('at_datetime')])
+                  for i, dt in enumerate(datetimes)]
+        at_dts = (at_dts[0] if len(at_dts) == 1
+                  else union_all(*at_dts)).alias(name='at_datetimes')
+
+        query = cls.quantity_query(additional_states=additional_states,
+                                   at_datetime=at_dts.c.at_datetime,
+                                   **kwargs)
+        if location is not None:
+            if location_recurse:
+                cte = PhysObj.flatten_containers_series_subquery(
+                    location, at_dts, additional_states=additional_states)
+                # in filter() rather than in the join condition, because
+                # at_datetimes comes after the joins in the FROM clause
+                query = query.join(
+                    cte, cte.c.id == Avatar.location_id).filter(
+                        cte.c.idx == at_dts.c.idx)
+            else:
+                query = query.filter(Avatar.location == location)
+
+        idx_col = at_dts.c.idx
+        res = [0] * len(datetimes)
+        for qty, idx in query.add_columns(idx_col).group_by(idx_col).all():
+            if qty is not None:
+                res[idx] = qty
+        return list(zip(datetimes, res))
 
     @classmethod
     def grouped_quantity_query(
@@ -203,6 +608,56 @@ class Wms:
 
         return query
 
+    @classmethod
+    def stock_export(cls, page_size=10000, fetch_size=1000, **kwargs):
+        """Stream quantities grouped by location and Type, for exports.
+
+        Contrary to :meth:`grouped_quantity_query` with ``joined=True``,
+        this doesn't instantiate any :class:`PhysObj
+        <anyblok_wms_base.core.physobj.main.PhysObj>` nor :class:`Type
+        <anyblok_wms_base.core.physobj.type.Type>`, and memory usage
+        doesn't depend on the total number of results:
+
+        - the results are fetched by pages of ``page_size`` rows, using
+          keyset pagination on the ids of locations and Types, rather
+          than ``OFFSET``, whose cost grows with the page number.
+        - each page is read from a server-side cursor, by batches of
+          ``fetch_size`` rows.
+
+        The other parameters are passed over to :meth:`quantity_query`.
+        For instance, restricting to a given ``location`` restricts the
+        export to what's inside it (recursively by default).
+
+        :return: generator of tuples
+                 ``(location_id, location_code, type_code, quantity)``,
+                 ordered by location and Type ids.
+        """
+        PhysObj = cls.registry.Wms.PhysObj
+        Avatar = PhysObj.Avatar
+        Location = orm.aliased(PhysObj, name='location')
+        PT = orm.aliased(PhysObj.Type, name='physobj_type')
+        keys = (Avatar.location_id, PhysObj.type_id)
+        query = (cls.quantity_query(**kwargs)
+                 .join(Location, Avatar.location_id == Location.id)
+                 .join(PT, PhysObj.type_id == PT.id)
+                 .add_columns(Location.code, PT.code, *keys)
+                 .group_by(Location.code, PT.code, *keys)
+                 .order_by(*keys))
+
+        last = None
+        while True:
+            page = query
+            if last is not None:
+                page = page.filter(tuple_(*keys) > tuple_(*last))
+            count = 0
+            for qty, loc_code, type_code, loc_id, type_id in page.limit(
+                    page_size).yield_per(fetch_size):
+                count += 1
+                yield loc_id, loc_code, type_code, 0 if qty is None else qty
+            if count < page_size:
+                return
+            last = (loc_id, type_id)
+
     @classmethod
     def base_quantity_query(cls):
         """Return base join quantity query, without any filtering
@@ -283,3 +738,31 @@ class Wms:
                 "Not a proper container type: %r " % container_type)
         return cls.registry.Wms.PhysObj.insert(type=container_type,
                                                **fields)
+
+    @classmethod
+    def loaded_records(cls, model, ids, session=None):
+        """Return the records of ``model`` with given ids held by a session.
+
+        This doesn't issue any query: the ids of records that aren't in
+        the identity map of ``session`` (by default, the current one),
+        and ``None`` values, are skipped. It's meant for callers of
+        set-based statements to invalidate or expire exactly the records
+        that they have changed.
+
+        :param model: a Model class, e.g., ``registry.Wms.PhysObj``
+        :param ids: iterable of primary key values
+        :rtype: list
+        """
+        if session is None:
+            session = cls.registry.session
+        mapper = orm.class_mapper(model)
+        identity_map = session.identity_map
+        res = []
+        for pk in set(ids):
+            if pk is None:
+                continue
+            record = identity_map.get(
+                mapper.identity_key_from_primary_key((pk, )))
+            if record is not None:
+                res.append(record)
+        return res
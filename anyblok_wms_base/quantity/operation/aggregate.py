@@ -75,12 +75,8 @@ class Aggregate(Operation):
             return val1 == val2
 
         # TODO implement on Properties class and test separately
-        # TODO PERF (minor): we could use fields_description() directly
-        props1 = val1.to_dict()
-        props2 = val2.to_dict()
-        props1.pop('id')
-        props2.pop('id')
-        return props1 == props2
+        # comparing contents only, not ids nor interning hashes
+        return val1 == val2 or val1.as_dict() == val2.as_dict()
 
     @classmethod
     def check_create_conditions(cls, state, dt_execution, inputs=None,
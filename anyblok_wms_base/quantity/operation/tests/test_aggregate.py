@@ -84,11 +84,7 @@ class TestAggregate(WmsTestCase):
         self.assertEqual(new_avatar.location, self.loc)
         new_goods = new_avatar.goods
         self.assertIsNotNone(new_goods.properties)
-        new_props = new_goods.properties.to_dict()
-        new_props.pop('id')
-        old_props = props.to_dict()
-        old_props.pop('id')
-        self.assertEqual(new_props, old_props)
+        self.assertEqual(new_goods.properties.as_dict(), props.as_dict())
 
     def test_create_done_several_dt_from(self):
         self.avatars[1].dt_from = self.dt_test2
@@ -108,13 +104,9 @@ class TestAggregate(WmsTestCase):
             PhysObj.type != self.location_type).all()
         self.assertEqual(len(new_goods), 2)
         if props is not None:
-            old_props = props.to_dict()
-            old_props.pop('id')
             for line in new_goods:
                 self.assertIsNotNone(line.properties)
-                new_props = line.properties.to_dict()
-                new_props.pop('id')
-                self.assertEqual(new_props, old_props)
+                self.assertEqual(line.properties.as_dict(), props.as_dict())
         self.assertEqual(set(g.quantity for g in new_goods), set((1, 2)))
 
         for avatar in self.PhysObj.Avatar.query().all():
@@ -326,5 +318,5 @@ class TestAggregate(WmsTestCase):
         gt.behaviours = {SPLIT_AGGREGATE_PHYSICAL_BEHAVIOUR: True}
         self.assertFalse(agg.is_reversible())
 
-        gt.behaviours['aggregate'] = dict(reversible=True)
+        gt.behaviours = dict(gt.behaviours, aggregate=dict(reversible=True))
         self.assertTrue(agg.is_reversible())
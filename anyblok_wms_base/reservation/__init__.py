@@ -24,6 +24,7 @@ class WmsReservation(Blok):
         from . import request  # noqa
         from . import reservation  # noqa
         from . import operation  # noqa
+        from . import wms  # noqa
 
     @classmethod
     def reload_declaration_module(cls, reload):
@@ -35,3 +36,5 @@ class WmsReservation(Blok):
         reload(reservation)
         from . import operation
         reload(operation)
+        from . import wms
+        reload(wms)
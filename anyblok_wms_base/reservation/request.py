@@ -299,7 +299,6 @@ class RequestItem:
         PhysObj = Wms.PhysObj
         Reservation = Wms.Reservation
         Avatar = PhysObj.Avatar
-        Props = PhysObj.Properties
         # TODO PERF this returns from the DB one PhysObj line per
         # Avatar, but SQLA reassembles them as exactly one (seen while
         # tracing the test_reserve_avatars_once() under pdb)
@@ -311,13 +310,8 @@ class RequestItem:
                 PhysObj.type == self.goods_type,
                 Avatar.state.in_(('present', 'future')))
         if self.properties:
-            props = self.properties.copy()
-            query = query.join(PhysObj.properties)
-            pfields = Props.fields_description()
-            for p in set(props).intersection(pfields):
-                query = query.filter(getattr(Props, p) == props.pop(p))
-            if props:
-                query = query.filter(Props.flexible.contains(props))
+            query = query.join(PhysObj.properties).filter(
+                *PhysObj.Properties.query_criteria(self.properties))
         return [(1, g) for g in query.limit(quantity).all()]
 
     def reserve(self):
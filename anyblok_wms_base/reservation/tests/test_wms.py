@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Base project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from anyblok_wms_base.testing import WmsTestCase
+
+
+class WmsQuantityTestCase(WmsTestCase):
+
+    def setUp(self):
+        super(WmsQuantityTestCase, self).setUp()
+        Wms = self.registry.Wms
+        self.Wms = Wms
+        self.Operation = Wms.Operation
+        self.Reservation = Wms.Reservation
+
+        self.goods_type = Wms.PhysObj.Type.insert(label="My good type",
+                                                  code="MyGT")
+        self.stock = self.insert_location('STOCK')
+        self.arrivals = [
+            self.Operation.Arrival.create(goods_type=self.goods_type,
+                                          location=self.stock,
+                                          state=state,
+                                          dt_execution=self.dt_test1)
+            for state in ('done', 'done', 'planned')]
+
+    def reserve(self, arrival):
+        request = self.Reservation.Request.insert(reserved=True)
+        req_item = self.Reservation.RequestItem.insert(
+            request=request,
+            goods_type=self.goods_type,
+            quantity=1)
+        return self.Reservation.insert(goods=arrival.outcomes[0].obj,
+                                       request_item=req_item)
+
+    def test_unreserved_only(self):
+        quantity = self.Wms.quantity
+        self.reserve(self.arrivals[0])
+
+        self.assertEqual(quantity(goods_type=self.goods_type,
+                                  location=self.stock), 2)
+        self.assertEqual(quantity(goods_type=self.goods_type,
+                                  location=self.stock,
+                                  unreserved_only=True), 1)
+        self.assertEqual(quantity(goods_type=self.goods_type,
+                                  location=self.stock,
+                                  additional_states=['future'],
+                                  at_datetime=self.dt_test2,
+                                  unreserved_only=True), 2)
+
+        # grouped queries go through quantity_query as well
+        self.assertEqual(
+            self.Wms.grouped_quantity_query(
+                location=self.stock, unreserved_only=True).all(),
+            [(1, self.stock.id, self.goods_type.id)])
+
+        # and so do quantity series
+        self.assertEqual(
+            self.Wms.quantity_series([self.dt_test1, self.dt_test2],
+                                     goods_type=self.goods_type,
+                                     location=self.stock,
+                                     additional_states=['future'],
+                                     unreserved_only=True),
+            [(self.dt_test1, 2), (self.dt_test2, 2)])
+
+    def test_available_to_promise(self):
+        atp = self.Wms.available_to_promise
+        self.assertEqual(atp(goods_type=self.goods_type,
+                             location=self.stock), 3)
+
+        self.reserve(self.arrivals[0])
+        self.reserve(self.arrivals[2])
+        self.assertEqual(atp(goods_type=self.goods_type,
+                             location=self.stock), 1)
+        # before the planned Arrival
+        self.assertEqual(atp(goods_type=self.goods_type,
+                             location=self.stock,
+                             at_datetime=self.dt_test1), 1)
+
+    def test_unreserved_only_not_cached(self):
+        Wms = self.Wms
+        cache = Wms.enable_quantity_cache()
+        try:
+            self.assertEqual(Wms.quantity(goods_type=self.goods_type,
+                                          location=self.stock,
+                                          unreserved_only=True), 2)
+            self.reserve(self.arrivals[0])
+            self.assertEqual(Wms.quantity(goods_type=self.goods_type,
+                                          location=self.stock,
+                                          unreserved_only=True), 1)
+            self.assertEqual(len(cache), 0)
+        finally:
+            Wms.disable_quantity_cache()
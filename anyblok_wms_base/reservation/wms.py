@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Base project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from sqlalchemy import orm
+from anyblok import Declarations
+
+from anyblok_wms_base.constants import DATE_TIME_INFINITY
+
+
+@Declarations.register(Declarations.Model)
+class Wms:
+    """Override to take reservations into account in quantity queries."""
+
+    @classmethod
+    def quantity_query(cls, unreserved_only=False, **kwargs):
+        """Add the possibility to count only unreserved PhysObj.
+
+        :param bool unreserved_only: if ``True``, the PhysObj having a
+                                     :class:`Reservation
+                                     <anyblok_wms_base.reservation.reservation.Reservation>`
+                                     are not taken into account.
+                                     This is done with an anti-join,
+                                     as in :meth:`RequestItem.lookup
+                                     <anyblok_wms_base.reservation.request.RequestItem.lookup>`.
+
+        All other parameters are passed over to the base implementation.
+        """
+        query = super(Wms, cls).quantity_query(**kwargs)
+        if unreserved_only:
+            Reservation = orm.aliased(cls.Reservation, name='reservation')
+            query = query.outerjoin(
+                Reservation,
+                Reservation.physobj_id == cls.PhysObj.id).filter(
+                    Reservation.physobj_id.is_(None))
+        return query
+
+    @classmethod
+    def available_to_promise(cls, at_datetime=DATE_TIME_INFINITY, **kwargs):
+        """Compute the quantity available to promise.
+
+        This is the quantity of PhysObj that are present or will be,
+        minus those that are reserved, computed in a single query.
+
+        :param at_datetime: the date and time at which to consider
+                            future Avatars. By default, it is
+                            ``DATE_TIME_INFINITY``, i.e., the final
+                            outcome of all planned Operations.
+
+        All other parameters are passed over to :meth:`quantity`.
+        """
+        return cls.quantity(additional_states=['future'],
+                            at_datetime=at_datetime,
+                            unreserved_only=True,
+                            **kwargs)
+
+    @classmethod
+    def quantity_cache_key(cls, method, unreserved_only=False, **kwargs):
+        """Don't cache results restricted to unreserved PhysObj.
+
+        Reservations aren't done through Operations, hence they
+        wouldn't invalidate the cache.
+        """
+        if unreserved_only:
+            return None
+        return super(Wms, cls).quantity_cache_key(method, **kwargs)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Base project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from anyblok.blok import Blok
+from anyblok_wms_base import version
+
+
+def import_declarations(reload=None):
+    from . import ledger
+    from . import wms
+    from . import operation
+
+    if reload is not None:
+        reload(ledger)
+        reload(wms)
+        reload(operation)
+
+
+class WmsStockLedger(Blok):
+    """Stock ledger for fast reads of present and future quantities.
+
+    With this Blok installed, the most common quantity queries, i.e., those
+    about the present and the final future, are answered from a table of
+    counters, one per location, PhysObj Type and Avatar state, which is kept
+    up to date by the Operations.
+
+    This is meant for applications that issue quantity queries at a high
+    rate, such as replenishment dashboards.
+    """
+    version = version
+    author = "Georges Racinet"
+    required = ['wms-core']
+
+    def update(self, latest_version):
+        if latest_version is None:
+            self.registry.Wms.StockLedger.refresh_all()
+
+    @classmethod
+    def import_declaration_module(cls):
+        import_declarations()
+
+    @classmethod
+    def reload_declaration_module(cls, reload):
+        import_declarations(reload=reload)
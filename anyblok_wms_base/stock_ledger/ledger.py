@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Base project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from sqlalchemy import case
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from anyblok import Declarations
+from anyblok.column import Decimal
+from anyblok.column import Selection
+from anyblok.relationship import Many2One
+
+from anyblok_wms_base.constants import AVATAR_STATES
+
+register = Declarations.register
+Model = Declarations.Model
+
+
+@register(Model.Wms)
+class StockLedger:
+    """Counters of PhysObj, per location, Type and Avatar state.
+
+    There is at most one record for each combination of :attr:`location`,
+    :attr:`goods_type` and :attr:`state`, giving the quantity
+    of PhysObj whose :ref:`Avatars <physobj_avatar>` are *directly*
+    in that location.
+
+    Only the ``present`` and ``future`` states are recorded: ``past``
+    Avatars pile up endlessly, and are anyway only relevant for quantity
+    queries at a given date and time, which the ledger can't answer.
+
+    The quantities are computed with :meth:`Wms.base_quantity_query
+    <anyblok_wms_base.core.wms.Wms.base_quantity_query>`, hence they are
+    counts of PhysObj, unless the :ref:`blok_wms_quantity` Blok is
+    installed, in which case they are sums of the ``quantity`` field.
+
+    The records are not meant to be created directly: the ledger is
+    maintained by :meth:`recompute`, which all Operations call on the
+    locations and Types they affect (see :class:`Operation
+    <anyblok_wms_base.stock_ledger.operation.Operation>`).
+    """
+
+    STATES = ('present', 'future')
+    """The Avatar states that the ledger keeps track of."""
+
+    ADVISORY_LOCK = 0x776d736c  # 'wmsl'
+    """Key of the advisory lock between :meth:`refresh_all` and
+    :meth:`recompute` (in the single ``bigint`` key space)."""
+
+    location = Many2One(model=Model.Wms.PhysObj,
+                        primary_key=True,
+                        foreign_key_options={'ondelete': 'cascade'})
+    """The direct location of the counted Avatars."""
+
+    goods_type = Many2One(model=Model.Wms.PhysObj.Type,
+                          primary_key=True,
+                          index=True,
+                          foreign_key_options={'ondelete': 'cascade'})
+    """The Type of the counted PhysObj."""
+
+    state = Selection(selections=AVATAR_STATES, primary_key=True)
+    """The state of the counted Avatars."""
+
+    quantity = Decimal(nullable=False, default=0)
+    """Quantity of all Avatars in the given state."""
+
+    open_quantity = Decimal(nullable=False, default=0)
+    """Quantity of the Avatars having no :attr:`dt_until
+    <anyblok_wms_base.core.physobj.main.Avatar.dt_until>`.
+
+    This is what quantity queries at
+    :data:`DATE_TIME_INFINITY <anyblok_wms_base.constants.DATE_TIME_INFINITY>`
+    need.
+    """
+
+    @classmethod
+    def aggregate_query(cls):
+        """Query computing the ledger values from the Avatars.
+
+        :return: a query whose columns are the quantity, the location id,
+                 the Type id, the Avatar state and whether the
+                 Avatar ``dt_until`` is unbounded.
+        """
+        Wms = cls.registry.Wms
+        Avatar = Wms.PhysObj.Avatar
+        open_ = Avatar.dt_until.is_(None)
+        cols = (Avatar.location_id, Wms.PhysObj.type_id, Avatar.state, open_)
+        return Wms.base_quantity_query().add_columns(*cols).filter(
+            Avatar.state.in_(cls.STATES)).group_by(*cols)
+
+    @classmethod
+    def insert_aggregated(cls, query):
+        """Insert or update records from the results of :meth:`aggregate_query`.
+
+        This is a single ``INSERT ... SELECT ... ON CONFLICT DO UPDATE``
+        statement. The values are those of the statement's snapshot: to
+        be correct in presence of concurrent transactions, the callers must
+        hold the locks of :meth:`lock_keys`.
+
+        :return: the set of keys (location id, Type id, state) of the
+                 records that have been inserted or updated.
+        """
+        qty, loc_id, type_id, state, open_ = query.subquery().c
+        table = cls.__table__
+        aggregated = select([
+            loc_id, type_id, state,
+            func.sum(qty),
+            func.sum(case([(open_, qty)], else_=0)),
+        ]).group_by(loc_id, type_id, state)
+        stmt = pg_insert(table).from_select(
+            ['location_id', 'goods_type_id', 'state',
+             'quantity', 'open_quantity'],
+            aggregated)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.location_id,
+                            table.c.goods_type_id,
+                            table.c.state],
+            set_=dict(quantity=stmt.excluded.quantity,
+                      open_quantity=stmt.excluded.open_quantity),
+        ).returning(table.c.location_id, table.c.goods_type_id, table.c.state)
+
+        session = cls.registry.session
+        written = set(tuple(row) for row in session.execute(stmt))
+        for obj in list(session.identity_map.values()):
+            if isinstance(obj, cls):
+                session.expire(obj)
+        return written
+
+    @classmethod
+    def recompute(cls, keys):
+        """Recompute the records for the given locations and Types.
+
+        :param keys: iterable of pairs (location id, Type id), as collected by
+                     the Operations before and after their changes.
+
+        The recomputation is restricted to the Avatars sitting directly
+        in these locations: its cost depends on the stock in these
+        locations only, and it can be safely repeated.
+
+        The keys are first locked by :meth:`lock_keys`, so that, under
+        the default ``READ COMMITTED`` isolation level, the aggregation
+        sees the changes of concurrent transactions that recomputed the
+        same keys. The records are then written by
+        :meth:`insert_aggregated`, and those that don't have any Avatar
+        anymore are deleted.
+        """
+        keys = set(keys)
+        if not keys:
+            return
+        cls.registry.flush()
+        cls.lock_keys(keys)
+        PhysObj = cls.registry.Wms.PhysObj
+        written = cls.insert_aggregated(cls.aggregate_query().filter(
+            tuple_(PhysObj.Avatar.location_id, PhysObj.type_id).in_(keys)))
+        query = cls.query().filter(
+            tuple_(cls.location_id, cls.goods_type_id).in_(keys))
+        if written:
+            query = query.filter(~tuple_(cls.location_id,
+                                         cls.goods_type_id,
+                                         cls.state).in_(written))
+        query.delete(synchronize_session='fetch')
+
+    @classmethod
+    def lock_keys(cls, keys):
+        """Lock the given keys until the end of the current transaction.
+
+        :param keys: pairs (location id, Type id)
+
+        These are PostgreSQL transaction level advisory locks, taken
+        in a consistent order to avoid deadlocks, in the two integers key
+        space. Another transaction locking some of the same keys waits
+        until the current one is over.
+
+        A shared lock on :attr:`ADVISORY_LOCK` is also taken, so that
+        :meth:`refresh_all` is mutually exclusive with all recomputations.
+
+        The locks have to be taken before aggregating: rows locks on the
+        ledger records wouldn't be enough, because they don't exist yet
+        for new keys.
+        """
+        execute = cls.registry.execute
+        execute(select([func.pg_advisory_xact_lock_shared(cls.ADVISORY_LOCK)]))
+        for loc_id, type_id in sorted(keys):
+            execute(select([func.pg_advisory_xact_lock(loc_id, type_id)]))
+
+    @classmethod
+    def refresh_all(cls):
+        """Rebuild the whole ledger from scratch.
+
+        This is done at installation, and can also be useful for data
+        imports that bypass Operations.
+
+        This takes an exclusive lock on :attr:`ADVISORY_LOCK`, waiting
+        for concurrent recomputations to be over.
+        """
+        cls.registry.flush()
+        cls.registry.execute(
+            select([func.pg_advisory_xact_lock(cls.ADVISORY_LOCK)]))
+        cls.query().delete(synchronize_session='fetch')
+        cls.insert_aggregated(cls.aggregate_query())
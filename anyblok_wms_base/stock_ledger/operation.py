@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Base project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+import itertools
+
+from sqlalchemy import select
+
+from anyblok import Declarations
+
+register = Declarations.register
+Wms = Declarations.Model.Wms
+
+
+@register(Wms)
+class Operation:
+    """Override to maintain the :class:`stock ledger
+    <anyblok_wms_base.stock_ledger.ledger.StockLedger>`.
+
+    This is done at the level of the main public methods, so that it
+    applies uniformly to all Operation classes, including those that
+    downstream libraries and applications define, whatever their
+    implementations of :meth:`after_insert`, :meth:`execute_planned`,
+    :meth:`cancel_single` and :meth:`obliviate_single`. For cancel and
+    oblivion, this is done for each batch of removed Operations, and
+    :meth:`bulk_create` and :meth:`bulk_execute` recompute once for all
+    created or executed Operations.
+
+    Since the ledger is recomputed for the affected locations and Types
+    rather than incremented, Operations calling other ones (e.g., the
+    Split done for a partial Move) can't make it drift.
+    """
+
+    def stock_ledger_keys(self):
+        """Return the locations and Types affected by the Operation.
+
+        :return: set of pairs (location id, Type id) of :attr:`inputs`
+                 and :attr:`outcomes`.
+        """
+        return set((av.location_id, av.obj.type_id)
+                   for av in itertools.chain(self.inputs, self.outcomes))
+
+    @classmethod
+    def create(cls, **kwargs):
+        op = super(Operation, cls).create(**kwargs)
+        cls.registry.Wms.StockLedger.recompute(op.stock_ledger_keys())
+        return op
+
+    @classmethod
+    def bulk_create(cls, specs):
+        """Override to recompute the ledger once for the whole batch."""
+        operations = super(Operation, cls).bulk_create(specs)
+        cls.registry.Wms.StockLedger.recompute(
+            cls.stock_ledger_keys_batch([op.id for op in operations]))
+        return operations
+
+    def execute(self, dt_execution=None):
+        super(Operation, self).execute(dt_execution=dt_execution)
+        self.registry.Wms.StockLedger.recompute(self.stock_ledger_keys())
+
+    @classmethod
+    def bulk_execute(cls, operations, dt_execution):
+        """Override to recompute the ledger once for the whole batch."""
+        failures = super(Operation, cls).bulk_execute(operations,
+                                                      dt_execution)
+        cls.registry.Wms.StockLedger.recompute(cls.stock_ledger_keys_batch(
+            [op.id for op in operations if op.id not in failures]))
+        return failures
+
+    @classmethod
+    def stock_ledger_keys_batch(cls, op_ids):
+        """Set-based version of :meth:`stock_ledger_keys`.
+
+        :param op_ids: ids of Operations
+        :return: set of pairs (location id, Type id)
+        """
+        affected = cls.affected_avatars(op_ids)
+        physobj = cls.registry.Wms.PhysObj.__table__
+        query = select([affected.c.location_id, physobj.c.type_id]).where(
+            physobj.c.id == affected.c.obj_id).distinct()
+        return set(tuple(row) for row in cls.registry.execute(query))
+
+    @classmethod
+    def single_batch(cls, operations, meth_name, **kwargs):
+        """Override to recompute the ledger after cancel or oblivion.
+
+        This is where :meth:`cancel` and :meth:`obliviate` actually remove
+        Operations, followers included, by batches.
+        """
+        keys = cls.stock_ledger_keys_batch([op.id for op in operations])
+        super(Operation, cls).single_batch(operations, meth_name, **kwargs)
+        cls.registry.Wms.StockLedger.recompute(keys)
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Base project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from sqlalchemy import func
+from sqlalchemy import select
+
+from anyblok_wms_base.constants import DATE_TIME_INFINITY
+from anyblok_wms_base.testing import WmsTestCase
+
+
+class TestStockLedger(WmsTestCase):
+
+    def setUp(self):
+        super(TestStockLedger, self).setUp()
+        self.Ledger = self.Wms.StockLedger
+        self.physobj_type = self.PhysObj.Type.insert(label="My goods",
+                                                     code='MyGT')
+        self.stock = self.insert_location('STK')
+        self.sub = self.insert_location('STK/SUB', parent=self.stock)
+        self.other = self.insert_location('OTHER')
+        # locations inserted directly, bypassing Operations
+        self.Ledger.refresh_all()
+        self.default_quantity_location = self.stock
+
+    def assert_ledger(self, expected, location=None):
+        """Compare the ledger with the given expected quantities.
+
+        Records with zero quantities are considered to be missing.
+
+        :param expected: dict whose keys are pairs (location, state), and
+                         values pairs (quantity, open_quantity)
+        """
+        query = self.Ledger.query().filter_by(goods_type=self.physobj_type)
+        if location is not None:
+            query = query.filter_by(location=location)
+        self.assertEqual(
+            {(rec.location, rec.state): (rec.quantity, rec.open_quantity)
+             for rec in query.all()},
+            expected)
+
+    def assert_quantity_unchanged_semantics(self, **kwargs):
+        """Check that the ledger answers like the base implementation."""
+        expected = self.Wms.quantity_query(goods_type=self.physobj_type,
+                                           **kwargs).one()[0] or 0
+        ledger_query = self.Wms.stock_ledger_quantity_query(
+            goods_type=self.physobj_type, **kwargs)
+        self.assertIsNotNone(ledger_query)
+        self.assertEqual(ledger_query.one()[0] or 0, expected)
+
+    def assert_all_quantities(self):
+        for loc in (self.stock, self.sub, self.other):
+            for recurse in (True, False):
+                self.assert_quantity_unchanged_semantics(
+                    location=loc, location_recurse=recurse)
+                self.assert_quantity_unchanged_semantics(
+                    location=loc, location_recurse=recurse,
+                    additional_states=['future'],
+                    at_datetime=DATE_TIME_INFINITY)
+
+    def test_arrival_move(self):
+        arrival = self.Operation.Arrival.create(goods_type=self.physobj_type,
+                                                location=self.sub,
+                                                dt_execution=self.dt_test1,
+                                                state='planned')
+        self.assert_ledger({(self.sub, 'future'): (1, 1)})
+        self.assert_all_quantities()
+        self.assert_quantity(0)
+
+        arrival.execute(dt_execution=self.dt_test1)
+        self.assert_ledger({(self.sub, 'present'): (1, 1)})
+        self.assert_all_quantities()
+        self.assert_quantity(1)
+
+        move = self.Operation.Move.create(input=arrival.outcomes[0],
+                                          destination=self.other,
+                                          dt_execution=self.dt_test2,
+                                          state='planned')
+        self.assert_ledger({(self.sub, 'present'): (1, 0),
+                            (self.other, 'future'): (1, 1)})
+        self.assert_all_quantities()
+        self.assert_quantity(1)
+        self.assert_quantity(0, additional_states=['future'],
+                             at_datetime=DATE_TIME_INFINITY)
+
+        move.execute(dt_execution=self.dt_test2)
+        self.assert_ledger({(self.other, 'present'): (1, 1)})
+        self.assert_all_quantities()
+        self.assert_quantity(0)
+        self.assert_quantity(1, location=self.other)
+
+        arrival.obliviate()
+        self.assert_ledger({})
+        self.assert_all_quantities()
+
+    def test_cancel(self):
+        arrival = self.Operation.Arrival.create(goods_type=self.physobj_type,
+                                                location=self.sub,
+                                                dt_execution=self.dt_test1,
+                                                state='planned')
+        self.Operation.Move.create(input=arrival.outcomes[0],
+                                   destination=self.other,
+                                   dt_execution=self.dt_test2,
+                                   state='planned')
+        self.assert_ledger({(self.sub, 'future'): (1, 0),
+                            (self.other, 'future'): (1, 1)})
+        arrival.cancel()
+        self.assert_ledger({})
+        self.assert_all_quantities()
+
+    def test_recompute(self):
+        self.Operation.Arrival.create(goods_type=self.physobj_type,
+                                      location=self.sub,
+                                      dt_execution=self.dt_test1,
+                                      state='done')
+        # messing with the ledger
+        record = self.Ledger.query().filter_by(location=self.sub).one()
+        record.quantity = 5
+        self.Ledger.insert(location=self.other,
+                           goods_type=self.physobj_type,
+                           state='present',
+                           quantity=3,
+                           open_quantity=3)
+        keys = [(loc.id, self.physobj_type.id)
+                for loc in (self.sub, self.other)]
+
+        self.Ledger.recompute(keys)
+        self.assert_ledger({(self.sub, 'present'): (1, 1)})
+        # existing records are updated, and that can be repeated
+        self.assertEqual(record.quantity, 1)
+        self.Ledger.recompute(keys)
+        self.assert_ledger({(self.sub, 'present'): (1, 1)})
+
+    def test_recompute_locks(self):
+        """Concurrent recomputations of the same keys wait for each other.
+
+        Hence, the second one aggregates in a snapshot taken after the
+        first one is committed, instead of overwriting its results
+        with outdated values.
+        """
+        self.Operation.Arrival.create(goods_type=self.physobj_type,
+                                      location=self.sub,
+                                      dt_execution=self.dt_test1,
+                                      state='done')
+        gt_id = self.physobj_type.id
+        # the Arrival recomputed its key, hence holds the lock
+        conn = self.registry.engine.connect()
+        try:
+            def try_lock(*key):
+                trans = conn.begin()
+                try:
+                    return conn.execute(select([
+                        func.pg_try_advisory_xact_lock(*key)])).scalar()
+                finally:
+                    trans.rollback()
+
+            self.assertFalse(try_lock(self.sub.id, gt_id))
+            self.assertTrue(try_lock(self.other.id, gt_id))
+            # refresh_all() would have to wait as well
+            self.assertFalse(try_lock(self.Ledger.ADVISORY_LOCK))
+        finally:
+            conn.close()
+        self.assert_ledger({(self.sub, 'present'): (1, 1)})
+
+    def test_goods_type_subtree(self):
+        subtype = self.PhysObj.Type.insert(code='MySubGT',
+                                           parent=self.physobj_type)
+        for gt in (self.physobj_type, subtype, subtype):
+            self.Operation.Arrival.create(goods_type=gt,
+                                          location=self.sub,
+                                          dt_execution=self.dt_test1,
+                                          state='done')
+        self.assert_quantity_unchanged_semantics(location=self.stock,
+                                                 goods_type_subtree=True)
+        self.assertEqual(
+            self.Wms.stock_ledger_quantity_query(
+                goods_type=self.physobj_type,
+                goods_type_subtree=True).one()[0], 3)
+
+    def test_fallback(self):
+        self.Operation.Arrival.create(goods_type=self.physobj_type,
+                                      location=self.sub,
+                                      dt_execution=self.dt_test2,
+                                      state='planned')
+        self.assertIsNone(self.Wms.stock_ledger_quantity_query(
+            additional_states=['future'], at_datetime=self.dt_test3))
+        self.assertIsNone(self.Wms.stock_ledger_quantity_query(
+            additional_filter=lambda q: q))
+        self.assert_quantity(1, additional_states=['future'],
+                             at_datetime=self.dt_test3)
+        self.assert_quantity(0, additional_states=['future'],
+                             at_datetime=self.dt_test1)
+
+        # quantity series mix ledger and fallback queries
+        self.assertEqual(
+            self.Wms.quantity_series([self.dt_test1, self.dt_test3,
+                                      DATE_TIME_INFINITY],
+                                     goods_type=self.physobj_type,
+                                     additional_states=['future'],
+                                     location=self.stock),
+            [(self.dt_test1, 0), (self.dt_test3, 1),
+             (DATE_TIME_INFINITY, 1)])
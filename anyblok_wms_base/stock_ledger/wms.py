@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Base project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+from sqlalchemy import func
+from sqlalchemy import select
+
+from anyblok import Declarations
+
+from anyblok_wms_base.constants import DATE_TIME_INFINITY
+
+register = Declarations.register
+Model = Declarations.Model
+
+
+@register(Model)
+class Wms:
+    """Override to answer the most common quantity queries from the ledger.
+    """
+
+    @classmethod
+    def stock_ledger_quantity_query(cls,
+                                    goods_type=None,
+                                    additional_states=None,
+                                    at_datetime=None,
+                                    additional_filter=None,
+                                    location=None,
+                                    location_recurse=True,
+                                    properties=None,
+                                    goods_type_subtree=False,
+                                    **kwargs):
+        """Query the :class:`stock ledger
+        <anyblok_wms_base.stock_ledger.ledger.StockLedger>` if possible.
+
+        The parameters are the same as in :meth:`quantity_query`. The
+        ledger can answer about:
+
+        - the present: neither ``additional_states`` nor
+          ``at_datetime`` are specified
+        - the final future: ``additional_states=['future']`` and
+          ``at_datetime`` is :data:`DATE_TIME_INFINITY
+          <anyblok_wms_base.constants.DATE_TIME_INFINITY>`
+
+        and can't apply ``additional_filter`` nor ``properties``, nor
+        any criteria that other Bloks may add to :meth:`quantity_query`
+        (e.g., ``unreserved_only``), passed as ``kwargs``.
+
+        :return: Query object, with only one column (the quantity), or
+                 ``None`` if the ledger can't answer.
+        """
+        if (additional_filter is not None or properties or
+                any(kwargs.values())):
+            return None
+
+        Ledger = cls.StockLedger
+        if additional_states is None and at_datetime is None:
+            col, states = Ledger.quantity, ('present', )
+        elif (at_datetime is DATE_TIME_INFINITY and
+              additional_states is not None and
+              set(additional_states) == {'future'}):
+            col, states = Ledger.open_quantity, ('present', 'future')
+        else:
+            return None
+
+        query = Ledger.query(func.sum(col)).filter(Ledger.state.in_(states))
+        if goods_type is not None:
+            if goods_type_subtree:
+                subtypes = cls.PhysObj.Type.flatten_subtypes_subquery(
+                    goods_type)
+                query = query.filter(
+                    Ledger.goods_type_id.in_(select([subtypes.c.id])))
+            else:
+                query = query.filter(Ledger.goods_type == goods_type)
+
+        if location is not None:
+            if location_recurse:
+                cte = cls.PhysObj.flatten_containers_subquery(
+                    top=location,
+                    at_datetime=at_datetime,
+                    additional_states=additional_states)
+                query = query.join(cte, cte.c.id == Ledger.location_id)
+            else:
+                query = query.filter(Ledger.location == location)
+        return query
+
+    @classmethod
+    def quantity(cls, **kwargs):
+        """Use the ledger if possible, otherwise fall back to counting Avatars.
+
+        See :meth:`stock_ledger_quantity_query` for the cases that the
+        ledger can handle.
+        """
+        query = cls.stock_ledger_quantity_query(**kwargs)
+        if query is None:
+            return super(Wms, cls).quantity(**kwargs)
+        res = query.one()[0]
+        return 0 if res is None else res
+
+    @classmethod
+    def quantity_series(cls, datetimes, **kwargs):
+        """Use the ledger for the final future, if possible.
+
+        If ``datetimes`` contains :data:`DATE_TIME_INFINITY
+        <anyblok_wms_base.constants.DATE_TIME_INFINITY>`, the corresponding
+        quantity is read from the ledger whenever
+        :meth:`stock_ledger_quantity_query` can answer, and the base
+        implementation is used for the other ones.
+        """
+        datetimes = list(datetimes)
+        query = None
+        if any(dt is DATE_TIME_INFINITY for dt in datetimes):
+            query = cls.stock_ledger_quantity_query(
+                at_datetime=DATE_TIME_INFINITY, **kwargs)
+        if query is None:
+            return super(Wms, cls).quantity_series(datetimes, **kwargs)
+
+        final = query.one()[0]
+        final = 0 if final is None else final
+        others = iter(super(Wms, cls).quantity_series(
+            [dt for dt in datetimes if dt is not DATE_TIME_INFINITY],
+            **kwargs))
+        return [(dt, final) if dt is DATE_TIME_INFINITY else next(others)
+                for dt in datetimes]
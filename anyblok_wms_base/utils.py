@@ -6,7 +6,10 @@
 # This Source Code Form is subject to the terms of the Mozilla Public License,
 # v. 2.0. If a copy of the MPL was not distributed with this file,You can
 # obtain one at http://mozilla.org/MPL/2.0/.
+import copy
 import itertools
+import time
+from collections import OrderedDict
 
 _missing = object()
 """A marker to use as default value in get-like functions/methods."""
@@ -274,3 +277,247 @@ class NonZero:
         if not isinstance(other, NonZero) and not isinstance(other, int):
             raise ValueError("Can't compare NonZero() to %r" % other)
         return True
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError("{} object is read-only".format(type(self).__name__))
+
+
+class FrozenDict(dict):
+    """Read-only :class:`dict`, as produced by :func:`freeze`.
+
+    Being a :class:`dict` subclass, it can be passed to :func:`dict_merge`,
+    serialized in JSON, etc. Copies are mutable, and deep copies are so at
+    all levels::
+
+      >>> d = freeze(dict(a=[1], b=dict(c=2)))
+      >>> d['a'].append(2)
+      Traceback (most recent call last):
+      ...
+      TypeError: FrozenList object is read-only
+      >>> d.setdefault('x', 1)
+      Traceback (most recent call last):
+      ...
+      TypeError: FrozenDict object is read-only
+      >>> import copy
+      >>> dc = copy.deepcopy(d)
+      >>> dc['b']['c'] = 3
+      >>> dc['a'].append(2)
+      >>> sorted(dc.items())
+      [('a', [1, 2]), ('b', {'c': 3})]
+      >>> type(d.copy()), type(copy.copy(d))
+      (<class 'dict'>, <class 'dict'>)
+    """
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+    __ior__ = _read_only
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {k: copy.deepcopy(v, memo) for k, v in self.items()}
+
+    def __reduce__(self):
+        return dict, (dict(self), )
+
+
+class FrozenList(list):
+    """Read-only :class:`list`, as produced by :func:`freeze`.
+
+    Slices, copies and concatenations are plain lists::
+
+      >>> fl = freeze([dict(a=1)])
+      >>> fl += [2]
+      Traceback (most recent call last):
+      ...
+      TypeError: FrozenList object is read-only
+      >>> type(fl[:]), type(fl + [2])
+      (<class 'list'>, <class 'list'>)
+    """
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = _read_only
+    reverse = sort = clear = _read_only
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(v, memo) for v in self]
+
+    def __reduce__(self):
+        return list, (list(self), )
+
+
+def freeze(obj):
+    """Return a read-only version of ``obj``, recursing in lists and dicts.
+
+    Other values are assumed to be immutable, as is the case of all values
+    read from JSON.
+
+      >>> freeze(dict(a=[dict(b=1)], c='foo'))
+      {'a': [{'b': 1}], 'c': 'foo'}
+      >>> freeze(None) is None
+      True
+    """
+    if isinstance(obj, dict):
+        return obj if isinstance(obj, FrozenDict) else FrozenDict(
+            (k, freeze(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return obj if isinstance(obj, FrozenList) else FrozenList(
+            freeze(v) for v in obj)
+    return obj
+
+
+class QuantityCache:
+    """Process-local LRU cache for quantity computations.
+
+    Each entry is stored together with the dependencies it has on the
+    PhysObj Type and locations, so that :meth:`invalidate` can discard
+    precisely the entries that an Operation affects.
+
+    >>> cache = QuantityCache(maxsize=2)
+    >>> cache.set('a', 3, type_id=1, location_ids={10, 11})
+    >>> cache.set('b', 5, type_id=2, location_ids={10})
+    >>> cache.get('a')
+    3
+    >>> cache.get('c') is None
+    True
+    >>> cache.hits, cache.misses
+    (1, 1)
+
+    Inserting an entry beyond ``maxsize`` evicts the least recently used one:
+
+    >>> cache.set('c', 0, type_id=None, location_ids=None)
+    >>> sorted(cache.keys())
+    ['a', 'c']
+    >>> cache.evictions
+    1
+
+    ``None`` as ``type_id`` or ``location_ids`` means that the entry
+    depends on all Types or on all locations:
+
+    >>> cache.invalidate([(11, 2)])
+    >>> sorted(cache.keys())
+    ['a']
+    >>> cache.invalidate([(12, 1)])
+    >>> sorted(cache.keys())
+    ['a']
+
+    Changes to containers affect all Types:
+
+    >>> cache.invalidate((), container_location_ids=[11])
+    >>> len(cache)
+    0
+    >>> sorted(cache.stats().items())  # doctest: +NORMALIZE_WHITESPACE
+    [('evictions', 1), ('hits', 1), ('invalidations', 2),
+     ('misses', 1), ('size', 0)]
+
+    With ``ttl``, entries expire after that many seconds, as measured
+    by ``clock``. This bounds the staleness caused by changes that
+    :meth:`invalidate` isn't told about, such as those of other processes:
+
+    >>> now = [0]
+    >>> cache = QuantityCache(ttl=10, clock=lambda: now[0])
+    >>> cache.set('a', 3)
+    >>> now[0] = 9
+    >>> cache.get('a')
+    3
+    >>> now[0] = 10
+    >>> cache.get('a') is None
+    True
+    >>> len(cache)
+    0
+
+    Subclasses or any object providing the same methods can be used
+    instead, e.g., to share invalidations between processes.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self):
+        return self.entries.keys()
+
+    def get(self, key, default=None):
+        """Return the cached value for ``key``, updating LRU and counters."""
+        entry = self.entries.get(key)
+        if entry is not None and entry[3] is not None and \
+                self.clock() >= entry[3]:
+            del self.entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def set(self, key, value, type_id=None, location_ids=None):
+        """Store a value, together with its dependencies.
+
+        :param type_id: id of the PhysObj Type the value is about, or
+                        ``None`` if it is about all Types.
+        :param location_ids: ids of all locations the value depends on,
+                             or ``None`` if it depends on all of them.
+        """
+        if location_ids is not None:
+            location_ids = frozenset(location_ids)
+        expiry = None if self.ttl is None else self.clock() + self.ttl
+        self.entries[key] = (value, type_id, location_ids, expiry)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, changes, container_location_ids=()):
+        """Discard entries affected by some changes.
+
+        :param changes: iterable of pairs (location id, Type id)
+        :param container_location_ids: ids of locations in which containers
+                                       changed. They affect entries
+                                       depending on these locations
+                                       for all Types.
+        """
+        changes = set(changes)
+        container_location_ids = set(container_location_ids)
+        if not changes and not container_location_ids:
+            return
+
+        def affected(type_id, location_ids):
+            if location_ids is None:
+                if type_id is None or container_location_ids:
+                    return True
+                return any(ch_type_id == type_id for _, ch_type_id in changes)
+            if not location_ids.isdisjoint(container_location_ids):
+                return True
+            return any(loc_id in location_ids and
+                       (type_id is None or ch_type_id == type_id)
+                       for loc_id, ch_type_id in changes)
+
+        for key in [key for key, (_, type_id, location_ids, _)
+                    in self.entries.items()
+                    if affected(type_id, location_ids)]:
+            del self.entries[key]
+            self.invalidations += 1
+
+    def clear(self):
+        """Discard all entries (counters are kept)."""
+        self.entries.clear()
+
+    def stats(self):
+        """Return counters and current size in a :class:`dict`."""
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    invalidations=self.invalidations,
+                    size=len(self.entries))
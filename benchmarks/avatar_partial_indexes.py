@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# This file is a part of the AnyBlok / WMS Base project
+#
+#    Copyright (C) 2018 Georges Racinet <gracinet@anybox.fr>
+#
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file,You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+"""Benchmark the partial indexes on Avatars on a history-heavy dataset.
+
+This needs a database in which ``wms-core`` is installed, whose name is
+passed as for all AnyBlok scripts, e.g., with the ``ANYBLOK_DATABASE_NAME``
+and ``ANYBLOK_DATABASE_DRIVER`` environment variables.
+
+The dataset is generated in SQL, directly in the tables, bypassing
+Operations: each PhysObj has ``--history`` past Avatars and one present
+Avatar, spread over ``--locations`` locations. Hot queries are then timed
+with the partial indexes, and after having dropped them, in ``--rounds``
+rounds that alternate the order of these two variants, so that none of them
+systematically runs on caches warmed up by the other. The best duration of
+all runs is kept for each query and variant.
+
+Everything happens in a transaction that is rolled back at the end:
+the database is left untouched.
+"""
+import sys
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import anyblok
+from sqlalchemy import text
+
+DT_START = datetime(2018, 1, 1)
+
+
+def generate(registry, nb_goods, history, nb_locations):
+    """Insert the dataset, return locations, Type and reasons."""
+    Wms = registry.Wms
+    PhysObj = Wms.PhysObj
+    loc_type = PhysObj.Type.insert(code='BENCH-LOC',
+                                   behaviours=dict(container={}))
+    goods_type = PhysObj.Type.insert(code='BENCH-GOODS')
+    root = Wms.create_root_container(loc_type, code='BENCH-ROOT')
+    reasons = [Wms.Operation.Arrival.insert(goods_type=goods_type,
+                                            location=root,
+                                            dt_execution=DT_START,
+                                            state='done')
+               for _ in range(history + 1)]
+    locations = [root]
+    for i in range(nb_locations - 1):
+        loc = Wms.create_root_container(loc_type, code='BENCH-%d' % i)
+        PhysObj.Avatar.insert(obj=loc, location=root, state='present',
+                              dt_from=DT_START, reason=reasons[0])
+        locations.append(loc)
+    registry.flush()
+
+    obj_ids = [r[0] for r in registry.execute(
+        text("INSERT INTO wms_physobj (type_id) "
+             "SELECT :type_id FROM generate_series(1, :nb) RETURNING id"),
+        dict(type_id=goods_type.id, nb=nb_goods)).fetchall()]
+    # step i of history happens at DT_START + i hours, in a location
+    # that changes at each step. The last step is the present one.
+    registry.execute(
+        text("INSERT INTO wms_physobj_avatar "
+             "(obj_id, state, location_id, dt_from, dt_until, reason_id) "
+             "SELECT obj.id, "
+             "       CASE WHEN step = :history THEN 'present' "
+             "            ELSE 'past' END, "
+             "       (:loc_ids)[1 + (obj.id + step) % :nb_locs], "
+             "       :dt_start + step * interval '1 hour', "
+             "       CASE WHEN step = :history THEN NULL "
+             "            ELSE :dt_start + (step + 1) * interval '1 hour' "
+             "       END, "
+             "       (:reason_ids)[1 + step] "
+             "FROM unnest(:obj_ids) AS obj(id), "
+             "     generate_series(0, :history) AS step"),
+        dict(history=history,
+             loc_ids=[loc.id for loc in locations],
+             nb_locs=len(locations),
+             dt_start=DT_START,
+             reason_ids=[op.id for op in reasons],
+             obj_ids=obj_ids))
+    registry.execute(text("ANALYZE wms_physobj_avatar"))
+    return locations, goods_type, reasons, obj_ids
+
+
+def timeit(func, repeat):
+    """Return the best duration of ``repeat`` calls to ``func``, in ms."""
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        duration = (perf_counter() - start) * 1000
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def hot_queries(registry, locations, goods_type, reasons, obj_ids):
+    """Return the queries to time, as a list of (label, callable)."""
+    Wms = registry.Wms
+    Avatar = Wms.PhysObj.Avatar
+    end = DT_START + timedelta(days=3650)
+    root, loc = locations[0], locations[-1]
+    return [
+        ("quantity, recursive",
+         lambda: Wms.quantity(location=root, goods_type=goods_type)),
+        ("quantity, direct location",
+         lambda: Wms.quantity(location=loc, goods_type=goods_type,
+                              location_recurse=False)),
+        ("quantity, future at date",
+         lambda: Wms.quantity(location=loc, goods_type=goods_type,
+                              location_recurse=False,
+                              additional_states=['future'],
+                              at_datetime=end)),
+        ("outcomes of an old Operation",
+         lambda: reasons[0].outcomes),
+        ("present Avatars of PhysObj",
+         lambda: Avatar.query().filter(Avatar.obj_id.in_(obj_ids[:100]),
+                                       Avatar.state == 'present').all()),
+    ]
+
+
+def time_queries(registry, queries, repeat, with_indexes):
+    """Time the given queries, return their best durations, in ms.
+
+    :param bool with_indexes: if ``False``, the partial indexes are
+                              dropped in a savepoint, rolled back
+                              afterwards.
+    """
+    if with_indexes:
+        return [timeit(q, repeat) for _, q in queries]
+
+    registry.execute(text("SAVEPOINT bench_drop"))
+    try:
+        for name, _ in registry.Wms.PhysObj.Avatar.NOT_PAST_INDEXES:
+            registry.execute(text("DROP INDEX %s" % name))
+        registry.execute(text("ANALYZE wms_physobj_avatar"))
+        return [timeit(q, repeat) for _, q in queries]
+    finally:
+        registry.execute(text("ROLLBACK TO SAVEPOINT bench_drop"))
+
+
+def run(registry, arguments):
+    print("Generating %d PhysObj with %d past Avatars each "
+          "in %d locations" % (arguments.goods, arguments.history,
+                               arguments.locations))
+    data = generate(registry, arguments.goods, arguments.history,
+                    arguments.locations)
+    queries = hot_queries(registry, *data)
+
+    best = {True: [], False: []}
+    for i in range(arguments.rounds):
+        order = (True, False) if i % 2 == 0 else (False, True)
+        for with_indexes in order:
+            durations = time_queries(registry, queries, arguments.repeat,
+                                     with_indexes)
+            best[with_indexes] = [min(pair) for pair in zip(
+                best[with_indexes], durations)] or durations
+
+    print()
+    print("%-32s %12s %12s %8s" % (
+        "Query (best of %d)" % (arguments.repeat * arguments.rounds),
+        "without (ms)", "with (ms)", "gain"))
+    for (label, _), without, with_ in zip(queries, best[False], best[True]):
+        print("%-32s %12.2f %12.2f %7.1fx" % (label, without, with_,
+                                              without / with_))
+
+
+def main():
+    parser = ArgumentParser(description=__doc__,
+                            formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--goods', type=int, default=10000,
+                        help="Number of PhysObj to generate")
+    parser.add_argument('--history', type=int, default=20,
+                        help="Number of past Avatars of each PhysObj")
+    parser.add_argument('--locations', type=int, default=50,
+                        help="Number of locations")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="Number of consecutive runs of each query "
+                        "in each round")
+    parser.add_argument('--rounds', type=int, default=4,
+                        help="Number of rounds, alternately starting "
+                        "with and without the partial indexes")
+    arguments = parser.parse_args()
+
+    # let AnyBlok read its own configuration from environment only
+    sys.argv[1:] = []
+    registry = anyblok.start('wms-bench', loadwithoutmigration=True)
+    if registry is None:
+        parser.error("No database to work on. Please set the "
+                     "ANYBLOK_DATABASE_NAME environment variable")
+    try:
+        run(registry, arguments)
+    finally:
+        registry.rollback()
+        registry.close()
+
+
+if __name__ == '__main__':
+    main()
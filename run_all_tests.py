@@ -79,6 +79,14 @@ def run(cr, db_name, nose_additional_opts):
     nosetests((os.path.join(bloks_dir, 'reservation'),
                ),
               nose_additional_opts)
+    install_bloks('wms-container-closure')
+    nosetests((os.path.join(bloks_dir, 'container_closure'),
+               ),
+              nose_additional_opts)
+    install_bloks('wms-stock-ledger')
+    nosetests((os.path.join(bloks_dir, 'stock_ledger'),
+               ),
+              nose_additional_opts)
     dropdb(cr, db_name)
     createdb('wms-quantity')
     nosetests((os.path.join(bloks_dir, 'quantity'),
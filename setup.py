@@ -35,6 +35,8 @@ bloks = {
     'wms-core': 'core:WmsCore',
     'wms-reservation': 'reservation:WmsReservation',
     'wms-quantity': 'quantity:WmsQuantity',
+    'wms-container-closure': 'container_closure:WmsContainerClosure',
+    'wms-stock-ledger': 'stock_ledger:WmsStockLedger',
     # Too simple for use outside of tests, yet we don't want to
     # use DBTestCase which means droping and creating all the time
     'test-wms-goods-batch-ref': 'test_bloks:PhysObjBatchRef'